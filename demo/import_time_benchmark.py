@@ -0,0 +1,58 @@
+#  Copyright (c) 2020 RumorMill (https://chandlersong.me)
+#  Copyright (c) 2020 chandler.song
+#
+#  Licensed under the GNU GENERAL PUBLIC LICENSE v3.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       https://www.gnu.org/licenses/gpl-3.0.html
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import subprocess
+import sys
+import unittest
+from unittest import TestCase
+
+MODULES = ["greenseer.configuration",
+           "greenseer.repository",
+           "greenseer.repository.china_stock",
+           "greenseer.dataset.china_dataset",
+           "greenseer.utils.tools",
+           "greenseer.utils.score",
+           "greenseer.preprocessing.clean_data",
+           "greenseer.preprocessing.transformers",
+           "greenseer.models.cash_models",
+           "greenseer.plots.knife_plots"]
+
+REPEAT = 5
+
+MEASURE_SCRIPT = "import time;start = time.perf_counter();import {};print(time.perf_counter() - start)"
+
+
+def measure_import_seconds(module: str, repeat=REPEAT) -> float:
+    """
+    import the module in a new interpreter each time, so nothing is cached in sys.modules
+    :return: the best seconds of all the runs
+    """
+    seconds = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", MEASURE_SCRIPT.format(module)], check=True,
+                                stdout=subprocess.PIPE, universal_newlines=True).stdout
+        seconds.append(float(output.strip().splitlines()[-1]))
+    return min(seconds)
+
+
+class TestImportTime(TestCase):
+
+    def test_import_time_of_each_module(self):
+        for module in MODULES:
+            print("{:<45}{:>8.1f} ms".format(module, measure_import_seconds(module) * 1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+#  Copyright (c) 2020 RumorMill (https://chandlersong.me)
+#  Copyright (c) 2020 chandler.song
+#
+#  Licensed under the GNU GENERAL PUBLIC LICENSE v3.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       https://www.gnu.org/licenses/gpl-3.0.html
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import unittest
+from logging.config import fileConfig
+from unittest import TestCase
+
+from greenseer.repository import ParquetLocalData
+from greenseer.repository.china_stock import migrate_china_stock_reports, compact_china_stock_reports
+
+
+class TestMigrateReports(TestCase):
+
+    def test_migrate_to_parquet(self):
+        fileConfig('logging_config.ini')
+        total = migrate_china_stock_reports(base_folder="allReportsData", local_source_type=ParquetLocalData)
+        print("{} reports has been migrated".format(total))
+
+    def test_compact_to_segment(self):
+        fileConfig('logging_config.ini')
+        total = compact_china_stock_reports(base_folder="allReportsData")
+        print("{} reports has been compacted".format(total))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#  Copyright (c) 2020 GreenSeer (https://chandlersong.me)
+#  Copyright (c) 2020 chandler.song
+#
+#  Licensed under the GNU GENERAL PUBLIC LICENSE v3.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       https://www.gnu.org/licenses/gpl-3.0.html
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import glob
+import io
+import os
+import timeit
+import unittest
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from greenseer.repository.china_stock import parse_net_ease_report, NET_EASE_ENCODE
+
+# put the responses of NetEase here, like zcfzb_600096.csv, to benchmark with the real payloads
+RECORDED_PAYLOAD_FOLDER = "netEasePayloads"
+
+SAMPLE_REPORT = "../tests/data/600096_assert_report.gz"
+
+REPEAT = 200
+
+
+def parse_by_read_csv(payload: bytes) -> pd.DataFrame:
+    """
+    the parser before parse_net_ease_report
+    """
+    local = pd.read_csv(io.BytesIO(payload), encoding=NET_EASE_ENCODE, na_values='--', index_col=0)
+    return local.drop(local.columns[len(local.columns) - 1], axis=1).fillna(0).apply(pd.to_numeric,
+                                                                                     errors='coerce')
+
+
+def create_sample_payload(na_ratio=0.2) -> bytes:
+    """
+    a payload like NetEase from the sample report, some cells are "--" and each row ends with a comma
+    """
+    report = pd.read_csv(SAMPLE_REPORT, index_col=0)
+    report = report.drop(columns=report.columns[-1]).fillna(0)
+    cells = report.astype(np.int64).astype(str)
+    cells = cells.mask(np.random.random(cells.shape) < na_ratio, "--")
+    lines = [",".join(["报告日期"] + list(report.columns)) + ","]
+    lines.extend(",".join([item] + list(row)) + "," for item, row in zip(report.index, cells.values))
+    return "\r\n".join(lines).encode(NET_EASE_ENCODE, errors="replace")
+
+
+def load_payloads() -> list:
+    paths = sorted(glob.glob(os.path.join(RECORDED_PAYLOAD_FOLDER, "*.csv")))
+    if len(paths) == 0:
+        return [create_sample_payload()]
+    payloads = []
+    for path in paths:
+        with open(path, "rb") as file:
+            payloads.append(file.read())
+    return payloads
+
+
+class TestNetEaseParser(TestCase):
+
+    def test_same_result(self):
+        for payload in load_payloads():
+            pd.testing.assert_frame_equal(parse_by_read_csv(payload), parse_net_ease_report(payload),
+                                          check_dtype=False, check_names=False)
+
+    def test_parse_speed(self):
+        payloads = load_payloads()
+        for name, parse in [("read_csv + apply(to_numeric)", parse_by_read_csv),
+                            ("parse_net_ease_report", parse_net_ease_report)]:
+            seconds = min(timeit.repeat(lambda: [parse(payload) for payload in payloads], number=REPEAT, repeat=3))
+            print("{:<35}{:>8.3f} ms per payload".format(name, seconds / REPEAT / len(payloads) * 1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
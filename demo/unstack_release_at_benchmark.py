@@ -0,0 +1,90 @@
+#  Copyright (c) 2020 GreenSeer (https://chandlersong.me)
+#  Copyright (c) 2020 chandler.song
+#
+#  Licensed under the GNU GENERAL PUBLIC LICENSE v3.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       https://www.gnu.org/licenses/gpl-3.0.html
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import time
+import unittest
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from greenseer.dataset.china_dataset import CODE_INDEX_NAME, RELEASE_AT_INDEX_NAME
+from greenseer.preprocessing.transformers import unstack_release_at
+
+# about the whole china market, 20 years of quarterly reports
+STOCK_COUNT = 4000
+
+REPORT_COUNT = 80
+
+
+def unstack_by_loop(X: pd.DataFrame, start: str, end: str, column_name: str,
+                    drop_if_contain_na: bool = True) -> pd.DataFrame:
+    """
+    unstack_release_at before it unstacks the whole column
+    """
+    stock_ids = X.index.levels[0]
+    pending_array = []
+    idx = pd.IndexSlice
+    X = X.loc[idx[:, start:end], :]
+    for stock_id in stock_ids:
+        try:
+            one_stock = X.loc[stock_id]
+        except KeyError:
+            continue
+        one_stock = one_stock[column_name].to_frame().T
+        one_stock.index = [stock_id]
+        pending_array.append(one_stock)
+    result = pd.concat(pending_array)
+    if drop_if_contain_na:
+        result = result.dropna()
+    result.index.set_names([CODE_INDEX_NAME], inplace=True)
+    return result
+
+
+def create_market(stock_count=STOCK_COUNT, report_count=REPORT_COUNT, listed_ratio=0.3) -> pd.DataFrame:
+    """
+    every stock starts to report at a random quarter, like the stocks listed in different years
+    """
+    dates = pd.date_range("20000331", periods=report_count, freq="Q")
+    stocks = ["{:06d}".format(code) for code in range(stock_count)]
+    first_reports = np.random.randint(0, int(report_count * listed_ratio) + 1, stock_count)
+    codes = np.repeat(stocks, report_count - first_reports)
+    release_at = np.concatenate([dates[first:] for first in first_reports])
+    index = pd.MultiIndex.from_arrays([codes, release_at], names=[CODE_INDEX_NAME, RELEASE_AT_INDEX_NAME])
+    return pd.DataFrame({"x": np.random.random(len(index)), "y": np.random.random(len(index))}, index=index)
+
+
+class TestUnstackReleaseAt(TestCase):
+
+    def test_same_result(self):
+        market = create_market(stock_count=200)
+        for drop_if_contain_na in [True, False]:
+            expected = unstack_by_loop(market, "2010-01-01", "2019-12-31", "x", drop_if_contain_na)
+            actual = unstack_release_at(start="2010-01-01", end="2019-12-31", column_name="x",
+                                        drop_if_contain_na=drop_if_contain_na).transform(market)
+            pd.testing.assert_frame_equal(expected, actual, check_names=False, check_freq=False)
+
+    def test_unstack_speed(self):
+        market = create_market()
+        transform = unstack_release_at(start="2005-01-01", end="2019-12-31", column_name="x")
+        for name, unstack in [("loop of stocks", lambda: unstack_by_loop(market, "2005-01-01", "2019-12-31", "x")),
+                              ("unstack_release_at", lambda: transform.transform(market))]:
+            begin = time.perf_counter()
+            result = unstack()
+            print("{:<25}{:>10.3f} s, {} stocks".format(name, time.perf_counter() - begin, len(result)))
+
+
+if __name__ == '__main__':
+    unittest.main()
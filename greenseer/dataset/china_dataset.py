@@ -13,18 +13,26 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import hashlib
+import json
 import logging
+import math
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from functools import partial
+from itertools import islice
 
 import numpy as np
 import pandas as pd
-import tushare as ts
-from sklearn.model_selection import train_test_split
 
-from greenseer.repository import ReportLocalData
+from greenseer.repository import ReportLocalData, ReportCache, WriteBehindLocalData, NegativeCache, \
+    read_json_lines, append_json_line, rewrite_json_lines
 from greenseer.repository.china_stock import create_china_stock_assert_repository, create_china_stock_income_repository, \
     create_china_stock_cash_repository, ChinaAssertRepository, ChinaIncomeRepository, ChinaCashRepository, \
-    get_global_basic_info_repository
+    get_global_basic_info_repository, create_china_stock_negative_cache
+from greenseer.utils.rate_limiter import TokenBucketRateLimiter, RandomDelayLimiter
 
 ASSERT_REPORT = "assert"
 
@@ -40,24 +48,76 @@ CODE_INDEX_NAME = "code"
 
 RELEASE_AT_INDEX_NAME = "releaseAt"
 
+DEFAULT_MAX_WORKERS = 4
+
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+DEFAULT_FETCH_CHUNK_SIZE = 200
+
+MAX_PROCESS_BATCH_SIZE = 100
+
 
 class ChinaReportRepository:
-    _fields = ["_assert", "_income", "_cash", "_stock_info", "_local_path"]
+    _fields = ["_assert", "_income", "_cash", "_stock_info", "_local_path", "_local_source_type", "_cache",
+               "_negative_cache"]
 
-    def __init__(self):
+    def __init__(self, local_path=DEFAULT_LOCAL_PATH, local_source_type=ReportLocalData):
         self._stock_info = None
         self._assert = None
         self._cash = None
         self._income = None
-        self._local_path = DEFAULT_LOCAL_PATH
-        self.refresh(DEFAULT_LOCAL_PATH)
-
-    def refresh(self, local_path):
+        self._local_path = local_path
+        self._local_source_type = local_source_type
+        self._cache = None
+        self._negative_cache = None
+        self.refresh(local_path, local_source_type)
+
+    def refresh(self, local_path, local_source_type=ReportLocalData, write_behind=False):
+        """
+        :param local_path: the root folder of the reports
+        :param local_source_type: how the reports are kept in local
+        :param write_behind: write the reports fetched from remote in background threads, call flush to wait them
+        """
+        self.close()
+        source_type = partial(_create_write_behind_source, local_source_type) if write_behind else local_source_type
         self._stock_info = get_global_basic_info_repository()
-        self._assert = create_china_stock_assert_repository(base_folder=local_path)
-        self._income = create_china_stock_income_repository(base_folder=local_path)
-        self._cash = create_china_stock_cash_repository(base_folder=local_path)
+        self._assert = create_china_stock_assert_repository(base_folder=local_path, local_source_type=source_type)
+        self._income = create_china_stock_income_repository(base_folder=local_path, local_source_type=source_type)
+        self._cash = create_china_stock_cash_repository(base_folder=local_path, local_source_type=source_type)
         self._local_path = local_path
+        self._local_source_type = local_source_type
+        self._negative_cache = create_china_stock_negative_cache(local_path)
+        if self._cache is not None:
+            self._cache.clear()
+        self.__share_cache()
+
+    def enable_cache(self, max_bytes):
+        """
+        cache the decoded reports in memory. the three reports share one cache, so max_bytes is the total budget
+        :param max_bytes: max bytes of all the cached reports. None will disable the cache
+        """
+        self._cache = None if max_bytes is None else ReportCache(max_bytes)
+        self.__share_cache()
+
+    def flush(self):
+        """
+        wait all the reports written to local, only useful when write_behind is enabled
+        """
+        for local_source in self.__write_behind_sources():
+            local_source.flush()
+
+    def close(self):
+        for local_source in self.__write_behind_sources():
+            local_source.close()
+
+    def __write_behind_sources(self):
+        return [report.local_source for report in [self._assert, self._income, self._cash]
+                if report is not None and isinstance(report.local_source, WriteBehindLocalData)]
+
+    def __share_cache(self):
+        for report in [self._assert, self._income, self._cash]:
+            report.cache = self._cache
+            report.negative_cache = self._negative_cache
 
     @property
     def assert_report(self) -> ChinaAssertRepository:
@@ -79,27 +139,202 @@ class ChinaReportRepository:
     def local_path(self) -> str:
         return self._local_path
 
+    @property
+    def local_source_type(self) -> type:
+        return self._local_source_type
+
+    @property
+    def cache(self) -> ReportCache:
+        return self._cache
+
+    @property
+    def negative_cache(self) -> NegativeCache:
+        """
+        the stocks NetEase has no report for, they are skipped until expired.
+        call negative_cache.clear() to fetch them again at once
+        """
+        return self._negative_cache
+
+
+def _create_write_behind_source(local_source_type, folder) -> WriteBehindLocalData:
+    return WriteBehindLocalData(local_source_type(folder))
 
-_repository = ChinaReportRepository()
+
+_repository = None
 
 _logger = logging.getLogger()
 
-_local_all_reports_repo = ReportLocalData(DEFAULT_LOCAL_PATH + "/chinaReports")
+_local_all_reports_repo = None
+
+_default_targets = None
 
 _ALL_REPORTS_NAME = "all_finance_reports"
 
+_FETCH_ALL_JOURNAL_FOLDER = "fetch_all_journal"
+
+
+class FetchAllJournal:
+    """
+    the checkpoint of fetch_all. each chunk of stocks is written to a partition file as soon as it's loaded,
+    then the chunk is appended to the journal. if fetch_all is broken, the next call skips the stocks in the journal.
+    at last, the partitions are assembled into all_finance_reports one by one, and the journal is removed.
+
+    the first line of the journal is the parameters of the run. the journal of a run with other parameters
+    can't be resumed, it's discarded with its partitions.
+    """
+
+    JOURNAL_NAME = "journal.jsonl"
+
+    PART_FORMAT = "part-{:05d}"
+
+    def __init__(self, folder, parameters: dict = None):
+        """
+
+        :param folder: folder of the journal and the partitions
+        :param parameters: parameters of the run, they must be serializable by json
+        """
+        self.__folder = folder
+        # compare with what is read back from the journal
+        self.__parameters = json.loads(json.dumps(parameters or {}))
+        self.__journal_path = os.path.join(folder, self.JOURNAL_NAME)
+        self.__done_stocks = set()
+        self.__parts = []
+        self.__chunks = 0
+        if os.path.exists(self.__journal_path) and not self.__read():
+            _logger.warning("the parameters of fetch_all are changed, discard the journal in {}".format(folder))
+            shutil.rmtree(folder)
+        self.__parts_source = ReportLocalData(folder)
+        if not os.path.exists(self.__journal_path):
+            rewrite_json_lines(self.__journal_path, [{"parameters": self.__parameters}])
+
+    @property
+    def folder(self):
+        return self.__folder
+
+    @property
+    def done_stocks(self) -> set:
+        return self.__done_stocks
+
+    @property
+    def parts(self) -> list:
+        return self.__parts
+
+    def record(self, stock_ids, data: pd.DataFrame):
+        """
+        write the chunk to a partition, then mark the stocks done
+
+        :param stock_ids: the stocks of the chunk
+        :param data: the reports of the stocks, index by code and releaseAt
+        """
+        part = None
+        if not data.empty:
+            part = self.PART_FORMAT.format(self.__chunks)
+            data = data.rename_axis([CODE_INDEX_NAME, RELEASE_AT_INDEX_NAME]).reset_index()
+            self.__parts_source.refresh_data(data.astype({CODE_INDEX_NAME: str}), part)
+            self.__parts.append(part)
+        stock_ids = [str(stock_id) for stock_id in stock_ids]
+        append_json_line(self.__journal_path, {"part": part, "stocks": stock_ids})
+        self.__done_stocks.update(stock_ids)
+        self.__chunks += 1
+
+    def assemble(self, target: ReportLocalData, identify):
+        """
+        write all the partitions into one record of target, only one partition is in memory at the same time
+        """
+        columns = self.__columns()
+        if len(self.__parts) == 0:
+            chunks = [pd.DataFrame(columns=columns)]
+        else:
+            chunks = (self.__parts_source.load_data(part, dtype={CODE_INDEX_NAME: str}, parse_dates=False)
+                      .reindex(columns=columns)
+                      for part in self.__parts)
+        target.refresh_data_in_chunks(chunks, identify)
+
+    def remove(self):
+        shutil.rmtree(self.__folder)
+
+    def __columns(self) -> pd.Index:
+        """
+        the union of the columns of all the partitions, in the order they appear like pd.concat.
+        only the header of each partition is read
+        """
+        columns = pd.Index([CODE_INDEX_NAME, RELEASE_AT_INDEX_NAME])
+        for part in self.__parts:
+            header = pd.read_csv(self.__parts_source.file_format.format(part), index_col=0, nrows=0,
+                                 compression="gzip").columns
+            columns = columns.append(header.difference(columns, sort=False))
+        return columns
+
+    def __read(self) -> bool:
+        """
+        :return: False if the journal is written by a run with other parameters
+        """
+        entries = read_json_lines(self.__journal_path)
+        if len(entries) == 0 or entries[0].get("parameters") != self.__parameters:
+            return False
+        for entry in entries[1:]:
+            if entry["part"] is not None:
+                self.__parts.append(entry["part"])
+            self.__done_stocks.update(entry["stocks"])
+            self.__chunks += 1
+        _logger.info("resume fetch_all, {} stocks has been done".format(len(self.__done_stocks)))
+        return True
+
+
+def get_repository() -> ChinaReportRepository:
+    """
+    the global repository, it's created at the first call. so importing this module won't touch the disk or network
+    """
+    global _repository
+    if _repository is None:
+        _repository = ChinaReportRepository()
+    return _repository
 
-def stock_info(repository=_repository) -> pd.DataFrame:
-    return repository.stock_info
 
+def _resolve_repository(repository) -> ChinaReportRepository:
+    return get_repository() if repository is None else repository
 
-def set_local_path(local_path: str):
-    _repository.refresh(local_path)
+
+def _get_local_all_reports_repo() -> ReportLocalData:
+    global _local_all_reports_repo
+    if _local_all_reports_repo is None:
+        _local_all_reports_repo = ReportLocalData(get_repository().local_path + "/chinaReports")
+    return _local_all_reports_repo
+
+
+def stock_info(repository=None) -> pd.DataFrame:
+    return _resolve_repository(repository).stock_info
+
+
+def set_local_path(local_path: str, local_source_type=ReportLocalData, write_behind=False):
+    """
+    :param local_path: the root folder of all the local data
+    :param local_source_type: how the reports are kept in local, like ReportLocalData or ParquetLocalData
+    :param write_behind: write the reports in background threads, so fetching from remote won't wait for the disk
+    """
+    get_repository().refresh(local_path, local_source_type, write_behind)
     global _local_all_reports_repo
     _local_all_reports_repo = ReportLocalData(local_path + "/chinaReports")
 
 
-def load_train_data(train_size=10, reload=False, force_remote=False, repository=_repository) -> (
+def enable_report_cache(max_bytes=DEFAULT_CACHE_MAX_BYTES, repository=None):
+    """
+    keep the reports in memory after they are loaded from local, it's useful when load the same stocks again and again.
+    :param max_bytes: memory budget of the cache, None will disable it
+    :param repository: repository
+    """
+    _resolve_repository(repository).enable_cache(max_bytes)
+
+
+def report_cache_info(repository=None) -> dict:
+    """
+    :return: hits, misses and size of the report cache. empty if the cache isn't enabled
+    """
+    cache = _resolve_repository(repository).cache
+    return {} if cache is None else cache.info()
+
+
+def load_train_data(train_size=10, reload=False, force_remote=False, repository=None) -> (
         pd.DataFrame, pd.DataFrame):
     """
     FUTUREIMPROVE: add target here
@@ -107,69 +342,259 @@ def load_train_data(train_size=10, reload=False, force_remote=False, repository=
     the trains_size and test_size, please refer to the train_test_split in sklearn
     :return: Train set, Test test
     """
-    stock_ids = repository.stock_info.index.astype(str)
+    from sklearn.model_selection import train_test_split
+
+    stock_ids = stock_info(repository).index.astype(str)
 
     if train_size is not None:
         train_index, _ = train_test_split(stock_ids, train_size=train_size, test_size=0)
-        result = fetch_multi_report(train_index)
+        result = load_multi_data(train_index, repository=repository)
         result = result.rename_axis([CODE_INDEX_NAME, RELEASE_AT_INDEX_NAME])
         return result
     else:
-        return fetch_all(reload=reload, force_remote=force_remote)
+        return fetch_all(reload=reload, force_remote=force_remote, repository=repository)
 
 
-def load_multi_data(stock_ids: np.array, force_remote=False, repository=_repository,
-                    max_sleep_seconds=5) -> pd.DataFrame:
+def load_multi_data(stock_ids: np.array, force_remote=False, repository=None,
+                    max_sleep_seconds=5, requests_per_second=None, max_workers=None,
+                    incremental=False, n_jobs=None) -> pd.DataFrame:
     """
     the main purpose is for load stock data in batch for ml.
     so I will try split data into here
 
+    if requests_per_second is provided, the stocks will be loaded by a thread pool. all the threads share one
+    token bucket instead of sleeping a random time before each remote call.
+
+    if n_jobs is provided, the stocks in local will be decoded by a process pool, it's for loading the local reports
+    on a machine with many cores. each process creates its own repository with the same local path, and sends back
+    the reports as one arrow buffer for each batch of stocks. the processes never write the local sources,
+    the stocks not in local or force_remote are fetched by the calling process one by one, with the random sleep.
+
     :param max_sleep_seconds:
     :param stock_ids: stock id list
     :param force_remote: force to load from remote
-    :param repository: repository
+    :param repository: repository, the global one if it's None
+    :param requests_per_second: global limit of remote calls
+    :param max_workers: max stocks loading at the same time. the reports of each stock are loaded one by one
+                        in the pool, so it's also the cap of in-flight remote calls.
+                        default is 4 when requests_per_second is provided
+    :param incremental: only write the new or changed quarters when force_remote
+    :param n_jobs: processes to decode the reports, it can't be used with requests_per_second
     :return:
     """
+    if n_jobs is not None and n_jobs > 1:
+        if requests_per_second is not None:
+            raise ValueError("n_jobs can't be used with requests_per_second, the processes can't share the limit")
+        return _load_multi_data_in_processes(stock_ids, force_remote, repository, max_sleep_seconds, incremental,
+                                             n_jobs)
+
+    if requests_per_second is None:
+        return pd.concat([load_by_stock_id(stock, force_remote, repository, max_sleep_seconds,
+                                           incremental=incremental) for stock in stock_ids])
+
+    rate_limiter = TokenBucketRateLimiter(requests_per_second)
+    with ThreadPoolExecutor(max_workers=max_workers or DEFAULT_MAX_WORKERS) as executor:
+        return pd.concat(executor.map(
+            lambda stock: load_by_stock_id(stock, force_remote, repository, None, rate_limiter, incremental,
+                                           concurrent=False),
+            stock_ids))
+
+
+def iter_multi_data(stock_ids: np.array, batch_size=1, prefetch=1, force_remote=False, repository=None,
+                    max_sleep_seconds=5, incremental=False):
+    """
+    the streaming version of load_multi_data, the reports are yielded batch by batch, so the memory doesn't grow
+    with the stocks. the row wise transformers, like pick_annual_report_china or re_sum_column_transform, can be
+    applied to each batch, then only the result need to be kept.
 
-    return pd.concat([load_by_stock_id(stock, force_remote, repository, max_sleep_seconds) for stock in stock_ids])
+    :param stock_ids: stock id list
+    :param batch_size: stocks of each batch
+    :param prefetch: batches loaded in background while the current one is being used, 0 to load on demand
+    :param force_remote: force to load from remote
+    :param repository: repository, the global one if it's None
+    :param max_sleep_seconds: the random sleep before the remote calls of each stock
+    :param incremental: only write the new or changed quarters when force_remote
+    :return: generator of data frames index by (code, releaseAt), in the order of stock_ids
+    """
+    stock_ids = list(stock_ids)
+    batches = (stock_ids[i:i + batch_size] for i in range(0, len(stock_ids), batch_size))
+
+    def load_batch(batch):
+        return load_multi_data(batch, force_remote, repository, max_sleep_seconds, incremental=incremental) \
+            .rename_axis([CODE_INDEX_NAME, RELEASE_AT_INDEX_NAME])
+
+    if prefetch <= 0:
+        for batch in batches:
+            yield load_batch(batch)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=prefetch)
+    pending = deque()
+    try:
+        pending.extend(executor.submit(load_batch, batch) for batch in islice(batches, prefetch + 1))
+        while len(pending) > 0:
+            result = pending.popleft().result()
+            for batch in islice(batches, 1):
+                pending.append(executor.submit(load_batch, batch))
+            yield result
+    finally:
+        # the caller may stop early, the batches not started are useless.
+        # cancel them one by one, shutdown(cancel_futures=True) needs python 3.9
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def load_panel(stock_ids: np.array, batch_size=100, prefetch=1, force_remote=False, repository=None,
+               max_sleep_seconds=5, dtype=np.float64):
+    """
+    load the reports of the stocks as a ReportPanel, the batches are put into the panel directly
+    without concat them into one data frame first
+
+    :param dtype: dtype of the panel, float32 saves half of the memory
+    :return: ReportPanel, stock x report date x item
+    """
+    from greenseer.dataset.panel import ReportPanel
 
+    return ReportPanel.from_frames(iter_multi_data(stock_ids, batch_size, prefetch, force_remote, repository,
+                                                   max_sleep_seconds), dtype)
 
-def fetch_all(reload=False, force_remote=False, repository=_repository, max_sleep_seconds=5) -> pd.DataFrame:
+
+def _load_multi_data_in_processes(stock_ids, force_remote, repository, max_sleep_seconds, incremental,
+                                  n_jobs) -> pd.DataFrame:
+    """
+    the processes only read the local reports. the local sources, the manifest and the negative cache can't be
+    written by many processes at the same time, so the stocks need to be fetched are loaded by this process
+    while the others are being decoded
+    """
+    repository = _resolve_repository(repository)
+    stock_ids = list(stock_ids)
+    # several batches for each process, so a slow batch won't keep the others idle
+    batch_size = max(1, min(MAX_PROCESS_BATCH_SIZE, math.ceil(len(stock_ids) / (n_jobs * 4))))
+    reports = [repository.assert_report, repository.income_report, repository.cash_report]
+
+    # the runs of the stocks in local and the runs need to be fetched, in the order of stock_ids
+    batches = []
+    for stock_id in stock_ids:
+        in_local = not force_remote and all(report.local_source.exist(stock_id) for report in reports)
+        if len(batches) > 0 and batches[-1][0] == in_local and len(batches[-1][1]) < batch_size:
+            batches[-1][1].append(stock_id)
+        else:
+            batches.append((in_local, [stock_id]))
+
+    load_batch = partial(_load_batch_in_process, max_sleep_seconds=max_sleep_seconds)
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_initial_process_repository,
+                             initargs=(repository.local_path, repository.local_source_type)) as executor:
+        futures = [executor.submit(load_batch, batch) if in_local else None for in_local, batch in batches]
+        frames = [pd.concat([load_by_stock_id(stock, force_remote, repository, max_sleep_seconds,
+                                              incremental=incremental) for stock in batch]) if future is None else None
+                  for future, (_, batch) in zip(futures, batches)]
+        return pd.concat([_from_arrow_buffer(*future.result()) if future is not None else frame
+                          for future, frame in zip(futures, frames)])
+
+
+_process_repository = None
+
+
+def _initial_process_repository(local_path, local_source_type):
+    global _process_repository
+    _process_repository = ChinaReportRepository(local_path, local_source_type)
+
+
+def _load_batch_in_process(stock_ids, max_sleep_seconds) -> (bytes, list):
+    data = pd.concat([load_by_stock_id(stock, False, _process_repository, max_sleep_seconds, concurrent=False)
+                      for stock in stock_ids])
+    return _to_arrow_buffer(data)
+
+
+def _to_arrow_buffer(data: pd.DataFrame) -> (bytes, list):
+    """
+    the frame as an arrow ipc stream, so it's sent back as one buffer instead of pickling the blocks.
+    arrow doesn't accept the duplicated column names, some items exist in different reports,
+    so the columns are sent besides the buffer
+    """
+    import pyarrow as pa
+
+    frame = data.copy(deep=False)
+    frame.columns = [str(i) for i in range(len(frame.columns))]
+    table = pa.Table.from_pandas(frame)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes(), list(data.columns)
+
+
+def _from_arrow_buffer(buffer: bytes, columns: list) -> pd.DataFrame:
+    import pyarrow as pa
+
+    data = pa.ipc.open_stream(buffer).read_pandas()
+    data.columns = columns
+    return data
+
+
+def fetch_all(reload=False, force_remote=False, repository=None, max_sleep_seconds=5,
+              requests_per_second=None, max_workers=None, incremental=False,
+              chunk_size=DEFAULT_FETCH_CHUNK_SIZE, n_jobs=None) -> pd.DataFrame:
     """
     this is only for load all stock info convenience. and it will take hours if you use all default for the first time.
 
     reload is compose the all report in local. and force_remote will fetch the data from remote.
     so you can update some data and call remote=True and force_remote=False and don't need to fetch whole from remote again
 
+    the stocks are loaded chunk by chunk, each chunk is written to disk at once and recorded in a journal.
+    if it's broken, call it again with the same local path and parameters and it continues from the last chunk.
+
     :param reload: reload local repository or not
     :param force_remote: force to fetch from remote
     :param repository:  repository
     :param max_sleep_seconds: sleep seconds for each call remote
+    :param requests_per_second: fetch concurrently with a global limit, please refer to load_multi_data
+    :param max_workers: max stocks loading at the same time
+    :param incremental: with force_remote, only the new or changed quarters of each stock will be written.
+                        it's the suggested way to update after the earnings season
+    :param chunk_size: stocks of each chunk, it's also the max stocks kept in memory
+    :param n_jobs: decode the local reports by processes, please refer to load_multi_data
     :return:
     """
     if not reload and not force_remote:
         result = __load_all_locally()
         if result.empty:
-            result = __reload_all_locally(force_remote, repository, max_sleep_seconds)
-            result = result.rename_axis([CODE_INDEX_NAME, RELEASE_AT_INDEX_NAME])
-            data = result.reset_index()
-            data = data.astype({"code": str})
-            _local_all_reports_repo.refresh_data(data, _ALL_REPORTS_NAME)
+            __reload_all_locally(force_remote, repository, max_sleep_seconds, requests_per_second, max_workers,
+                                 incremental, chunk_size, n_jobs)
+            result = __load_all_locally()
         return result
     else:
-        result = __reload_all_locally(force_remote, repository, max_sleep_seconds)
-        _local_all_reports_repo.refresh_data(result, _ALL_REPORTS_NAME)
-
-
-def __reload_all_locally(force_remote, repository, max_sleep_seconds) -> pd.DataFrame:
-    info = repository.stock_info
-    index = info.index
-    _logger.info("total will fetch {} stocks report".format(len(index)))
-    return fetch_multi_report(index, force_remote=force_remote, max_sleep_seconds=max_sleep_seconds)
+        __reload_all_locally(force_remote, repository, max_sleep_seconds, requests_per_second, max_workers,
+                             incremental, chunk_size, n_jobs)
+
+
+def __reload_all_locally(force_remote, repository, max_sleep_seconds, requests_per_second=None,
+                         max_workers=None, incremental=False, chunk_size=DEFAULT_FETCH_CHUNK_SIZE, n_jobs=None):
+    repository = _resolve_repository(repository)
+    all_reports = _get_local_all_reports_repo()
+    index = repository.stock_info.index
+    parameters = {"stocks": hashlib.sha1("\n".join(sorted(str(stock_id) for stock_id in index)).encode()).hexdigest(),
+                  "force_remote": bool(force_remote), "incremental": bool(incremental), "chunk_size": int(chunk_size)}
+    journal = FetchAllJournal(os.path.join(all_reports.source_folder, _FETCH_ALL_JOURNAL_FOLDER), parameters)
+    stock_ids = [stock_id for stock_id in index if str(stock_id) not in journal.done_stocks]
+    _logger.info("total will fetch {} stocks report, {} has been done".format(len(index),
+                                                                            len(index) - len(stock_ids)))
+    for start in range(0, len(stock_ids), chunk_size):
+        chunk = stock_ids[start:start + chunk_size]
+        result = load_multi_data(chunk, force_remote=force_remote, repository=repository,
+                                 max_sleep_seconds=max_sleep_seconds,
+                                 requests_per_second=requests_per_second, max_workers=max_workers,
+                                 incremental=incremental, n_jobs=n_jobs)
+        # the journal shouldn't say a stock is done before it's really written
+        repository.flush()
+        journal.record(chunk, result)
+
+    journal.assemble(all_reports, _ALL_REPORTS_NAME)
+    journal.remove()
 
 
 def __load_all_locally() -> pd.DataFrame:
-    data = _local_all_reports_repo.load_data(_ALL_REPORTS_NAME, dtype={"code": str}, parse_dates=[2])
+    data = _get_local_all_reports_repo().load_data(_ALL_REPORTS_NAME, dtype={"code": str}, parse_dates=[2])
     if not data.empty:
         data = data.set_index([CODE_INDEX_NAME, RELEASE_AT_INDEX_NAME])
     return data
@@ -194,28 +619,74 @@ def compose_target(target_info: dict, index: pd.Index, level=None) -> pd.DataFra
 
 
 def list_default_targets() -> dict:
+    import tushare as ts
+
     result = dict()
     st_stocks = ts.get_st_classified()
     result["st"] = st_stocks["code"].values
     return result
 
 
-def list_industry_category(repository: ChinaReportRepository = _repository, industry_column="industry") -> dict:
-    return {key: list(value) for key, value in repository.stock_info.groupby(industry_column).groups.items()}
+def _get_default_targets() -> dict:
+    global _default_targets
+    if _default_targets is None:
+        _default_targets = list_default_targets()
+    return _default_targets
+
+
+def list_industry_category(repository: ChinaReportRepository = None, industry_column="industry") -> dict:
+    return {key: list(value) for key, value in stock_info(repository).groupby(industry_column).groups.items()}
+
+
+def load_by_stock_id(stock_id: str, force_remote=False, repository=None, max_sleep_seconds=9,
+                     rate_limiter=None, incremental=False, concurrent=True) -> pd.DataFrame:
+    """
+    if any report of the stock needs to be fetched from remote, the three reports are loaded at the same time.
+    if rate_limiter isn't provided, they share one random sleep before calling remote
+
+    :param concurrent: fetch the three reports at the same time. load_multi_data turns it off,
+                       so its max_workers is still the cap of in-flight remote calls
+    :return: the reports index by stock id and release date
+    """
+    repository = _resolve_repository(repository)
+    if rate_limiter is None and max_sleep_seconds is not None:
+        rate_limiter = RandomDelayLimiter(max_sleep_seconds)
+
+    reports = [repository.assert_report, repository.income_report, repository.cash_report]
+    load = partial(_load_report, stock_id=stock_id, force_remote=force_remote, rate_limiter=rate_limiter,
+                   incremental=incremental)
+    if concurrent and (force_remote or not all(report.local_source.exist(stock_id) for report in reports)):
+        with ThreadPoolExecutor(max_workers=len(reports)) as executor:
+            frames = list(executor.map(load, reports))
+    else:
+        frames = [load(report) for report in reports]
+    return pd.concat({stock_id: pd.concat(frames, axis=1)})
+
+
+def _load_report(report, stock_id, force_remote, rate_limiter, incremental) -> pd.DataFrame:
+    return report.load_data(stock_id=stock_id, force_remote=force_remote, remote_delay_max_seconds=None,
+                            rate_limiter=rate_limiter, incremental=incremental)
 
 
-def load_by_stock_id(stock_id: str, force_remote=False, repository=_repository, max_sleep_seconds=9) -> pd.DataFrame:
-    assert_report = repository.assert_report.load_data(stock_id=stock_id, force_remote=force_remote,
-                                                       remote_delay_max_seconds=max_sleep_seconds)
-    income_report = repository.income_report.load_data(stock_id=stock_id, force_remote=force_remote,
-                                                       remote_delay_max_seconds=max_sleep_seconds)
-    cash_report = repository.cash_report.load_data(stock_id=stock_id, force_remote=force_remote,
-                                                   remote_delay_max_seconds=max_sleep_seconds)
-    return pd.concat({stock_id: pd.concat([assert_report, income_report, cash_report], axis=1)})
+def fetch_default_targets(target_info: dict = None, index: pd.Index = None, level=None) -> pd.DataFrame:
+    """
+    compose_target with the default targets for all the stocks.
+    the default targets are fetched from remote at the first call
+    """
+    return compose_target(target_info=_get_default_targets() if target_info is None else target_info,
+                          index=stock_info().index if index is None else index, level=level)
+
+
+def fetch_targets(index: pd.Index, target_info: dict = None, level=None) -> pd.DataFrame:
+    """
+    compose_target with the default targets
+    """
+    return compose_target(target_info=_get_default_targets() if target_info is None else target_info,
+                          index=index, level=level)
 
 
-fetch_one_report = partial(load_by_stock_id, repository=_repository)
-fetch_multi_report = partial(load_multi_data, repository=_repository)
-fetch_train_set = partial(load_train_data, repository=_repository)
-fetch_default_targets = partial(compose_target, target_info=list_default_targets(), index=_repository.stock_info.index)
-fetch_targets = partial(compose_target, target_info=list_default_targets())
+fetch_one_report = load_by_stock_id
+fetch_multi_report = load_multi_data
+iter_multi_report = iter_multi_data
+fetch_panel = load_panel
+fetch_train_set = load_train_data
@@ -0,0 +1,214 @@
+#  Copyright (c) 2020 GreenSeer (https://chandlersong.me)
+#  Copyright (c) 2020 chandler.song
+#
+#  Licensed under the GNU GENERAL PUBLIC LICENSE v3.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       https://www.gnu.org/licenses/gpl-3.0.html
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from greenseer.dataset.china_dataset import CODE_INDEX_NAME, RELEASE_AT_INDEX_NAME
+
+
+class ReportPanel:
+    """
+    the reports of many stocks as one dense float array, stock x report date x item.
+    the labels of each axis are kept in an index, so a label can be found without aligning any data frame.
+    the missing values, like a stock not listed at that date, are nan.
+
+    the cross sectional maths, like rank or zscore among the stocks, work on the array directly.
+    """
+
+    def __init__(self, values: np.ndarray, stocks, dates, items):
+        """
+
+        :param values: array of shape (stocks, dates, items)
+        :param stocks: stock ids
+        :param dates: report dates
+        :param items: report items
+        """
+        self.__stocks = pd.Index(stocks, name=CODE_INDEX_NAME)
+        self.__dates = pd.DatetimeIndex(dates, name=RELEASE_AT_INDEX_NAME)
+        self.__items = pd.Index(items)
+        expected = (len(self.__stocks), len(self.__dates), len(self.__items))
+        if values.shape != expected:
+            raise ValueError("values shape should be {}, but it's {}".format(expected, values.shape))
+        self.__values = values
+
+    @classmethod
+    def from_frame(cls, data: pd.DataFrame, dtype=np.float64) -> "ReportPanel":
+        """
+        :param data: index by (code, releaseAt) and each item is a column, like the result of fetch_all
+        :param dtype: dtype of the array, float32 saves half of the memory
+        """
+        return cls.from_frames([data], dtype)
+
+    @classmethod
+    def from_frames(cls, frames, dtype=np.float64) -> "ReportPanel":
+        """
+        build the panel from batches, like iter_multi_data, without concat them.
+        the positions of each batch are kept first, then the array is filled once
+
+        the same item may exist in different reports, only the first column of the name is kept
+
+        :param frames: iterable of data frames index by (code, releaseAt)
+        :param dtype: dtype of the array
+        """
+        stocks, dates, items = {}, {}, {}
+        blocks = []
+        for frame in frames:
+            if frame.empty:
+                continue
+            frame = frame.loc[:, ~frame.columns.duplicated()]
+            blocks.append((_positions(stocks, frame.index.get_level_values(0)),
+                           _positions(dates, pd.to_datetime(frame.index.get_level_values(1))),
+                           _positions(items, frame.columns),
+                           frame.astype(dtype).to_numpy()))
+
+        values = np.full((len(stocks), len(dates), len(items)), np.nan, dtype=dtype)
+        for stock_positions, date_positions, item_positions, block in blocks:
+            values[stock_positions[:, None], date_positions[:, None], item_positions[None, :]] = block
+
+        # the dates are in the order they appear, sort them once at last
+        date_labels = pd.DatetimeIndex(list(dates))
+        order = np.argsort(date_labels.values, kind="stable")
+        return cls(values[:, order, :], list(stocks), date_labels[order], list(items))
+
+    @property
+    def values(self) -> np.ndarray:
+        return self.__values
+
+    @property
+    def stocks(self) -> pd.Index:
+        return self.__stocks
+
+    @property
+    def dates(self) -> pd.DatetimeIndex:
+        return self.__dates
+
+    @property
+    def items(self) -> pd.Index:
+        return self.__items
+
+    @property
+    def shape(self) -> tuple:
+        return self.__values.shape
+
+    def __repr__(self):
+        return "ReportPanel({} stocks x {} dates x {} items)".format(*self.shape)
+
+    def to_frame(self, dropna=True) -> pd.DataFrame:
+        """
+        back to the data frame index by (code, releaseAt)
+        :param dropna: drop the (stock, date) without any value
+        """
+        stocks, dates, items = self.shape
+        flat = self.__values.reshape(stocks * dates, items)
+        index = pd.MultiIndex.from_product([self.__stocks, self.__dates])
+        if dropna:
+            keep = ~np.isnan(flat).all(axis=1)
+            flat, index = flat[keep], index[keep]
+        return pd.DataFrame(flat, index=index, columns=self.__items)
+
+    def select(self, stocks=None, dates=None, items=None) -> "ReportPanel":
+        """
+        slice the panel along any axis. a slice of labels, like dates=slice("2018-01-01", "2019-12-31"),
+        returns a view of the array, a list of labels returns a copy
+
+        :raise KeyError: if a label doesn't exist
+        """
+        stock_indexer = _indexer(self.__stocks, stocks)
+        date_indexer = _indexer(self.__dates, dates)
+        item_indexer = _indexer(self.__items, items)
+        values = self.__values[stock_indexer]
+        values = values[:, date_indexer]
+        values = values[:, :, item_indexer]
+        return ReportPanel(values, self.__stocks[stock_indexer], self.__dates[date_indexer],
+                           self.__items[item_indexer])
+
+    def item(self, item) -> pd.DataFrame:
+        """
+        :return: stock by report date of one item
+        """
+        return pd.DataFrame(self.__values[:, :, self.__items.get_loc(item)], index=self.__stocks,
+                            columns=self.__dates)
+
+    def with_item(self, item, values: np.ndarray) -> "ReportPanel":
+        """
+        append a new item, like a ratio of two items
+
+        :param item: name of the new item
+        :param values: array of shape (stocks, dates)
+        """
+        return ReportPanel(np.concatenate([self.__values, values[:, :, None]], axis=2), self.__stocks,
+                           self.__dates, self.__items.append(pd.Index([item])))
+
+    def ratio(self, item, numerator, denominator) -> "ReportPanel":
+        """
+        append numerator / denominator as a new item, the zero denominator will be nan
+        """
+        numerator_values = self.__values[:, :, self.__items.get_loc(numerator)]
+        denominator_values = self.__values[:, :, self.__items.get_loc(denominator)]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.where(denominator_values == 0, np.nan, numerator_values / denominator_values)
+        return self.with_item(item, ratio)
+
+    def zscore(self) -> "ReportPanel":
+        """
+        standardize each (date, item) among the stocks, the nan are ignored
+        """
+        with warnings.catch_warnings(), np.errstate(invalid="ignore"):
+            # the (date, item) without any value is nan, numpy warns about it
+            warnings.simplefilter("ignore", RuntimeWarning)
+            mean = np.nanmean(self.__values, axis=0, keepdims=True)
+            std = np.nanstd(self.__values, axis=0, keepdims=True)
+            values = (self.__values - mean) / np.where(std == 0, np.nan, std)
+        return ReportPanel(values, self.__stocks, self.__dates, self.__items)
+
+    def rank(self, pct=True) -> "ReportPanel":
+        """
+        rank the stocks of each (date, item), the smallest is 1. the nan are kept as nan,
+        the same values are ranked in the order of the stocks
+
+        :param pct: rank in percentile, between 0 and 1
+        """
+        missing = np.isnan(self.__values)
+        # nan are sorted to the end, so they don't change the rank of the others
+        ranks = np.argsort(np.argsort(self.__values, axis=0, kind="stable"), axis=0).astype(self.__values.dtype) + 1
+        if pct:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ranks /= (~missing).sum(axis=0, keepdims=True)
+        ranks[missing] = np.nan
+        return ReportPanel(ranks, self.__stocks, self.__dates, self.__items)
+
+
+def _positions(labels: dict, values) -> np.ndarray:
+    """
+    position of each value in labels, the new values are appended to labels.
+    only the unique values are looked up in the dict
+    """
+    codes, uniques = pd.factorize(values)
+    positions = np.array([labels.setdefault(value, len(labels)) for value in uniques], dtype=np.intp)
+    return positions[codes]
+
+
+def _indexer(index: pd.Index, labels):
+    if labels is None:
+        return slice(None)
+    if isinstance(labels, slice):
+        return index.slice_indexer(labels.start, labels.stop, labels.step)
+    positions = index.get_indexer(labels)
+    if (positions < 0).any():
+        raise KeyError("{} not found".format(list(pd.Index(labels)[positions < 0])))
+    return positions
@@ -19,6 +19,8 @@ import pandas as pd
 from sklearn.base import TransformerMixin, BaseEstimator
 
 from greenseer.utils.annotation import FunctionTransformerWrapper
+from greenseer.utils.quantile_sketch import QuantileSketch
+from greenseer.utils.tools import pick_group_rows
 
 
 @FunctionTransformerWrapper()
@@ -28,8 +30,14 @@ def remove_inf_and_na(X: pd.DataFrame = None) -> pd.DataFrame:
 
 
 class RemoveAbnormalFilter(BaseEstimator, TransformerMixin):
+    """
+    remove the rows out of the quantile range of any column, the rows with na in the columns are removed too.
 
-    def __init__(self, column: List[str], quantile=0.999, mode="high"):
+    for the data larger than memory, the range can be fitted batch by batch with partial_fit.
+    it keeps a QuantileSketch each column, so the range is approximate
+    """
+
+    def __init__(self, column: List[str], quantile=0.999, mode="high", approximate=False, compression=500):
         """
 
         :param column: column name
@@ -37,28 +45,103 @@ class RemoveAbnormalFilter(BaseEstimator, TransformerMixin):
         :param mode: both: exclude both side, the range will be (1-quantile)/2 to 1- (1-quantile)/2
                      high: exclude high side, the range will be 0 to quantile
                      low: exclude low side, the range will quantile to 100
+        :param approximate: fit by the sketches, it's always true for partial_fit
+        :param compression: compression of the sketches
         """
         self._columns = column
         self._quantile = quantile
         self._mode = mode
+        self._approximate = approximate
+        self._compression = compression
         self._low = None
         self._high = None
+        self._sketches = None
 
-    def fit(self, X: pd.DataFrame, y=None):
-
+    def _quantile_range(self) -> tuple:
         if self._mode == "both":
             boundary = (1 - self._quantile) / 2
-            self._high = X[self._columns].quantile(1 - boundary)
-            self._low = X[self._columns].quantile(boundary)
+            return boundary, 1 - boundary
         elif self._mode == "high":
-            self._high = X[self._columns].quantile(self._quantile)
-            self._low = X[self._columns].quantile(0)
+            return 0, self._quantile
         elif self._mode == "low":
-            self._high = X[self._columns].quantile(1)
-            self._low = X[self._columns].quantile(1 - self._quantile)
+            return 1 - self._quantile, 1
+        raise ValueError("mode should be both, high or low, but it's {}".format(self._mode))
+
+    def fit(self, X: pd.DataFrame, y=None):
+        if self._approximate:
+            self._sketches = None
+            return self.partial_fit(X, y)
+
+        low, high = self._quantile_range()
+        bounds = X[self._columns].quantile([low, high])
+        self._low, self._high = bounds.iloc[0], bounds.iloc[1]
         return self
 
-    def transform(self, X: pd.DataFrame):
+    def partial_fit(self, X: pd.DataFrame, y=None):
+        low, high = self._quantile_range()
+        if self._sketches is None:
+            self._sketches = {column: QuantileSketch(self._compression) for column in self._columns}
         for column in self._columns:
-            X = X[(self._low[column] <= X[column]) & (X[column] <= self._high[column])]
-        return X
+            self._sketches[column].update(X[column].to_numpy(dtype=np.float64))
+        bounds = pd.DataFrame({column: self._sketches[column].quantile([low, high]) for column in self._columns})
+        self._low, self._high = bounds.iloc[0], bounds.iloc[1]
+        return self
+
+    def transform(self, X: pd.DataFrame):
+        values = X[self._columns].to_numpy(dtype=np.float64)
+        low, high = self._bounds(X)
+        return X[((low <= values) & (values <= high)).all(axis=1)]
+
+    def _bounds(self, X: pd.DataFrame) -> tuple:
+        """
+        :return: low and high can be broadcast to the values of the columns
+        """
+        return self._low[self._columns].to_numpy(), self._high[self._columns].to_numpy()
+
+
+class GroupRemoveAbnormalFilter(RemoveAbnormalFilter):
+    """
+    like RemoveAbnormalFilter, but the quantile range is of each group, like the industry.
+    the rows of the groups not fitted are kept
+    """
+
+    def __init__(self, group_by: str, column: List[str], quantile=0.999, mode="high", approximate=False,
+                 compression=500):
+        """
+
+        :param group_by: the column of group
+        """
+        super().__init__(column, quantile, mode, approximate, compression)
+        self._group_by = group_by
+
+    def fit(self, X: pd.DataFrame, y=None):
+        if self._approximate:
+            self._sketches = None
+            return self.partial_fit(X, y)
+
+        low, high = self._quantile_range()
+        bounds = X.groupby(self._group_by)[self._columns].quantile([low, high])
+        self._low, self._high = bounds.xs(low, level=-1), bounds.xs(high, level=-1)
+        return self
+
+    def partial_fit(self, X: pd.DataFrame, y=None):
+        low, high = self._quantile_range()
+        if self._sketches is None:
+            self._sketches = {}
+        for group, one_group in X.groupby(self._group_by):
+            sketches = self._sketches.setdefault(
+                group, {column: QuantileSketch(self._compression) for column in self._columns})
+            for column in self._columns:
+                sketches[column].update(one_group[column].to_numpy(dtype=np.float64))
+
+        groups = list(self._sketches.keys())
+        bounds = np.array([[self._sketches[group][column].quantile([low, high]) for column in self._columns]
+                           for group in groups])
+        self._low = pd.DataFrame(bounds[:, :, 0], index=groups, columns=self._columns)
+        self._high = pd.DataFrame(bounds[:, :, 1], index=groups, columns=self._columns)
+        return self
+
+    def _bounds(self, X: pd.DataFrame) -> tuple:
+        groups = X[self._group_by]
+        return (pick_group_rows(self._low[self._columns], groups, -np.inf),
+                pick_group_rows(self._high[self._columns], groups, np.inf))
@@ -0,0 +1,209 @@
+#  Copyright (c) 2020 GreenSeer (https://chandlersong.me)
+#  Copyright (c) 2020 chandler.song
+#
+#  Licensed under the GNU GENERAL PUBLIC LICENSE v3.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       https://www.gnu.org/licenses/gpl-3.0.html
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import ast
+import re
+
+import numpy as np
+import pandas as pd
+from sklearn.base import TransformerMixin, BaseEstimator
+
+from greenseer.preprocessing.transformers import match_labels
+
+_QUOTED_NAME = re.compile(r"`([^`]*)`")
+
+
+class FeatureExpressionTransformer(BaseEstimator, TransformerMixin):
+    """
+    append many new columns by expressions at once, instead of a chain of sum_column_transform and
+    percent_column_transform. like:
+    {
+        "cash": "货币资金 + 交易性金融资产",
+        "cash_ratio": "cash / `流动负债合计(万元)`",
+        "fixed": "match('固定资产', '在建工程') / 资产总计"
+    }
+
+    the expression supports + - * / and brackets.
+    a name is a feature defined before, or a column. quote the column by ` if it isn't a python name.
+    match(patterns) is the sum of the columns match any of the regular expressions, like re_sum_column_transform.
+
+    the na in a sum are 0, like DataFrame.sum, the other operations keep na. -a is -1 * a, so it keeps na too.
+
+    all the expressions are compiled into one plan. the same sums, like "a + b" and "b + a", are calculated once.
+    only the whole sums are shared, "a + b" isn't reused inside "a + b + c".
+    the columns are read from X by position as one float block. a column used by the expressions can't be
+    duplicated in X, like the same item of different reports, the other columns can.
+    """
+
+    def __init__(self, expressions: dict):
+        """
+
+        :param expressions: new column name -> expression, a later expression can use the former features
+        :raise ValueError: if an expression can't be parsed
+        """
+        self._expressions = expressions
+        self.__trees = {name: _parse_expression(expression) for name, expression in expressions.items()}
+        self.__plan_columns = None
+        self.__plan = None
+
+    def fit(self, X: pd.DataFrame, y=None):
+        return self
+
+    def transform(self, X: pd.DataFrame):
+        """
+        :return: X with the features, the features already in X are replaced in place, the others are appended
+        :raise ValueError: if a column used is duplicated in X
+        """
+        columns, features = self.__compile(X.columns)
+        # each column of the block is contiguous
+        block = np.asfortranarray(X.iloc[:, X.columns.get_indexer_for(columns)].to_numpy(dtype=np.float64))
+        positions = {column: position for position, column in enumerate(columns)}
+        cache = {}
+        values = {name: np.broadcast_to(_evaluate(node, block, positions, cache), len(X))
+                  for name, node in features.items()}
+
+        for name in [name for name in values if name in X.columns]:
+            X[name] = values.pop(name)
+        if len(values) == 0:
+            return X
+        return pd.concat([X, pd.DataFrame(values, index=X.index)], axis=1)
+
+    def __compile(self, headers: pd.Index) -> tuple:
+        """
+        resolve the names and match(patterns) by the columns. the plan is kept until the columns change
+        :return: the columns used and the node of each feature
+        """
+        plan_columns = tuple(headers)
+        if self.__plan_columns == plan_columns:
+            return self.__plan
+        features = {}
+        for name, tree in self.__trees.items():
+            features[name] = _resolve(tree, headers, features)
+        columns = list(dict.fromkeys(_columns_of(features.values())))
+        duplicated = [column for column in columns if len(headers.get_indexer_for([column])) > 1]
+        if len(duplicated) > 0:
+            raise ValueError("{} are duplicated columns, keep one of each first".format(duplicated))
+        self.__plan_columns, self.__plan = plan_columns, (columns, features)
+        return self.__plan
+
+
+def _parse_expression(expression: str) -> tuple:
+    quoted = {}
+
+    def quote(match) -> str:
+        name = "__quoted_{}".format(len(quoted))
+        quoted[name] = match.group(1)
+        return name
+
+    try:
+        tree = ast.parse(_QUOTED_NAME.sub(quote, expression).strip(), mode="eval")
+        return _to_node(tree.body, quoted)
+    except (SyntaxError, ValueError) as err:
+        raise ValueError("can't parse the expression {}: {}".format(expression, err))
+
+
+def _to_node(tree: ast.AST, quoted: dict) -> tuple:
+    """
+    the nodes are tuples, so the same expression is the same key of a dict
+    """
+    if isinstance(tree, ast.Name):
+        return "name", quoted.get(tree.id, tree.id)
+    if isinstance(tree, ast.Constant) and isinstance(tree.value, (int, float)):
+        return "constant", float(tree.value)
+    if isinstance(tree, ast.UnaryOp) and isinstance(tree.op, ast.UAdd):
+        return _to_node(tree.operand, quoted)
+    if isinstance(tree, ast.UnaryOp) and isinstance(tree.op, ast.USub):
+        operand = _to_node(tree.operand, quoted)
+        if operand[0] == "constant":
+            return "constant", -operand[1]
+        # not a sum, a sum takes na as 0 but -a should be na if a is na
+        return ("multiply",) + tuple(sorted([("constant", -1.0), operand], key=repr))
+    if isinstance(tree, ast.BinOp):
+        left, right = _to_node(tree.left, quoted), _to_node(tree.right, quoted)
+        if isinstance(tree.op, ast.Add):
+            return _sum([(1, left), (1, right)])
+        if isinstance(tree.op, ast.Sub):
+            return _sum([(1, left), (-1, right)])
+        if isinstance(tree.op, ast.Mult):
+            return ("multiply",) + tuple(sorted([left, right], key=repr))
+        if isinstance(tree.op, ast.Div):
+            return "divide", left, right
+    if isinstance(tree, ast.Call) and isinstance(tree.func, ast.Name) and tree.func.id == "match" \
+            and len(tree.keywords) == 0 \
+            and all(isinstance(arg, ast.Constant) and isinstance(arg.value, str) for arg in tree.args):
+        return "match", tuple(arg.value for arg in tree.args)
+    raise ValueError("{} isn't supported".format(type(tree).__name__))
+
+
+def _sum(terms) -> tuple:
+    """
+    flatten the nested sums and sort the terms, so "a + (b + c)" and "c + b + a" are the same sum
+    """
+    flatten = []
+    for sign, node in terms:
+        if node[0] == "sum":
+            flatten.extend((sign * inner_sign, inner) for inner_sign, inner in node[1])
+        else:
+            flatten.append((sign, node))
+    return "sum", tuple(sorted(flatten, key=repr))
+
+
+def _resolve(node: tuple, headers: pd.Index, features: dict) -> tuple:
+    kind = node[0]
+    if kind == "name":
+        if node[1] in features:
+            return features[node[1]]
+        if node[1] in headers:
+            return "column", node[1]
+        raise KeyError("{} isn't a column or a feature".format(node[1]))
+    if kind == "match":
+        return _sum([(1, ("column", column)) for column in match_labels(headers, node[1])])
+    if kind == "sum":
+        return _sum([(sign, _resolve(term, headers, features)) for sign, term in node[1]])
+    if kind in ("multiply", "divide"):
+        return (kind,) + tuple(_resolve(child, headers, features) for child in node[1:])
+    return node
+
+
+def _columns_of(nodes):
+    for node in nodes:
+        if node[0] == "column":
+            yield node[1]
+        elif node[0] == "sum":
+            yield from _columns_of(term for _, term in node[1])
+        elif node[0] in ("multiply", "divide"):
+            yield from _columns_of(node[1:])
+
+
+def _evaluate(node: tuple, block: np.ndarray, positions: dict, cache: dict):
+    if node in cache:
+        return cache[node]
+    kind = node[0]
+    if kind == "column":
+        value = block[:, positions[node[1]]]
+    elif kind == "constant":
+        value = node[1]
+    elif kind == "sum":
+        value = np.zeros(len(block))
+        for sign, term in node[1]:
+            term_value = _evaluate(term, block, positions, cache)
+            value += sign * np.where(np.isnan(term_value), 0, term_value)
+    elif kind == "multiply":
+        value = _evaluate(node[1], block, positions, cache) * _evaluate(node[2], block, positions, cache)
+    else:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            value = _evaluate(node[1], block, positions, cache) / _evaluate(node[2], block, positions, cache)
+    cache[node] = value
+    return value
@@ -15,7 +15,7 @@
 
 import logging
 import re
-from functools import partial
+from functools import partial, lru_cache
 from typing import List
 
 import numpy as np
@@ -24,6 +24,7 @@ from sklearn.base import TransformerMixin, BaseEstimator
 
 from greenseer.dataset.china_dataset import stock_info, CODE_INDEX_NAME, RELEASE_AT_INDEX_NAME
 from greenseer.utils.annotation import FunctionTransformerWrapper
+from greenseer.utils.tools import pick_group_rows
 
 _logger = logging.getLogger()
 
@@ -65,20 +66,20 @@ def append_stock_info_transform(X: pd.DataFrame = None, info: str = "name",
 
 @FunctionTransformerWrapper()
 def regular_expression_index_filter(X: pd.DataFrame, pattern, level=None) -> pd.DataFrame:
-    drop_indexes = [index for index in X.index.get_level_values(level) if not re.match(pattern, index)]
-    _logger.info("remove {} rows,details is {}".format(len(drop_indexes), drop_indexes))
-    return X.drop(drop_indexes, level=level).sort_index(level=level, ascending=False)
+    labels = X.index.get_level_values(level)
+    keep = match_labels(labels, [pattern])
+    mask = labels.isin(keep)
+    _logger.info("remove {} rows,details is {}".format(np.count_nonzero(~mask), list(labels[~mask].unique())))
+    return X[mask].sort_index(level=level, ascending=False)
 
 
 @FunctionTransformerWrapper()
 def regular_expression_column_filter(X: pd.DataFrame, patterns, level=None, rename=None) -> pd.DataFrame:
-    columns = set(X.columns.get_level_values(level))
-    for pattern in patterns:
-        keep = [column for column in columns if re.match(pattern, column)]
-        columns = columns.difference(keep)
+    headers = X.columns.get_level_values(level)
+    mask = headers.isin(match_labels(headers, patterns))
 
-    _logger.info("remove {} rows,details is {}".format(len(columns), columns))
-    result = X.drop(columns, axis=1, level=level).sort_index(level=level, ascending=False)
+    _logger.info("remove {} rows,details is {}".format(len(headers[~mask].unique()), set(headers[~mask])))
+    result = X.loc[:, mask].sort_index(level=level, ascending=False)
 
     if rename is not None:
         result.rename(rename, inplace=True, axis=1)
@@ -94,7 +95,7 @@ def sum_column_transform(X: pd.DataFrame, new_name: str, columns: List[str], lev
 
 @FunctionTransformerWrapper()
 def re_sum_column_transform(X: pd.DataFrame, new_name: str, patterns, level=None) -> pd.DataFrame:
-    columns = _match_columns_by_patterns(set(X.columns.get_level_values(level)), patterns)
+    columns = match_labels(X.columns.get_level_values(level), patterns)
     X[new_name] = X[columns].sum(level=level, axis=1)
     return X
 
@@ -102,18 +103,33 @@ def re_sum_column_transform(X: pd.DataFrame, new_name: str, patterns, level=None
 @FunctionTransformerWrapper()
 def re_percent_column_transform(X: pd.DataFrame, new_name: str, numerator: List[str], denominator: List[str],
                                 level=None) -> pd.DataFrame:
-    headers = set(X.columns.get_level_values(level))
-    n = _match_columns_by_patterns(headers, numerator)
-    d = _match_columns_by_patterns(headers, denominator)
+    headers = X.columns.get_level_values(level)
+    n = match_labels(headers, numerator)
+    d = match_labels(headers, denominator)
     X[new_name] = X[n].sum(level=level, axis=1) / X[d].sum(level=level, axis=1)
     return X
 
 
-def _match_columns_by_patterns(headers, numerator):
-    n = set()
-    for pattern in numerator:
-        n.update([column for column in headers if re.match(pattern, column)])
-    return n
+def match_labels(labels: pd.Index, patterns) -> list:
+    """
+    the unique labels match any of the patterns, in the order of labels
+    """
+    return list(_resolve_labels(tuple(labels.unique()), tuple(patterns)))
+
+
+@lru_cache(maxsize=256)
+def _resolve_labels(labels: tuple, patterns: tuple) -> tuple:
+    """
+    a pipeline transforms the data of the same columns again and again, like a grid search.
+    so the labels matched are cached by the labels and the patterns
+    """
+    compiled = _compile_patterns(patterns)
+    return tuple(label for label in labels if any(pattern.match(label) for pattern in compiled))
+
+
+@lru_cache(maxsize=None)
+def _compile_patterns(patterns: tuple) -> tuple:
+    return tuple(re.compile(pattern) for pattern in patterns)
 
 
 @FunctionTransformerWrapper()
@@ -139,67 +155,156 @@ def pick_row_by_index_month(X: pd.DataFrame, month: int, level=None) -> pd.DataF
 
 @FunctionTransformerWrapper()
 def unstack_release_at(X: pd.DataFrame, start: str, end: str, column_name: str,
-                       drop_if_contain_na: bool = True) -> pd.DataFrame:
+                       drop_if_contain_na: bool = True, fill_value=None) -> pd.DataFrame:
     """
-    unstack index release at
+    unstack index release at, one row each stock and one column each release at.
+    it's one unstack of the whole column, not a loop of the stocks
+
     :param X: input data
     :param start: start time
     :param end: end time
     :param column_name: the value of new data frame
-    :param drop_if_contain_na: drop is contine na
+    :param drop_if_contain_na: drop the stock if it still contains na
+    :param fill_value: fill the release at which a stock doesn't have, None keeps them as na.
+                       the na values in the column are not filled
     :return:
     """
-    stock_ids = X.index.levels[0]
-    pending_array = []
     idx = pd.IndexSlice
-    X = X.loc[idx[:, start:end], :]
-    for stock_id in stock_ids:
-        try:
-            one_stock = X.loc[stock_id]
-        except KeyError as err:
-            _logger.debug("{} can't get the data".format(err))
-            continue
-        one_stock = one_stock[column_name].to_frame().T
-        one_stock.index = [stock_id]
-        one_stock.fillna(0)
-        pending_array.append(one_stock)
-
-    _logger.debug("unstack_release_at: {} total find stocks".format(len(pending_array)))
-    if len(pending_array) == 0:
+    column = X.loc[idx[:, start:end], column_name]
+    if column.empty:
+        _logger.debug("unstack_release_at: 0 total find stocks")
         return pd.DataFrame()
-    result = pd.concat(pending_array)
+
+    # the stocks without any data between start and end are not in the result
+    column.index = column.index.remove_unused_levels()
+    result = column.unstack(level=1, fill_value=fill_value)
+    _logger.debug("unstack_release_at: {} total find stocks".format(len(result)))
 
     if drop_if_contain_na:
         result = result.dropna()
         _logger.debug("unstack_release_at:after drop na still contain {} stock ".format(len(result)))
     result.index.set_names([CODE_INDEX_NAME], inplace=True)
+    result.columns.set_names([RELEASE_AT_INDEX_NAME], inplace=True)
     return result
 
 
+MEAN_DISTANCE_METRICS = ("euclidean", "mahalanobis", "cosine")
+
+
 class MeanDistanceTransformer(BaseEstimator, TransformerMixin):
     """
     1: calculate the center (means of each column) by group_by column
     2: create a new column which is distance to the center or each row
+
+    the center of each row is picked by the position of its group, and all the distances are calculated at once.
+    the rows of an unknown group or without group get nan, the rows without group aren't fitted.
+
+    metric:
+    euclidean: the norm of row - center
+    mahalanobis: like euclidean, but scaled by the covariance of the rows to their centers (pooled of all groups)
+    cosine: 1 - cosine similarity of row and center
+
+    for the data larger than memory, fit it batch by batch with partial_fit and transform the batches with
+    iter_transform. chunk_size limits the rows calculated at once, so the temporary arrays are small
     """
 
-    def __init__(self, group_by: str, columns: List[str], new_column: str = "distance"):
+    def __init__(self, group_by: str, columns: List[str], new_column: str = "distance", metric: str = "euclidean",
+                 chunk_size: int = None):
         self._group_by = group_by
         self._columns = columns
         self._new_column = new_column
+        self._metric = metric
+        self._chunk_size = chunk_size
         self._centers = None
+        self.__inverse_covariance = None
+        self.__reset()
+
+    def __reset(self):
+        self.__sums = None
+        self.__counts = None
+        # only the rows with all columns are used by the covariance
+        self.__complete_sums = None
+        self.__complete_counts = None
+        self.__scatter = np.zeros((len(self._columns), len(self._columns)))
 
     def fit(self, X: pd.DataFrame, y=None):
-        self._centers = X.groupby(self._group_by).mean()
+        self.__reset()
+        return self.partial_fit(X, y)
+
+    def partial_fit(self, X: pd.DataFrame, y=None):
+        """
+        add a batch to the centers, the centers are the same as fit all the batches at once
+        """
+        self.__check_parameters()
+        known = X[self._group_by].notna()
+        values = X.loc[known, self._columns].astype(np.float64)
+        groups = X.loc[known, self._group_by]
+        self.__sums = _add_frame(self.__sums, values.groupby(groups).sum())
+        self.__counts = _add_frame(self.__counts, values.groupby(groups).count())
+
+        complete = values.notna().all(axis=1)
+        complete_values = values[complete]
+        self.__complete_sums = _add_frame(self.__complete_sums, complete_values.groupby(groups[complete]).sum())
+        self.__complete_counts = _add_frame(self.__complete_counts,
+                                            complete_values.groupby(groups[complete]).size().to_frame())
+        array = complete_values.to_numpy()
+        self.__scatter += array.T @ array
+
+        self._centers = self.__sums / self.__counts.where(self.__counts > 0)
+        if self._metric == "mahalanobis":
+            self.__inverse_covariance = np.linalg.pinv(self.__covariance())
         return self
 
+    def __covariance(self) -> np.ndarray:
+        sums = self.__complete_sums.to_numpy()
+        counts = self.__complete_counts.reindex(self.__complete_sums.index).to_numpy()
+        # scatter of the rows to their centers: sum(x * x') - sum(n * center * center') of each group
+        with np.errstate(divide="ignore", invalid="ignore"):
+            centers = np.where(counts > 0, sums / counts, 0)
+        within = self.__scatter - (centers * counts).T @ centers
+        degree = counts.sum() - np.count_nonzero(counts)
+        return within / max(degree, 1)
+
+    def __check_parameters(self):
+        if self._metric not in MEAN_DISTANCE_METRICS:
+            raise ValueError("metric should be one of {}, but it's {}".format(MEAN_DISTANCE_METRICS, self._metric))
+        if self._chunk_size is not None and self._chunk_size <= 0:
+            raise ValueError("chunk_size should be positive, but it's {}".format(self._chunk_size))
+
     def transform(self, X: pd.DataFrame):
-        X[self._new_column] = X.apply(self._calculate_distance, axis=1)
+        self.__check_parameters()
+        chunk_size = len(X) if self._chunk_size is None else self._chunk_size
+        distances = np.empty(len(X))
+        for start in range(0, len(X), max(chunk_size, 1)):
+            distances[start:start + chunk_size] = self._calculate_distance(X.iloc[start:start + chunk_size])
+        X[self._new_column] = distances
         return X
 
-    def _calculate_distance(self, row: pd.Series):
-        center_ids = self._centers.loc[row[self._group_by]][self._columns].values
-        val = row[self._columns].values
-        return np.linalg.norm(center_ids - val)
+    def iter_transform(self, frames):
+        """
+        transform the batches one by one, like the batches of iter_multi_data
+        """
+        for frame in frames:
+            yield self.transform(frame)
+
+    def _calculate_distance(self, X: pd.DataFrame) -> np.ndarray:
+        centers = pick_group_rows(self._centers[self._columns], X[self._group_by], np.nan)
+        values = X[self._columns].to_numpy(dtype=np.float64)
+        if self._metric == "cosine":
+            with np.errstate(divide="ignore", invalid="ignore"):
+                similarity = np.einsum("ij,ij->i", values, centers) / (
+                        np.linalg.norm(values, axis=1) * np.linalg.norm(centers, axis=1))
+            return 1 - similarity
+        diff = values - centers
+        if self._metric == "mahalanobis":
+            return np.sqrt(np.einsum("ij,jk,ik->i", diff, self.__inverse_covariance, diff))
+        return np.sqrt(np.einsum("ij,ij->i", diff, diff))
+
+
+def _add_frame(total: pd.DataFrame, part: pd.DataFrame) -> pd.DataFrame:
+    if total is None:
+        return part
+    return total.add(part, fill_value=0)
 
 
 pick_annual_report_china = partial(pick_row_by_index_month, month=12, level=1)
@@ -16,7 +16,6 @@
 
 import abc
 import logging
-import os
 import time
 from abc import ABC
 
@@ -24,6 +23,17 @@ import numpy as np
 import pandas as pd
 from pandas import DataFrame
 
+from greenseer.repository.cache import ReportCache, NegativeCache
+from greenseer.repository.files import replace_file_atomically, read_json_lines, append_json_line, \
+    rewrite_json_lines, write_json_atomically
+from greenseer.repository.folder_source import ReportLocalData, ParquetLocalData, migrate_local_data
+from greenseer.repository.local_source import LocalSource, merge_report_columns, to_report_date_index, \
+    from_report_date_index
+from greenseer.repository.manifest import SourceManifest
+from greenseer.repository.segment_source import SegmentLocalData
+from greenseer.repository.sqlite_source import SqliteLocalData
+from greenseer.repository.write_behind import WriteBehindLocalData
+
 """
 this module is a data source
 I hope it could be a smart one. it can choice to pick data from local or remote.
@@ -35,42 +45,12 @@ another is stockinfo, like stock information, stock id is the primary key.
 
 each will have it's own implementation.
 
+the local sources, the caches and the file helpers are in their own modules, they are exported here too.
 """
 
 DATA_TYPE_FOR_TRANSFORM = {'amount': np.float64, 'volume': np.float64}
 
 
-class LocalSource(ABC):
-    """
-    this is a interface. Because I am familiar with interface in java. I use a stupid solution here.
-    need to be changed if there's a good solution
-    """
-
-    @abc.abstractmethod
-    def load_data(self, *args, **kwargs) -> DataFrame:
-        """
-        load data from repository
-        :param stock_id:
-        :param args:
-        :param kwargs:
-        :return:
-        """
-        pass
-
-    @abc.abstractmethod
-    def refresh_data(self, df: DataFrame, stock_id):
-        pass
-
-    @abc.abstractmethod
-    def exist(self, stock_id):
-        """
-        check data is dirty or not
-        :param stock_id:
-        :return:
-        """
-        pass
-
-
 class RemoteFetcher(ABC):
     logger = logging.getLogger()
 
@@ -85,47 +65,6 @@ class RemoteFetcher(ABC):
         pass
 
 
-class ReportLocalData(LocalSource):
-    """
-    the source is a folder, it work like a table in the database
-    each record will be used as a file
-    """
-
-    logger = logging.getLogger()
-
-    def __init__(self, source_folder):
-        self.__source_folder = source_folder
-        if not os.path.exists(self.__source_folder):
-            self.logger.info('%s not exists,auto create!!!' % self.__source_folder)
-            os.makedirs(self.__source_folder, exist_ok=True)
-        else:
-            self.logger.info('%s exists' % self.__source_folder)
-        self.file_format = source_folder + "/{}.gz"
-
-    @property
-    def source_folder(self):
-        return self.__source_folder
-
-    def refresh_data(self, df: DataFrame, identify):
-        file_path = self.file_format.format(identify)
-        if os.path.exists(file_path):
-            self.logger.info("{} exists and has been deleted".format(file_path))
-            os.remove(file_path)
-
-        df.sort_index().to_csv(file_path, encoding="utf-8", compression="gzip")
-
-    def load_data(self, identify, index_col=0, dtype=None, parse_dates=True, *args, **kwargs) -> DataFrame:
-        try:
-            return pd.read_csv(self.file_format.format(identify), index_col=index_col, compression="gzip",
-                               parse_dates=parse_dates, dtype=dtype)
-        except FileNotFoundError:
-            self.logger.error("{} not exists in local".format(identify))
-            return pd.DataFrame()
-
-    def exist(self, stock_id):
-        return os.path.exists(self.file_format.format(stock_id))
-
-
 class ReportRepository(RemoteFetcher, ABC):
     """
     all the DataSource should be responsibility for one kind of data. like store price.
@@ -147,26 +86,146 @@ class ReportRepository(RemoteFetcher, ABC):
         :param local_source:  it should be a source to persist data
         """
         self.__local_source = local_source
+        self.__cache = None
+        self.__negative_cache = None
 
     @property
     def local_source(self) -> LocalSource:
         return self.__local_source
 
-    def load_data(self, stock_id, force_remote=False, remote_delay_max_seconds=None) -> DataFrame:
-        # FUTUREIMPROVE:  add dirty check if possible.
-        if not self.local_source.exist(stock_id) or force_remote:
-            self.logger.info("{} is empty, local data will be refresh".format(stock_id))
+    @property
+    def report_type(self) -> str:
+        return type(self).__name__
+
+    @property
+    def cache(self) -> ReportCache:
+        return self.__cache
+
+    @cache.setter
+    def cache(self, cache: ReportCache):
+        """
+        the cache is optional, it can be shared by different repositories
+        """
+        self.__cache = cache
+
+    @property
+    def negative_cache(self) -> NegativeCache:
+        return self.__negative_cache
 
-            if remote_delay_max_seconds is not None:  # avoid been banned by remote server
+    @negative_cache.setter
+    def negative_cache(self, negative_cache: NegativeCache):
+        """
+        optional, the stocks remote has no data for won't be asked again until they expire. it can be shared by
+        different repositories
+        """
+        self.__negative_cache = negative_cache
+
+    def load_data(self, stock_id, force_remote=False, remote_delay_max_seconds=None, rate_limiter=None,
+                  incremental=False) -> DataFrame:
+        """
+
+        :param stock_id: stock id
+        :param force_remote: fetch from remote even the data exists in local
+        :param remote_delay_max_seconds: sleep a random time before call remote
+        :param rate_limiter: shared TokenBucketRateLimiter, it replaces the random sleep if provided
+        :param incremental: when fetch from remote and local exists, only the new or changed quarters will be
+                            written to local. nothing will be written if no quarter is dirty
+        :return: report date by item, the report date is a DatetimeIndex.
+                 empty if the stock isn't in local and the remote has no data for it, even force_remote if it's
+                 in the negative cache. if the stock is in local, the local one is returned when remote has no data
+        """
+        if not force_remote and self.cache is not None:
+            cached = self.cache.get((self.report_type, stock_id))
+            if cached is not None:
+                return cached
+
+        exist = self.local_source.exist(stock_id)
+        if not exist or force_remote:
+            self.logger.info("{} is empty, local data will be refresh".format(stock_id))
+            # only the stocks without local data are skipped, a stock in local is always refreshed when forced
+            if not exist and self.negative_cache is not None \
+                    and self.negative_cache.is_missing(self.report_type, stock_id):
+                self.logger.info("{} has no {} in remote, skip it".format(stock_id, self.report_type))
+                return pd.DataFrame()
+
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            elif remote_delay_max_seconds is not None:  # avoid been banned by remote server
                 time.sleep(np.random.randint(0, remote_delay_max_seconds))
 
             remote_data = self.initial_remote_data(stock_id)
-            self.local_source.refresh_data(remote_data, stock_id)
-            return _change_column_to_datetime(remote_data)
+            if remote_data.empty and exist:
+                # it may be a transient error of remote, like a busy page, the local one is still valid
+                self.logger.warning("remote returns no {} of {}, keep the local one".format(self.report_type,
+                                                                                          stock_id))
+                local_data = self.__load_local(stock_id)
+                return pd.DataFrame() if local_data is None else local_data
+            if remote_data.empty:
+                self.logger.warning("remote has no {} of {}".format(self.report_type, stock_id))
+                if self.negative_cache is not None:
+                    self.negative_cache.mark_missing(self.report_type, stock_id)
+                return pd.DataFrame()
+            if self.negative_cache is not None:
+                self.negative_cache.forget(self.report_type, stock_id)
+
+            if incremental and exist:
+                remote_data = self.__update_dirty_quarters(stock_id, remote_data)
+            else:
+                self.local_source.refresh_data(remote_data, stock_id)
+            if self.cache is not None:
+                self.cache.invalidate((self.report_type, stock_id))
+            return to_report_date_index(remote_data)
         else:
-            return _change_column_to_datetime(self.__local_source.load_data(stock_id))
-
-
-def _change_column_to_datetime(data: pd.DataFrame):
-    data.columns = data.columns.map(pd.Timestamp)
-    return data
+            local_data = self.__load_local(stock_id)
+            if local_data is None:
+                self.logger.warning("{} of {} is lost in local, fetch it from remote".format(self.report_type,
+                                                                                         stock_id))
+                return self.load_data(stock_id, force_remote, remote_delay_max_seconds, rate_limiter, incremental)
+            return local_data
+
+    def __load_local(self, stock_id) -> DataFrame:
+        """
+        :return: None if the record is lost, like its file is deleted by others, and the local source forgot it
+        """
+        local_data = self.__local_source.load_data(stock_id)
+        if local_data.empty and not self.local_source.exist(stock_id):
+            return None
+        if not self.local_source.report_date_as_index:
+            local_data = to_report_date_index(local_data)
+        if self.cache is not None:
+            self.cache.put((self.report_type, stock_id), local_data)
+            return local_data.copy()
+        return local_data
+
+    def __update_dirty_quarters(self, stock_id, remote_data: DataFrame) -> DataFrame:
+        local_data = self.local_source.load_data(stock_id)
+        if self.local_source.report_date_as_index:
+            local_data = from_report_date_index(local_data)
+        dirty = find_dirty_quarters(local_data, remote_data)
+        if len(dirty) == 0:
+            self.logger.info("{} has no new or changed quarter".format(stock_id))
+            return local_data
+
+        self.logger.info("{} will update quarters {}".format(stock_id, list(dirty)))
+        update = remote_data[dirty]
+        self.local_source.update_data(update, stock_id)
+        return merge_report_columns(local_data, update)
+
+
+def find_dirty_quarters(local: DataFrame, remote: DataFrame) -> pd.Index:
+    """
+    the report is item by date, so each column is a quarter.
+    a quarter is dirty if it doesn't exist in local, or any value of it is different from local.
+    the values are compared with a tiny relative tolerance, so a value only changed by the float round trip of the
+    local file isn't dirty. na is the same as na.
+
+    :param local: report in local
+    :param remote: report from remote
+    :return: the dirty quarters, keep the order of remote
+    """
+    common = remote.columns.intersection(local.columns)
+    remote_common = remote[common].to_numpy(dtype=np.float64)
+    local_common = local.reindex(index=remote.index, columns=common).to_numpy(dtype=np.float64)
+    same = np.isclose(remote_common, local_common, rtol=1e-9, atol=0, equal_nan=True)
+    changed = common[~same.all(axis=0)]
+    return remote.columns[~remote.columns.isin(local.columns) | remote.columns.isin(changed)]
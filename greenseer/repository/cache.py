@@ -0,0 +1,170 @@
+#  Copyright (c) 2020 GreenSeer (https://chandlersong.me)
+#  Copyright (c) 2020 chandler.song
+#
+#  Licensed under the GNU GENERAL PUBLIC LICENSE v3.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       https://www.gnu.org/licenses/gpl-3.0.html
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from pandas import DataFrame
+
+from greenseer.repository.files import write_json_atomically
+
+
+class ReportCache:
+    """
+    in-process LRU cache of the decoded reports. the key is (report type, stock id).
+    when the total bytes of the reports are over max_bytes, the least recently used one will be evicted.
+
+    the reports are copied when they are returned, so the caller can change them freely
+    """
+
+    def __init__(self, max_bytes):
+        self.__max_bytes = max_bytes
+        self.__entries = OrderedDict()
+        self.__current_bytes = 0
+        self.__hits = 0
+        self.__misses = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def max_bytes(self):
+        return self.__max_bytes
+
+    @property
+    def current_bytes(self):
+        return self.__current_bytes
+
+    @property
+    def hits(self):
+        return self.__hits
+
+    @property
+    def misses(self):
+        return self.__misses
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key) -> DataFrame:
+        """
+        :return: a copy of the report, None if it's not cached
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.__misses += 1
+                return None
+            self.__hits += 1
+            self.__entries.move_to_end(key)
+            return entry[0].copy()
+
+    def put(self, key, df: DataFrame):
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        with self.__lock:
+            self.__remove(key)
+            if size > self.__max_bytes:
+                return
+            self.__entries[key] = (df, size)
+            self.__current_bytes += size
+            while self.__current_bytes > self.__max_bytes:
+                _, (_, evicted_size) = self.__entries.popitem(last=False)
+                self.__current_bytes -= evicted_size
+
+    def invalidate(self, key):
+        with self.__lock:
+            self.__remove(key)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__current_bytes = 0
+
+    def info(self) -> dict:
+        return {"hits": self.__hits, "misses": self.__misses, "size": len(self.__entries),
+                "current_bytes": self.__current_bytes, "max_bytes": self.__max_bytes}
+
+    def __remove(self, key):
+        entry = self.__entries.pop(key, None)
+        if entry is not None:
+            self.__current_bytes -= entry[1]
+
+
+class NegativeCache:
+    """
+    the stocks the remote has no data for, like the delisted or newly listed ones. the key is (report type, stock id)
+    and each one expires after ttl_seconds, then the remote will be asked again.
+
+    it's persisted in a json file, so a new process won't query the dead stocks again.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, path, ttl_seconds):
+        """
+
+        :param path: the json file to keep the missing stocks
+        :param ttl_seconds: how long a stock is known missing
+        """
+        self.__path = path
+        self.__ttl_seconds = ttl_seconds
+        self.__lock = threading.Lock()
+        self.__entries = self.__read()
+
+    @property
+    def path(self):
+        return self.__path
+
+    @property
+    def ttl_seconds(self):
+        return self.__ttl_seconds
+
+    def __len__(self):
+        return sum(len(stocks) for stocks in self.__entries.values())
+
+    def is_missing(self, report_type, stock_id) -> bool:
+        """
+        :return: True if the stock is known missing and it's not expired
+        """
+        expire_at = self.__entries.get(report_type, {}).get(stock_id)
+        return expire_at is not None and time.time() < expire_at
+
+    def mark_missing(self, report_type, stock_id):
+        with self.__lock:
+            self.__entries.setdefault(report_type, {})[stock_id] = time.time() + self.__ttl_seconds
+            self.__write()
+
+    def forget(self, report_type, stock_id):
+        with self.__lock:
+            if self.__entries.get(report_type, {}).pop(stock_id, None) is not None:
+                self.__write()
+
+    def clear(self):
+        with self.__lock:
+            self.__entries = {}
+            self.__write()
+
+    def __read(self) -> dict:
+        if not os.path.exists(self.__path):
+            return {}
+        with open(self.__path, encoding="utf-8") as file:
+            return json.load(file)
+
+    def __write(self):
+        os.makedirs(os.path.dirname(self.__path) or ".", exist_ok=True)
+        write_json_atomically(self.__path, self.__entries)
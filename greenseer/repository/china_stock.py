@@ -15,19 +15,95 @@
 #
 
 import logging
-from urllib import request
+import os
+import threading
+import time
 
 import numpy as np
 import pandas as pd
-import tushare as ts
 from pandas import DataFrame
 
-from greenseer.repository import ReportRepository, ReportLocalData, RemoteFetcher
+from greenseer.configuration import get_global_configuration
+from greenseer.repository import ReportRepository, ReportLocalData, RemoteFetcher, ParquetLocalData, \
+    SegmentLocalData, NegativeCache, migrate_local_data, replace_file_atomically
 
 NET_EASE_ENCODE = 'gb2312'
 
+# the na strings of read_csv and "--" of NetEase, they were all filled by the zero na value before
+NET_EASE_NA_VALUES = {"--", "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+                      "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"}
+
+CHINA_REPORT_FOLDERS = ["china_assert_reports", "china_cash_reports", "china_income_reports"]
+
 TU_SHARE_SINA_DAILY = {'amount': np.float64, 'volume': np.float64}
 
+CHINA_STOCK_CONFIG_SECTION = "china_stock_config"
+
+STOCK_BASIC_SNAPSHOT_NAME = "china_stock_basics"
+
+DEFAULT_STOCK_BASIC_TTL_SECONDS = 24 * 60 * 60
+
+STOCK_BASIC_RETRY_SECONDS = 10 * 60
+
+DEFAULT_REMOTE_TIMEOUT_SECONDS = 10
+
+DEFAULT_REMOTE_POOL_SIZE = 10
+
+NEGATIVE_CACHE_NAME = "china_stock_missing_reports.json"
+
+DEFAULT_NEGATIVE_CACHE_TTL_SECONDS = 7 * 86400
+
+
+class RemoteSession:
+    """
+    a keep-alive http session. the connections are kept in a pool and reused by all the requests,
+    so only the first request to a host pays for the connection setup.
+    the response is transferred with gzip and decoded automatically.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, pool_size=DEFAULT_REMOTE_POOL_SIZE, timeout=DEFAULT_REMOTE_TIMEOUT_SECONDS):
+        """
+
+        :param pool_size: max connections kept for one host, it should be bigger than the threads fetch at same time
+        :param timeout: seconds to wait for the server of each request
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.__timeout = timeout
+        self.__session = requests.Session()
+        self.__session.headers.update({"Accept-Encoding": "gzip"})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.__session.mount("http://", adapter)
+        self.__session.mount("https://", adapter)
+
+    @property
+    def timeout(self):
+        return self.__timeout
+
+    def get(self, url) -> bytes:
+        response = self.__session.get(url, timeout=self.__timeout)
+        response.raise_for_status()
+        return response.content
+
+    def close(self):
+        self.__session.close()
+
+
+_global_remote_session = None
+
+
+def get_global_remote_session() -> RemoteSession:
+    """
+    the session shared by all the remote fetchers, it will be created at the first call
+    """
+    global _global_remote_session
+    if _global_remote_session is None:
+        _global_remote_session = RemoteSession()
+    return _global_remote_session
+
 
 class TuShareStockBasicFetcher(RemoteFetcher):
 
@@ -62,24 +138,92 @@ class TuShareStockBasicFetcher(RemoteFetcher):
 
 class NetEaseRemoteFetcher(RemoteFetcher):
 
-    def __init__(self, remote_path_format):
+    def __init__(self, remote_path_format, session: RemoteSession = None):
+        """
+
+        :param remote_path_format: url format, stock id will be the parameter
+        :param session: http session, the global one will be used if it's None
+        """
         self.__remote_path_format = remote_path_format
+        self.__session = session
         self.logger.debug("remote path format is %s", remote_path_format)
 
+    @property
+    def session(self) -> RemoteSession:
+        if self.__session is None:
+            self.__session = get_global_remote_session()
+        return self.__session
+
     def initial_remote_data(self, stock_id):
         path = self.__remote_path_format.format(stock_id)
         self.logger.debug("file path is %s", path)
-        with request.urlopen(path) as web:
-            local = pd.read_csv(web, encoding=NET_EASE_ENCODE, na_values='--',
-                                index_col=ChinaAssertRepository.INDEX_COL)
-            return local.drop(local.columns[len(local.columns) - 1], axis=1).fillna(
-                ChinaAssertRepository.ZERO_NA_VALUE).apply(pd.to_numeric,
-                                                           errors='coerce')
+        try:
+            return parse_net_ease_report(self.session.get(path), ChinaAssertRepository.ZERO_NA_VALUE)
+        except (ValueError, UnicodeDecodeError):
+            # the delisted or newly listed stocks get an empty or broken file
+            self.logger.warning("{} returns no report".format(path))
+            return pd.DataFrame()
 
     def load_remote(self, stock_id):
         return self.initial_remote_data(stock_id)
 
 
+def parse_net_ease_report(payload: bytes, na_value=0) -> DataFrame:
+    """
+    parse the csv report of NetEase in one pass. the first column is the item and the first row is the report dates,
+    each row ends with a comma, so there's an empty column at last. the cells may be padded by spaces.
+    the items are kept as they are sent, like the leading space of the cash flow items, so they are the same as
+    the columns of the records already in local.
+
+    the cells are converted to float together instead of column by column, and the array is kept in
+    report date by item order, the frame returned is its transposed view. so the repository can transpose
+    it back to the final orientation without copy.
+
+    :param payload: the response of NetEase
+    :param na_value: the value of "--", the empty cells and the other na strings of read_csv, like "NA" or "nan"
+    :return: item by report date, the same layout as the response. empty if there's no row
+    :raise ValueError: if the payload isn't a report
+    """
+    lines = [line for line in payload.decode(NET_EASE_ENCODE).splitlines() if line.strip() != ""]
+    if len(lines) < 2:
+        return pd.DataFrame()
+
+    header = lines[0].split(",")
+    if len(header) < 2:
+        raise ValueError("{} isn't a report header".format(lines[0][:50]))
+    dates = [date.strip() for date in header[1:]]
+    if dates[-1] == "":
+        dates = dates[:-1]
+    rows = [line.split(",") for line in lines[1:]]
+    items = [row[0] for row in rows]
+    cells = [_pad_cells(row[1:len(dates) + 1], len(dates)) for row in rows]
+    values = np.ascontiguousarray(_to_float_array(cells, na_value).reshape(len(rows), len(dates)).T)
+    return DataFrame(values.T, index=pd.Index(items, name=header[0]), columns=dates, copy=False)
+
+
+def _to_float_array(cells: list, na_value) -> np.ndarray:
+    """
+    all the cells are converted by numpy at once, the spaces around the numbers are skipped.
+    if any cell is empty or not a number, they are converted one by one
+    """
+    text = ",".join(",".join(row) for row in cells).replace("--", str(na_value))
+    try:
+        values = np.array(text.split(","), dtype=np.float64)
+        # only the na strings like "nan" can be converted to nan
+        values[np.isnan(values)] = na_value
+        return values
+    except ValueError:
+        pass
+
+    flat = pd.Series([cell for row in cells for cell in row]).str.strip()
+    flat = flat.mask(flat.isin(NET_EASE_NA_VALUES), str(na_value))
+    return pd.to_numeric(flat, errors="coerce").to_numpy(dtype=np.float64)
+
+
+def _pad_cells(cells: list, length) -> list:
+    return cells if len(cells) == length else cells + [""] * (length - len(cells))
+
+
 class ChinaAssertRepository(ReportRepository, NetEaseRemoteFetcher):
     INDEX_COL = 0
 
@@ -87,12 +231,9 @@ class ChinaAssertRepository(ReportRepository, NetEaseRemoteFetcher):
 
     logger = logging.getLogger()
 
-    def __init__(self, local_repository):
+    def __init__(self, local_repository, session: RemoteSession = None):
         ReportRepository.__init__(self, local_repository)
-        NetEaseRemoteFetcher.__init__(self, 'http://quotes.money.163.com/service/zcfzb_{}.html')
-
-    def load_data(self, stock_id, force_remote=False, remote_delay_max_seconds=None) -> DataFrame:
-        return super().load_data(stock_id, force_remote, remote_delay_max_seconds).T
+        NetEaseRemoteFetcher.__init__(self, 'http://quotes.money.163.com/service/zcfzb_{}.html', session)
 
 
 class ChinaCashRepository(ReportRepository, NetEaseRemoteFetcher):
@@ -102,12 +243,9 @@ class ChinaCashRepository(ReportRepository, NetEaseRemoteFetcher):
 
     logger = logging.getLogger()
 
-    def __init__(self, local_repository):
+    def __init__(self, local_repository, session: RemoteSession = None):
         ReportRepository.__init__(self, local_repository)
-        NetEaseRemoteFetcher.__init__(self, 'http://quotes.money.163.com/service/xjllb_{}.html')
-
-    def load_data(self, stock_id, force_remote=False, remote_delay_max_seconds=None) -> DataFrame:
-        return super().load_data(stock_id, force_remote, remote_delay_max_seconds).T
+        NetEaseRemoteFetcher.__init__(self, 'http://quotes.money.163.com/service/xjllb_{}.html', session)
 
 
 class ChinaIncomeRepository(ReportRepository, NetEaseRemoteFetcher):
@@ -117,53 +255,170 @@ class ChinaIncomeRepository(ReportRepository, NetEaseRemoteFetcher):
 
     logger = logging.getLogger()
 
-    def __init__(self, local_repository):
+    def __init__(self, local_repository, session: RemoteSession = None):
         ReportRepository.__init__(self, local_repository)
-        NetEaseRemoteFetcher.__init__(self, 'http://quotes.money.163.com/service/lrb_{}.html')
-
-    def load_data(self, stock_id, force_remote=False, remote_delay_max_seconds=None) -> DataFrame:
-        return super().load_data(stock_id, force_remote, remote_delay_max_seconds).T
+        NetEaseRemoteFetcher.__init__(self, 'http://quotes.money.163.com/service/lrb_{}.html', session)
 
 
 class BasicInfoRepository(TuShareStockBasicFetcher):
-    def __init__(self):
+    """
+    the stock list is kept in a local parquet snapshot.
+    in ttl_seconds it's only read from the snapshot. after that, the snapshot is still returned and a background
+    thread will refresh it from remote, so the caller never waits for the network unless there's no snapshot
+    """
+
+    def __init__(self, base_folder="reportData", ttl_seconds=None):
+        """
+
+        :param base_folder: the snapshot will be kept in base_folder/greenseer
+        :param ttl_seconds: how long the snapshot is fresh, default is stock_basic_ttl_seconds in configuration
+        """
+        import tushare as ts
+
         TuShareStockBasicFetcher.__init__(self, ts.get_stock_basics)
         self.__cache = None
+        self.__snapshot_path = "{}/greenseer/{}.parquet".format(base_folder, STOCK_BASIC_SNAPSHOT_NAME)
+        if ttl_seconds is None:
+            ttl_seconds = get_global_configuration().get_int_value(CHINA_STOCK_CONFIG_SECTION,
+                                                                   "stock_basic_ttl_seconds",
+                                                                   DEFAULT_STOCK_BASIC_TTL_SECONDS)
+        self.__ttl_seconds = ttl_seconds
+        self.__next_refresh_time = 0
+        self.__refresh_thread = None
+        self.__lock = threading.Lock()
+
+    @property
+    def ttl_seconds(self):
+        return self.__ttl_seconds
 
     def initial_remote_data(self):
-        self.__cache = ts.get_stock_basics()
+        import tushare as ts
+
+        data = ts.get_stock_basics()
+        os.makedirs(os.path.dirname(self.__snapshot_path), exist_ok=True)
+        replace_file_atomically(self.__snapshot_path, data.to_parquet)
+        self.__cache = data
+        self.__next_refresh_time = time.time() + self.__ttl_seconds
         return self.__cache
 
     def load_data(self, stock_id=None) -> pd.DataFrame:
         if self.__cache is None:
-            self.initial_remote_data()
-
+            if not os.path.exists(self.__snapshot_path):
+                return self.initial_remote_data()
+            self.__cache = pd.read_parquet(self.__snapshot_path)
+            snapshot_time = os.path.getmtime(self.__snapshot_path)
+            self.__next_refresh_time = snapshot_time + self.__ttl_seconds
+
+        if time.time() >= self.__next_refresh_time:
+            self.__refresh_in_background()
         return self.__cache
 
+    def wait_for_refresh(self, timeout=None):
+        """
+        block until the background refresh finish, do nothing if there's no refresh
+        """
+        thread = self.__refresh_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def __refresh_in_background(self):
+        with self.__lock:
+            if self.__refresh_thread is not None and self.__refresh_thread.is_alive():
+                return
+            self.logger.info("stock basic info snapshot is expired, refresh it in background")
+            self.__refresh_thread = threading.Thread(target=self.__refresh_snapshot, name="stock-basic-refresh",
+                                                     daemon=True)
+            self.__refresh_thread.start()
+
+    def __refresh_snapshot(self):
+        try:
+            self.initial_remote_data()
+        except Exception:
+            self.logger.exception("refresh stock basic info failed, the snapshot will be used")
+            self.__next_refresh_time = time.time() + STOCK_BASIC_RETRY_SECONDS
+
 
-Global_BASIC_INFO_REPOSITORY = BasicInfoRepository()
+Global_BASIC_INFO_REPOSITORY = None
 
 
-def get_global_basic_info_repository() -> Global_BASIC_INFO_REPOSITORY:
+def get_global_basic_info_repository() -> BasicInfoRepository:
+    """
+    the repository is created at the first call, so importing this module won't touch the disk or network
+    """
+    global Global_BASIC_INFO_REPOSITORY
+    if Global_BASIC_INFO_REPOSITORY is None:
+        Global_BASIC_INFO_REPOSITORY = BasicInfoRepository()
     return Global_BASIC_INFO_REPOSITORY
 
 
-def create_china_stock_assert_repository(local_source=None, base_folder="reportData") -> ChinaAssertRepository:
-    if local_source is None:
-        local_source = ReportLocalData(base_folder + "/greenseer/china_assert_reports")
+def create_china_stock_negative_cache(base_folder="reportData", ttl_seconds=None) -> NegativeCache:
+    """
+    the stocks NetEase has no report for, shared by the three report repositories
 
-    return ChinaAssertRepository(local_source)
+    :param base_folder: the cache will be kept in base_folder/greenseer
+    :param ttl_seconds: how long a stock is known missing, default is negative_cache_ttl_seconds in configuration
+    """
+    if ttl_seconds is None:
+        ttl_seconds = get_global_configuration().get_int_value(CHINA_STOCK_CONFIG_SECTION,
+                                                               "negative_cache_ttl_seconds",
+                                                               DEFAULT_NEGATIVE_CACHE_TTL_SECONDS)
+    return NegativeCache("{}/greenseer/{}".format(base_folder, NEGATIVE_CACHE_NAME), ttl_seconds)
 
 
-def create_china_stock_cash_repository(local_source=None, base_folder="reportData") -> ChinaCashRepository:
+def create_china_stock_assert_repository(local_source=None, base_folder="reportData",
+                                         local_source_type=ReportLocalData, session=None) -> ChinaAssertRepository:
     if local_source is None:
-        local_source = ReportLocalData(base_folder + "/greenseer/china_cash_reports")
+        local_source = local_source_type(base_folder + "/greenseer/china_assert_reports")
 
-    return ChinaCashRepository(local_source)
+    return ChinaAssertRepository(local_source, session)
 
 
-def create_china_stock_income_repository(local_source=None, base_folder="reportData") -> ChinaIncomeRepository:
+def create_china_stock_cash_repository(local_source=None, base_folder="reportData",
+                                       local_source_type=ReportLocalData, session=None) -> ChinaCashRepository:
     if local_source is None:
-        local_source = ReportLocalData(base_folder + "/greenseer/china_income_reports")
+        local_source = local_source_type(base_folder + "/greenseer/china_cash_reports")
 
-    return ChinaIncomeRepository(local_source)
+    return ChinaCashRepository(local_source, session)
+
+
+def create_china_stock_income_repository(local_source=None, base_folder="reportData",
+                                         local_source_type=ReportLocalData, session=None) -> ChinaIncomeRepository:
+    if local_source is None:
+        local_source = local_source_type(base_folder + "/greenseer/china_income_reports")
+
+    return ChinaIncomeRepository(local_source, session)
+
+
+def migrate_china_stock_reports(base_folder="reportData", local_source_type=ParquetLocalData,
+                                remove_source=False) -> int:
+    """
+    migrate the gzip csv reports under base_folder to another local source type. the new files will be
+    kept in the same folders, so the repository can be created with the same base_folder and the new type
+
+    :param base_folder: same as the base_folder of create_china_stock_xxx_repository
+    :param local_source_type: the type of target local source
+    :param remove_source: remove the gzip csv after migrate
+    :return: total records has been migrated
+    """
+    total = 0
+    for report_folder in CHINA_REPORT_FOLDERS:
+        folder = base_folder + "/greenseer/" + report_folder
+        total += migrate_local_data(ReportLocalData(folder), local_source_type(folder), remove_source)
+    return total
+
+
+def compact_china_stock_reports(base_folder="reportData", local_source_type=ReportLocalData) -> int:
+    """
+    pack the reports of each report type into one memory-mapped segment in the same folder,
+    then the repository can be created with local_source_type=SegmentLocalData
+
+    :param base_folder: same as the base_folder of create_china_stock_xxx_repository
+    :param local_source_type: the type of the local source to pack, SegmentLocalData to compact the segment itself
+    :return: total records has been packed
+    """
+    total = 0
+    for report_folder in CHINA_REPORT_FOLDERS:
+        folder = base_folder + "/greenseer/" + report_folder
+        segment = SegmentLocalData(folder)
+        total += segment.compact(None if local_source_type is SegmentLocalData else local_source_type(folder))
+    return total
@@ -0,0 +1,82 @@
+#  Copyright (c) 2020 GreenSeer (https://chandlersong.me)
+#  Copyright (c) 2020 chandler.song
+#
+#  Licensed under the GNU GENERAL PUBLIC LICENSE v3.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       https://www.gnu.org/licenses/gpl-3.0.html
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import json
+import logging
+import os
+import uuid
+
+
+def replace_file_atomically(file_path, write):
+    """
+    write to a temp file in the same folder then rename it to file_path,
+    so file_path is either the old file or the complete new file even if the process crash.
+
+    :param file_path: target file
+    :param write: function receive the temp file path and write the content
+    """
+    temp_path = "{}.{}.tmp".format(file_path, uuid.uuid4().hex)
+    try:
+        write(temp_path)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def read_json_lines(file_path) -> list:
+    """
+    read a journal of json lines, each line is one json value
+
+    :param file_path: the journal
+    :return: the values in order, the broken lines are skipped
+    """
+    values = []
+    with open(file_path, encoding="utf-8") as journal:
+        for line in journal:
+            try:
+                values.append(json.loads(line))
+            except ValueError:
+                # the last line may be broken if the process crash when appending it
+                logging.getLogger().warning("broken line in {} is ignored".format(file_path))
+    return values
+
+
+def append_json_line(file_path, value):
+    with open(file_path, "a", encoding="utf-8") as journal:
+        journal.write(json.dumps(value, ensure_ascii=False) + "\n")
+
+
+def rewrite_json_lines(file_path, values):
+    """
+    replace the journal with the values atomically, one json value each line
+    """
+
+    def write(path):
+        with open(path, "w", encoding="utf-8") as journal:
+            for value in values:
+                journal.write(json.dumps(value, ensure_ascii=False) + "\n")
+
+    replace_file_atomically(file_path, write)
+
+
+def write_json_atomically(file_path, value):
+    def write(path):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(value, file, ensure_ascii=False)
+
+    replace_file_atomically(file_path, write)
@@ -0,0 +1,214 @@
+#  Copyright (c) 2020 GreenSeer (https://chandlersong.me)
+#  Copyright (c) 2020 chandler.song
+#
+#  Licensed under the GNU GENERAL PUBLIC LICENSE v3.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       https://www.gnu.org/licenses/gpl-3.0.html
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import gzip
+import logging
+import os
+
+import pandas as pd
+from pandas import DataFrame
+
+from greenseer.repository.files import replace_file_atomically
+from greenseer.repository.local_source import LocalSource, to_report_date_index, from_report_date_index
+from greenseer.repository.manifest import SourceManifest
+
+
+class ReportLocalData(LocalSource):
+    """
+    the source is a folder, it work like a table in the database
+    each record will be used as a file
+
+    the records written by the source are listed in the manifest of the folder, so exist doesn't need to
+    check the file system for them
+    """
+
+    FILE_EXTENSION = ".gz"
+
+    MANIFEST_FILE_FORMAT = "manifest{}.jsonl"
+
+    logger = logging.getLogger()
+
+    def __init__(self, source_folder):
+        self.__source_folder = source_folder
+        if not os.path.exists(self.__source_folder):
+            self.logger.info('%s not exists,auto create!!!' % self.__source_folder)
+            os.makedirs(self.__source_folder, exist_ok=True)
+        else:
+            self.logger.info('%s exists' % self.__source_folder)
+        self.file_format = source_folder + "/{}" + self.FILE_EXTENSION
+        self.__manifest = SourceManifest(os.path.join(source_folder, self.MANIFEST_FILE_FORMAT.format(
+            self.FILE_EXTENSION)), source_folder, self.FILE_EXTENSION)
+
+    @property
+    def source_folder(self):
+        return self.__source_folder
+
+    @property
+    def manifest(self) -> SourceManifest:
+        return self.__manifest
+
+    def list_identifies(self) -> list:
+        """
+        list all the records in the folder
+        :return: identifies sorted by name
+        """
+        return sorted(name[:-len(self.FILE_EXTENSION)] for name in os.listdir(self.__source_folder)
+                      if name.endswith(self.FILE_EXTENSION))
+
+    def refresh_data(self, df: DataFrame, identify):
+        file_path = self.file_format.format(identify)
+        if identify in self.__manifest:
+            self.logger.info("{} exists and will be replaced".format(file_path))
+
+        data = df.sort_index()
+        replace_file_atomically(file_path, lambda path: data.to_csv(path, encoding="utf-8", compression="gzip"))
+        self.__manifest.record(identify, file_path, data.columns, data)
+
+    def refresh_data_in_chunks(self, chunks, identify):
+        """
+        write a record too big to keep in memory. the chunks are appended to the file one by one,
+        the file is the same as refresh_data with the concat of the chunks, the index is renumbered.
+
+        :param chunks: iterable of data frames with the same columns, there should be one chunk at least
+        :param identify: the record
+        """
+        file_path = self.file_format.format(identify)
+
+        def write(path):
+            start = 0
+            with gzip.open(path, "wt", encoding="utf-8", newline="") as file:
+                for i, chunk in enumerate(chunks):
+                    chunk = chunk.set_axis(pd.RangeIndex(start, start + len(chunk)))
+                    chunk.to_csv(file, header=i == 0)
+                    start += len(chunk)
+
+        replace_file_atomically(file_path, write)
+        self.__manifest.record(identify, file_path, [], None)
+
+    def load_data(self, identify, index_col=0, dtype=None, parse_dates=True, *args, **kwargs) -> DataFrame:
+        try:
+            return pd.read_csv(self.file_format.format(identify), index_col=index_col, compression="gzip",
+                               parse_dates=parse_dates, dtype=dtype)
+        except FileNotFoundError:
+            self.logger.error("{} not exists in local".format(identify))
+            self.__manifest.remove(identify)
+            return pd.DataFrame()
+
+    def exist(self, stock_id):
+        """
+        the records not in the manifest may be written by others, like another process, so the file is checked
+        """
+        return stock_id in self.__manifest or os.path.exists(self.file_format.format(stock_id))
+
+    def remove_data(self, identify):
+        os.remove(self.file_format.format(identify))
+        self.__manifest.remove(identify)
+
+
+class ParquetLocalData(ReportLocalData):
+    """
+    same folder layout as ReportLocalData, but each record is kept as a typed columnar parquet file.
+    so a load doesn't need to parse the text, the dates and infer the dtypes again.
+
+    the report is kept in its final orientation, report date by item with a DatetimeIndex, and the layout version
+    is written in the file metadata. the old files are migrated when they are loaded:
+    layout 1 parquet files (item by report date) and the gzip csv files of ReportLocalData in the same folder.
+    """
+
+    FILE_EXTENSION = ".parquet"
+
+    LAYOUT_METADATA_KEY = b"greenseer.layout"
+
+    LAYOUT_VERSION = b"2"
+
+    REPORT_DATE_AS_INDEX = True
+
+    def __init__(self, source_folder):
+        super().__init__(source_folder)
+        self.__legacy_source = ReportLocalData(source_folder)
+
+    def refresh_data(self, df: DataFrame, identify):
+        self.__write(to_report_date_index(df), identify)
+
+    def load_data(self, identify, *args, **kwargs) -> DataFrame:
+        """
+        the parameters of ReportLocalData.load_data is for parsing text. they are useless here because all the
+        types are kept in the file.
+        """
+        import pyarrow.parquet as pq
+
+        try:
+            table = pq.read_table(self.file_format.format(identify))
+        except FileNotFoundError:
+            if self.__legacy_source.exist(identify):
+                return self.__migrate_csv(identify)
+            self.logger.error("{} not exists in local".format(identify))
+            self.manifest.remove(identify)
+            return pd.DataFrame()
+
+        data = table.to_pandas()
+        if (table.schema.metadata or {}).get(self.LAYOUT_METADATA_KEY) != self.LAYOUT_VERSION:
+            self.logger.info("{} is layout 1, migrate it to layout {}".format(identify, self.LAYOUT_VERSION))
+            data = to_report_date_index(data)
+            self.__write(data, identify)
+        return data
+
+    def exist(self, stock_id):
+        return super().exist(stock_id) or self.__legacy_source.exist(stock_id)
+
+    def __migrate_csv(self, identify) -> DataFrame:
+        self.logger.info("{} only exists as gzip csv, migrate it to parquet".format(identify))
+        data = to_report_date_index(self.__legacy_source.load_data(identify))
+        self.__write(data, identify)
+        return data
+
+    def __write(self, data: DataFrame, identify):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        file_path = self.file_format.format(identify)
+        if identify in self.manifest:
+            self.logger.info("{} exists and will be replaced".format(file_path))
+
+        data = data.sort_index(axis=1).sort_index(ascending=False)
+        data.columns = data.columns.map(str)
+        table = pa.Table.from_pandas(data)
+        metadata = dict(table.schema.metadata or {})
+        metadata[self.LAYOUT_METADATA_KEY] = self.LAYOUT_VERSION
+        table = table.replace_schema_metadata(metadata)
+        replace_file_atomically(file_path, lambda path: pq.write_table(table, path))
+        self.manifest.record(identify, file_path, data.index, data)
+
+
+def migrate_local_data(source: ReportLocalData, target: LocalSource, remove_source=False) -> int:
+    """
+    copy all the records from one local source to another. like from gzip csv to parquet.
+
+    :param source: the source to read from
+    :param target: the source to write to
+    :param remove_source: remove the origin file after it has been migrated
+    :return: how many records has been migrated
+    """
+    identifies = source.list_identifies()
+    for identify in identifies:
+        data = source.load_data(identify)
+        if source.report_date_as_index:
+            data = from_report_date_index(data)
+        target.refresh_data(data, identify)
+        if remove_source:
+            source.remove_data(identify)
+    source.logger.info("{} records migrate from {}".format(len(identifies), source.source_folder))
+    return len(identifies)
@@ -0,0 +1,111 @@
+#  Copyright (c) 2020 GreenSeer (https://chandlersong.me)
+#  Copyright (c) 2020 chandler.song
+#
+#  Licensed under the GNU GENERAL PUBLIC LICENSE v3.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       https://www.gnu.org/licenses/gpl-3.0.html
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import abc
+from abc import ABC
+
+import pandas as pd
+from pandas import DataFrame
+
+
+class LocalSource(ABC):
+    """
+    this is a interface. Because I am familiar with interface in java. I use a stupid solution here.
+    need to be changed if there's a good solution
+
+    refresh_data always receive the report as remote provide it, item by report date.
+    if REPORT_DATE_AS_INDEX is True, load_data returns the report date by item with a DatetimeIndex,
+    so the repository doesn't need to transpose it on every read.
+    """
+
+    REPORT_DATE_AS_INDEX = False
+
+    @property
+    def report_date_as_index(self) -> bool:
+        return self.REPORT_DATE_AS_INDEX
+
+    @abc.abstractmethod
+    def load_data(self, *args, **kwargs) -> DataFrame:
+        """
+        load data from repository
+        :param stock_id:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        pass
+
+    @abc.abstractmethod
+    def refresh_data(self, df: DataFrame, stock_id):
+        pass
+
+    @abc.abstractmethod
+    def exist(self, stock_id):
+        """
+        check data is dirty or not
+        :param stock_id:
+        :return:
+        """
+        pass
+
+    def update_data(self, df: DataFrame, stock_id):
+        """
+        update part of the record, the columns in df will replace the same columns in local or be appended.
+        the default way is merge it with the local record and refresh the whole record.
+        the implementation can override it if it can append data directly
+        :param df: new or changed columns
+        :param stock_id:
+        :return:
+        """
+        local = self.load_data(stock_id)
+        if self.report_date_as_index:
+            local = from_report_date_index(local)
+        self.refresh_data(merge_report_columns(local, df), stock_id)
+
+
+def merge_report_columns(local: DataFrame, update: DataFrame) -> DataFrame:
+    """
+    the columns in update will replace the same columns in local, the new columns will be appended.
+    the latest quarter will be the first column, the same as the report from remote.
+    """
+    if local.empty:
+        return update
+    kept = local.drop(columns=update.columns.intersection(local.columns))
+    return pd.concat([kept, update], axis=1).sort_index(axis=1, ascending=False)
+
+
+def to_report_date_index(data: DataFrame) -> DataFrame:
+    """
+    item by report date, the layout from remote, to report date by item with a DatetimeIndex
+    """
+    result = data.T
+    result.index = pd.to_datetime(result.index)
+    return result
+
+
+def from_report_date_index(data: DataFrame) -> DataFrame:
+    """
+    the reverse of to_report_date_index, the report dates are columns like "2019-12-31" again
+    """
+    if data.empty:
+        return pd.DataFrame()
+    result = data.T
+    result.columns = pd.to_datetime(result.columns).strftime("%Y-%m-%d")
+    return result
+
+
+def to_report_date(value) -> str:
+    return pd.Timestamp(value).strftime("%Y-%m-%d")
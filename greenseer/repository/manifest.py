@@ -0,0 +1,159 @@
+#  Copyright (c) 2020 GreenSeer (https://chandlersong.me)
+#  Copyright (c) 2020 chandler.song
+#
+#  Licensed under the GNU GENERAL PUBLIC LICENSE v3.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       https://www.gnu.org/licenses/gpl-3.0.html
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import hashlib
+import logging
+import os
+import threading
+
+import pandas as pd
+from pandas import DataFrame
+
+from greenseer.repository.files import read_json_lines, append_json_line, rewrite_json_lines
+from greenseer.repository.local_source import to_report_date
+
+
+class SourceManifest:
+    """
+    what's in a folder source: the row count, the last report date, content hash, byte size and write time
+    of each record. it's loaded into memory once, so the source doesn't need to touch the file system to know
+    a record exists, and the stale records can be found without opening any data file.
+
+    the manifest is a json lines journal, each refresh appends one line, so the update is atomic and cheap even
+    if there are thousands of records. when it grows much larger than the records, it's rewritten atomically.
+    if there's no manifest yet, the folder is scanned once, the rows, dates and hash are unknown until the record
+    is refreshed again.
+    """
+
+    COLUMNS = ["rows", "last_report_date", "content_hash", "bytes", "written_at"]
+
+    logger = logging.getLogger()
+
+    def __init__(self, manifest_path, source_folder, file_extension):
+        self.__manifest_path = manifest_path
+        self.__source_folder = source_folder
+        self.__file_extension = file_extension
+        self.__entries = None
+        self.__journal_lines = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def manifest_path(self):
+        return self.__manifest_path
+
+    def __contains__(self, identify):
+        return identify in self.__load()
+
+    def __len__(self):
+        return len(self.__load())
+
+    def get(self, identify) -> dict:
+        """
+        :return: a copy of the entry, None if the record is unknown
+        """
+        entry = self.__load().get(identify)
+        return None if entry is None else dict(entry)
+
+    def identifies(self) -> list:
+        return sorted(self.__load())
+
+    def record(self, identify, file_path, report_dates, data: DataFrame):
+        """
+        called after the record is written
+
+        :param identify: the record
+        :param file_path: the file just written
+        :param report_dates: the report dates of the record, the values not a date are ignored
+        :param data: the content, it's used to compute the hash. None if it's too big to keep in memory
+        """
+        report_dates = pd.to_datetime(pd.Index(report_dates), errors="coerce").dropna()
+        entry = {"rows": len(report_dates),
+                 "last_report_date": report_dates.max().strftime("%Y-%m-%d") if len(report_dates) > 0 else None,
+                 "content_hash": None if data is None else _content_hash(data),
+                 "bytes": os.path.getsize(file_path),
+                 "written_at": os.path.getmtime(file_path)}
+        self.__append(identify, entry)
+
+    def remove(self, identify):
+        if identify in self.__load():
+            self.__append(identify, None)
+
+    def to_frame(self) -> DataFrame:
+        """
+        :return: one row for each record, index by identify
+        """
+        entries = self.__load()
+        return pd.DataFrame.from_dict(entries, orient="index", columns=self.COLUMNS).sort_index()
+
+    def stale_identifies(self, latest_report_date) -> list:
+        """
+        :param latest_report_date: like "2020-03-31"
+        :return: the records whose last report date is before latest_report_date or unknown
+        """
+        latest = to_report_date(latest_report_date)
+        return sorted(identify for identify, entry in self.__load().items()
+                      if entry["last_report_date"] is None or entry["last_report_date"] < latest)
+
+    def __load(self) -> dict:
+        if self.__entries is None:
+            with self.__lock:
+                if self.__entries is None:
+                    self.__entries = self.__read() if os.path.exists(self.__manifest_path) else self.__scan()
+        return self.__entries
+
+    def __read(self) -> dict:
+        entries = {}
+        for identify, entry in read_json_lines(self.__manifest_path):
+            self.__journal_lines += 1
+            if entry is None:
+                entries.pop(identify, None)
+            else:
+                entries[identify] = entry
+        return entries
+
+    def __scan(self) -> dict:
+        self.logger.info("{} not exists, scan {}".format(self.__manifest_path, self.__source_folder))
+        entries = {}
+        for file in os.scandir(self.__source_folder):
+            if file.name.endswith(self.__file_extension):
+                stat = file.stat()
+                entries[file.name[:-len(self.__file_extension)]] = {
+                    "rows": None, "last_report_date": None, "content_hash": None,
+                    "bytes": stat.st_size, "written_at": stat.st_mtime}
+        return entries
+
+    def __append(self, identify, entry):
+        entries = self.__load()
+        with self.__lock:
+            if entry is None:
+                entries.pop(identify, None)
+            else:
+                entries[identify] = entry
+            if self.__journal_lines > 2 * len(entries) + 100 or not os.path.exists(self.__manifest_path):
+                self.__rewrite(entries)
+            else:
+                append_json_line(self.__manifest_path, [identify, entry])
+                self.__journal_lines += 1
+
+    def __rewrite(self, entries):
+        rewrite_json_lines(self.__manifest_path, ([identify, entries[identify]] for identify in sorted(entries)))
+        self.__journal_lines = len(entries)
+
+
+def _content_hash(data: DataFrame) -> str:
+    digest = hashlib.sha1(pd.util.hash_pandas_object(data, index=True).values.tobytes())
+    digest.update(pd.util.hash_pandas_object(data.columns.to_series().map(str), index=False).values.tobytes())
+    return digest.hexdigest()
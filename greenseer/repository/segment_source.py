@@ -0,0 +1,181 @@
+#  Copyright (c) 2020 GreenSeer (https://chandlersong.me)
+#  Copyright (c) 2020 chandler.song
+#
+#  Licensed under the GNU GENERAL PUBLIC LICENSE v3.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       https://www.gnu.org/licenses/gpl-3.0.html
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from greenseer.repository.files import read_json_lines, append_json_line, write_json_atomically
+from greenseer.repository.local_source import LocalSource, to_report_date_index
+
+
+class SegmentLocalData(LocalSource):
+    """
+    all the records of the folder are packed into one segment file of contiguous float64 blocks,
+    and a small json index maps each record to its offset, shape, items and report dates.
+
+    the block is mapped by numpy.memmap, so loading a record doesn't parse or decompress anything and
+    the pages are shared by all the processes reading the same folder. the loaded frame is a copy-on-write
+    view, changing it won't touch the file or the other loaded frames.
+
+    refresh_data appends a new block and the old one becomes garbage, call compact() to pack the segment again.
+    the index isn't rewritten by refresh_data, the entry is appended to a json lines journal of the generation,
+    so refreshing thousands of records doesn't rewrite the whole index each time. compact() folds the journal
+    into the index.
+    compact() writes a new segment file with a new generation, so the readers never see a half written segment.
+    the index is read once when the source is created, create a new one to see the changes of other processes.
+    """
+
+    INDEX_FILE = "reports.segment.json"
+
+    SEGMENT_FILE_FORMAT = "reports.{}.segment"
+
+    JOURNAL_FILE_FORMAT = "reports.{}.segment.jsonl"
+
+    LAYOUT_VERSION = 1
+
+    REPORT_DATE_AS_INDEX = True
+
+    logger = logging.getLogger()
+
+    def __init__(self, source_folder):
+        self.__source_folder = source_folder
+        os.makedirs(source_folder, exist_ok=True)
+        self.__index_path = os.path.join(source_folder, self.INDEX_FILE)
+        self.__lock = threading.RLock()
+        self.__index = self.__read_index()
+        self.__item_ids = {tuple(items): i for i, items in enumerate(self.__index["items"])}
+
+    @property
+    def source_folder(self):
+        return self.__source_folder
+
+    @property
+    def segment_path(self):
+        return os.path.join(self.__source_folder, self.SEGMENT_FILE_FORMAT.format(self.__index["generation"]))
+
+    @property
+    def journal_path(self):
+        return os.path.join(self.__source_folder, self.JOURNAL_FILE_FORMAT.format(self.__index["generation"]))
+
+    def refresh_data(self, df: DataFrame, identify):
+        data = to_report_date_index(df).sort_index(ascending=False)
+        with self.__lock:
+            with open(self.segment_path, "ab") as segment:
+                offset = segment.tell()
+                segment.write(np.ascontiguousarray(data.to_numpy(dtype=np.float64)).tobytes())
+            item_count = len(self.__index["items"])
+            entry = _segment_entry(data, offset, self.__index["items"], self.__item_ids)
+            self.__index["stocks"][identify] = entry
+            # a new item list is kept in the same line, so the line can be replayed alone
+            new_items = self.__index["items"][entry["items"]] if entry["items"] >= item_count else None
+            append_json_line(self.journal_path, [identify, entry, new_items])
+
+    def load_data(self, identify, *args, **kwargs) -> DataFrame:
+        with self.__lock:
+            entry = self.__index["stocks"].get(identify)
+            if entry is None:
+                self.logger.error("{} not exists in local".format(identify))
+                return pd.DataFrame()
+            items = self.__index["items"][entry["items"]]
+            rows, cols = len(entry["dates"]), len(items)
+            segment_path = self.segment_path
+
+        if rows * cols == 0:
+            return pd.DataFrame(index=pd.DatetimeIndex(entry["dates"]), columns=items, dtype=np.float64)
+        values = np.memmap(segment_path, dtype=np.float64, mode="c", offset=entry["offset"], shape=(rows, cols))
+        return pd.DataFrame(values, index=pd.DatetimeIndex(entry["dates"]), columns=items, copy=False)
+
+    def exist(self, stock_id):
+        return stock_id in self.__index["stocks"]
+
+    def list_identifies(self) -> list:
+        return sorted(self.__index["stocks"])
+
+    def compact(self, source: LocalSource = None) -> int:
+        """
+        pack all the records into a new segment file, the garbage of the refreshed records is dropped
+
+        :param source: the records to pack, like a ReportLocalData of gzip csv. default is the segment itself
+        :return: how many records has been packed
+        """
+        if source is None:
+            source = self
+
+        with self.__lock:
+            generation = self.__index["generation"] + 1
+            segment_path = os.path.join(self.__source_folder, self.SEGMENT_FILE_FORMAT.format(generation))
+            stocks = {}
+            items = []
+            item_ids = {}
+            with open(segment_path, "wb") as segment:
+                for identify in source.list_identifies():
+                    data = source.load_data(identify)
+                    if not source.report_date_as_index:
+                        data = to_report_date_index(data)
+                    data = data.sort_index(ascending=False)
+                    stocks[identify] = _segment_entry(data, segment.tell(), items, item_ids)
+                    segment.write(np.ascontiguousarray(data.to_numpy(dtype=np.float64)).tobytes())
+
+            old_segment_path, old_journal_path = self.segment_path, self.journal_path
+            self.__index["generation"] = generation
+            self.__index["items"] = items
+            self.__index["stocks"] = stocks
+            self.__item_ids = item_ids
+            self.__write_index()
+            for old_path in [old_segment_path, old_journal_path]:
+                if os.path.exists(old_path):
+                    os.remove(old_path)
+
+        self.logger.info("{} records compacted into {}".format(len(stocks), segment_path))
+        return len(stocks)
+
+    def __read_index(self) -> dict:
+        if not os.path.exists(self.__index_path):
+            index = {"layout": self.LAYOUT_VERSION, "generation": 0, "items": [], "stocks": {}}
+        else:
+            with open(self.__index_path, encoding="utf-8") as index_file:
+                index = json.load(index_file)
+
+        journal_path = os.path.join(self.__source_folder, self.JOURNAL_FILE_FORMAT.format(index["generation"]))
+        if os.path.exists(journal_path):
+            for identify, entry, new_items in read_json_lines(journal_path):
+                if new_items is not None:
+                    index["items"].append(new_items)
+                index["stocks"][identify] = entry
+        return index
+
+    def __write_index(self):
+        write_json_atomically(self.__index_path, self.__index)
+
+
+def _segment_entry(data: DataFrame, offset, items: list, item_ids: dict) -> dict:
+    """
+    the index entry of one block. the stocks of the same report type have the same items mostly,
+    so each item list is kept once in items and the entry only keeps its position
+    """
+    columns = tuple(data.columns.map(str))
+    item_id = item_ids.get(columns)
+    if item_id is None:
+        item_id = len(items)
+        items.append(list(columns))
+        item_ids[columns] = item_id
+    return {"offset": offset, "items": item_id, "dates": list(data.index.strftime("%Y-%m-%d"))}
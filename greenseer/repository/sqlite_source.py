@@ -0,0 +1,173 @@
+#  Copyright (c) 2020 GreenSeer (https://chandlersong.me)
+#  Copyright (c) 2020 chandler.song
+#
+#  Licensed under the GNU GENERAL PUBLIC LICENSE v3.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       https://www.gnu.org/licenses/gpl-3.0.html
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import logging
+import os
+import sqlite3
+from contextlib import contextmanager
+
+import pandas as pd
+from pandas import DataFrame
+
+from greenseer.repository.local_source import LocalSource, to_report_date
+
+
+class SqliteLocalData(LocalSource):
+    """
+    all the records of the folder are kept in one embedded sqlite database, in long layout:
+    one row for each (code, release_at, item). the items of different reports are different, so the table
+    doesn't need to change when a new item appears.
+
+    code and release_at are indexed, so a cross-sectional query, like one item of all the stocks at one date,
+    doesn't need to open every record.
+    """
+
+    DATABASE_NAME = "reports.sqlite"
+
+    REPORT_DATE_AS_INDEX = True
+
+    QUERY_INDEX_NAMES = ["code", "releaseAt"]
+
+    MAX_QUERY_CODES = 500
+
+    logger = logging.getLogger()
+
+    def __init__(self, source_folder):
+        self.__source_folder = source_folder
+        os.makedirs(source_folder, exist_ok=True)
+        self.__database = os.path.join(source_folder, self.DATABASE_NAME)
+        with self.__connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS reports "
+                               "(code TEXT NOT NULL, release_at TEXT NOT NULL, item TEXT NOT NULL, value REAL, "
+                               "PRIMARY KEY (code, release_at, item))")
+            connection.execute("CREATE INDEX IF NOT EXISTS reports_release_at ON reports (release_at, item)")
+
+    @property
+    def source_folder(self):
+        return self.__source_folder
+
+    @property
+    def database(self):
+        return self.__database
+
+    def refresh_data(self, df: DataFrame, identify):
+        with self.__connect() as connection:
+            connection.execute("DELETE FROM reports WHERE code = ?", (identify,))
+            connection.executemany("INSERT INTO reports VALUES (?, ?, ?, ?)", _to_report_rows(df, identify))
+
+    def update_data(self, df: DataFrame, identify):
+        """
+        only the quarters in df are replaced, the others are not touched
+        """
+        rows = _to_report_rows(df, identify)
+        with self.__connect() as connection:
+            connection.executemany("DELETE FROM reports WHERE code = ? AND release_at = ?",
+                                   {(code, release_at) for code, release_at, _, _ in rows})
+            connection.executemany("INSERT INTO reports VALUES (?, ?, ?, ?)", rows)
+
+    def load_data(self, identify, *args, **kwargs) -> DataFrame:
+        """
+        the record is returned report date by item, the latest quarter is the first row.
+        """
+        with self.__connect() as connection:
+            data = pd.read_sql_query("SELECT release_at, item, value FROM reports WHERE code = ?", connection,
+                                     params=(identify,))
+        if data.empty:
+            self.logger.error("{} not exists in local".format(identify))
+            return pd.DataFrame()
+        data["release_at"] = pd.to_datetime(data["release_at"])
+        result = data.pivot(index="release_at", columns="item", values="value").sort_index(ascending=False)
+        result.index.name = None
+        result.columns.name = None
+        return result
+
+    def exist(self, stock_id):
+        with self.__connect() as connection:
+            row = connection.execute("SELECT 1 FROM reports WHERE code = ? LIMIT 1", (stock_id,)).fetchone()
+        return row is not None
+
+    def list_identifies(self) -> list:
+        with self.__connect() as connection:
+            return [row[0] for row in connection.execute("SELECT DISTINCT code FROM reports ORDER BY code")]
+
+    def query(self, items=None, codes=None, start=None, end=None) -> DataFrame:
+        """
+        query the reports of many stocks at once
+
+        :param items: the items to query, all the items if it's None
+        :param codes: the stocks to query, all the stocks if it's None
+        :param start: first report date, like "2019-12-31", included
+        :param end: last report date, included
+        :return: data frame index by (code, releaseAt), each item is a column
+        """
+        if codes is None:
+            data = self.__query(items, None, start, end)
+        else:
+            codes = list(codes)
+            data = pd.concat([self.__query(items, codes[i:i + self.MAX_QUERY_CODES], start, end)
+                              for i in range(0, max(len(codes), 1), self.MAX_QUERY_CODES)])
+
+        data["release_at"] = pd.to_datetime(data["release_at"])
+        result = data.set_index(["code", "release_at", "item"])["value"].unstack("item")
+        result.index.names = self.QUERY_INDEX_NAMES
+        result.columns.name = None
+        return result
+
+    def __query(self, items, codes, start, end) -> DataFrame:
+        conditions = []
+        params = []
+        if items is not None:
+            conditions.append("item IN ({})".format(",".join("?" * len(items))))
+            params.extend(items)
+        if codes is not None:
+            conditions.append("code IN ({})".format(",".join("?" * len(codes))))
+            params.extend(codes)
+        if start is not None:
+            conditions.append("release_at >= ?")
+            params.append(to_report_date(start))
+        if end is not None:
+            conditions.append("release_at <= ?")
+            params.append(to_report_date(end))
+
+        sql = "SELECT code, release_at, item, value FROM reports"
+        if len(conditions) > 0:
+            sql += " WHERE " + " AND ".join(conditions)
+        with self.__connect() as connection:
+            return pd.read_sql_query(sql, connection, params=params)
+
+    @contextmanager
+    def __connect(self):
+        """
+        a new connection for each call, so it can be used by different threads.
+        the changes are committed when it exits without error
+        """
+        connection = sqlite3.connect(self.__database, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+
+def _to_report_rows(df: DataFrame, identify) -> list:
+    """
+    item by date data frame to (code, release_at, item, value) rows
+    """
+    data = df.copy()
+    data.columns = pd.to_datetime(data.columns).strftime("%Y-%m-%d")
+    stacked = data.stack(dropna=False)
+    values = stacked.astype(float).astype(object).where(stacked.notna(), None)
+    return [(identify, release_at, item, value) for (item, release_at), value in values.items()]
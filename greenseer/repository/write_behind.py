@@ -0,0 +1,145 @@
+#  Copyright (c) 2020 GreenSeer (https://chandlersong.me)
+#  Copyright (c) 2020 chandler.song
+#
+#  Licensed under the GNU GENERAL PUBLIC LICENSE v3.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       https://www.gnu.org/licenses/gpl-3.0.html
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import atexit
+import logging
+import queue
+import threading
+
+from pandas import DataFrame
+
+from greenseer.repository.local_source import LocalSource, to_report_date_index
+
+
+class WriteBehindLocalData(LocalSource):
+    """
+    wrap a local source and write the records in background threads, so the caller doesn't wait for compression.
+    the records which haven't been written are kept in memory, load_data and exist can still see them.
+    if one record is refreshed again before it's written, only the latest one will be written.
+
+    call flush() to wait all the records are written, or use it as a context manager.
+    the workers are daemon threads, so the pending records are flushed at exit if it isn't closed.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, local_source: LocalSource, workers=2, max_pending=64):
+        """
+
+        :param local_source: the source really keep the records, the records are loaded in its orientation
+        :param workers: threads to write the records
+        :param max_pending: max records wait for writing, refresh_data will block when it's full
+        """
+        self.__local_source = local_source
+        self.__queue = queue.Queue(maxsize=max_pending)
+        self.__pending = {}
+        self.__errors = []
+        self.__lock = threading.Lock()
+        self.__workers = [threading.Thread(target=self.__write_records, name="write-behind-{}".format(i), daemon=True)
+                          for i in range(workers)]
+        for worker in self.__workers:
+            worker.start()
+        atexit.register(self.__flush_at_exit)
+
+    @property
+    def local_source(self) -> LocalSource:
+        return self.__local_source
+
+    @property
+    def report_date_as_index(self) -> bool:
+        return self.__local_source.report_date_as_index
+
+    def refresh_data(self, df: DataFrame, identify):
+        with self.__lock:
+            queued = identify in self.__pending
+            self.__pending[identify] = df
+        if not queued:
+            self.__queue.put(identify)
+
+    def load_data(self, identify, *args, **kwargs) -> DataFrame:
+        with self.__lock:
+            pending = self.__pending.get(identify)
+        if pending is not None:
+            if self.report_date_as_index:
+                return to_report_date_index(pending)
+            return pending.copy()
+        return self.__local_source.load_data(identify, *args, **kwargs)
+
+    def exist(self, stock_id):
+        with self.__lock:
+            if stock_id in self.__pending:
+                return True
+        return self.__local_source.exist(stock_id)
+
+    def flush(self):
+        """
+        block until all the pending records are written
+        :raise IOError: if any record failed to write
+        """
+        self.__queue.join()
+        with self.__lock:
+            errors, self.__errors = self.__errors, []
+        if len(errors) > 0:
+            raise IOError("{} records failed to write: {}".format(len(errors), [identify for identify, _ in errors]))
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            for _ in self.__workers:
+                self.__queue.put(None)
+            for worker in self.__workers:
+                worker.join()
+            atexit.unregister(self.__flush_at_exit)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __flush_at_exit(self):
+        try:
+            self.flush()
+        except IOError:
+            self.logger.exception("pending records failed to write at exit")
+
+    def __write_records(self):
+        while True:
+            identify = self.__queue.get()
+            try:
+                if identify is None:
+                    return
+                self.__write_latest(identify)
+            finally:
+                self.__queue.task_done()
+
+    def __write_latest(self, identify):
+        # the record may be refreshed again while it's being written, keep writing until it's the latest one.
+        # a failed write doesn't drop the newer one, the error is raised by the next flush
+        while True:
+            with self.__lock:
+                df = self.__pending[identify]
+            try:
+                self.__local_source.refresh_data(df, identify)
+            except Exception as err:
+                self.logger.exception("{} failed to write".format(identify))
+                with self.__lock:
+                    self.__errors.append((identify, err))
+            with self.__lock:
+                if self.__pending[identify] is df:
+                    del self.__pending[identify]
+                    return
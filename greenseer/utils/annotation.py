@@ -12,7 +12,10 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
-from sklearn.preprocessing import FunctionTransformer
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from sklearn.preprocessing import FunctionTransformer
 
 
 class FunctionTransformerWrapper:
@@ -20,7 +23,9 @@ class FunctionTransformerWrapper:
         self._validate = validate
 
     def __call__(self, original_func):
-        def wrap_function_transformer(*args, **kwargs) -> FunctionTransformer:
+        def wrap_function_transformer(*args, **kwargs) -> "FunctionTransformer":
+            from sklearn.preprocessing import FunctionTransformer
+
             return FunctionTransformer(original_func, validate=self._validate, kw_args=kwargs)
 
         return wrap_function_transformer
@@ -0,0 +1,104 @@
+#  Copyright (c) 2020 GreenSeer (https://chandlersong.me)
+#  Copyright (c) 2020 chandler.song
+#
+#  Licensed under the GNU GENERAL PUBLIC LICENSE v3.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       https://www.gnu.org/licenses/gpl-3.0.html
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import numpy as np
+
+
+class QuantileSketch:
+    """
+    a bounded summary of a stream of values to estimate the quantiles, like a merging t-digest.
+    the values are kept as weighted centroids. the centroids near the tails are small, so the quantiles like
+    0.001 or 0.999 are still close, and the centroids are at most about compression / 2.
+
+    the min and max are kept exactly.
+    """
+
+    def __init__(self, compression: int = 500):
+        """
+
+        :param compression: more centroids are more accurate but use more memory
+        """
+        self.__compression = compression
+        self.__means = np.empty(0)
+        self.__weights = np.empty(0)
+        self.__min = np.inf
+        self.__max = -np.inf
+
+    @property
+    def count(self) -> float:
+        return self.__weights.sum()
+
+    @property
+    def centroids(self) -> int:
+        return len(self.__means)
+
+    def update(self, values) -> "QuantileSketch":
+        """
+        add a batch of values, the nan are ignored
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return self
+        self.__min = min(self.__min, values.min())
+        self.__max = max(self.__max, values.max())
+        self.__compress(np.concatenate([self.__means, values]),
+                        np.concatenate([self.__weights, np.ones(values.size)]))
+        return self
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        if other.count == 0:
+            return self
+        self.__min = min(self.__min, other.__min)
+        self.__max = max(self.__max, other.__max)
+        self.__compress(np.concatenate([self.__means, other.__means]),
+                        np.concatenate([self.__weights, other.__weights]))
+        return self
+
+    @property
+    def min(self) -> float:
+        return self.__min if self.__weights.size > 0 else np.nan
+
+    @property
+    def max(self) -> float:
+        return self.__max if self.__weights.size > 0 else np.nan
+
+    def quantile(self, q):
+        """
+        :param q: a quantile or an array of quantiles between 0 and 1, 0 is the min and 1 is the max exactly
+        :return: nan if there is no value
+        """
+        if self.__weights.size == 0:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        q = np.asarray(q, dtype=np.float64)
+        total = self.__weights.sum()
+        # like the linear interpolation of pandas, the first value is at 0.5 and the last one is at total - 0.5.
+        # each centroid is at the middle of its weight, the tails are between the min or max and the centroid
+        positions = np.concatenate([[0.5], np.cumsum(self.__weights) - self.__weights / 2, [total - 0.5]])
+        means = np.concatenate([[self.__min], self.__means, [self.__max]])
+        result = np.interp(q * (total - 1) + 0.5, positions, means)
+        return np.where(q <= 0, self.__min, np.where(q >= 1, self.__max, result))[()]
+
+    def __compress(self, means: np.ndarray, weights: np.ndarray):
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        cumulative = np.cumsum(weights)
+        q = (cumulative - weights / 2) / cumulative[-1]
+        # the k1 scale of t-digest: each centroid covers one unit of k, it's narrow near 0 and 1
+        k = self.__compression / (2 * np.pi) * np.arcsin(2 * q - 1) + self.__compression / 4
+        bins = np.floor(k).astype(np.intp)
+        _, bins = np.unique(bins, return_inverse=True)
+        self.__weights = np.bincount(bins, weights=weights)
+        self.__means = np.bincount(bins, weights=means * weights) / self.__weights
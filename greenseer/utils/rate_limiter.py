@@ -0,0 +1,85 @@
+#  Copyright (c) 2020 GreenSeer (https://chandlersong.me)
+#  Copyright (c) 2020 chandler.song
+#
+#  Licensed under the GNU GENERAL PUBLIC LICENSE v3.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       https://www.gnu.org/licenses/gpl-3.0.html
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import random
+import threading
+import time
+
+
+class TokenBucketRateLimiter:
+    """
+    a thread safe token bucket. tokens are refilled at requests_per_second and at most burst tokens can be kept.
+    every remote call should acquire one token first, so all the threads share one global speed.
+    """
+
+    def __init__(self, requests_per_second: float, burst: int = 1):
+        """
+
+        :param requests_per_second: refill speed of the tokens
+        :param burst: max tokens can be kept, it's also the max requests can be sent at the same moment
+        """
+        if requests_per_second <= 0:
+            raise ValueError("requests_per_second should be positive, but it's {}".format(requests_per_second))
+        self.__rate = requests_per_second
+        self.__burst = burst
+        self.__tokens = burst
+        self.__last_refill = time.monotonic()
+        self.__lock = threading.Lock()
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.__rate
+
+    def acquire(self, tokens=1):
+        """
+        block until there are enough tokens
+        :param tokens: tokens needed
+        """
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__tokens = min(self.__burst, self.__tokens + (now - self.__last_refill) * self.__rate)
+                self.__last_refill = now
+                if self.__tokens >= tokens:
+                    self.__tokens -= tokens
+                    return
+                wait_seconds = (tokens - self.__tokens) / self.__rate
+            time.sleep(wait_seconds)
+
+
+class RandomDelayLimiter:
+    """
+    sleep a random time at the first acquire, the later ones return at once.
+    it's used to share one random delay between the remote calls of the same stock.
+    """
+
+    def __init__(self, max_delay_seconds: int):
+        """
+
+        :param max_delay_seconds: the delay is a random int in [0, max_delay_seconds)
+        """
+        self.__max_delay_seconds = max_delay_seconds
+        self.__delayed = False
+        self.__lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        the callers during the delay are blocked until it finish
+        :param tokens: useless, only to be the same as TokenBucketRateLimiter
+        """
+        with self.__lock:
+            if not self.__delayed:
+                if self.__max_delay_seconds > 0:
+                    time.sleep(random.randrange(0, self.__max_delay_seconds))
+                self.__delayed = True
@@ -12,10 +12,11 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
-from sklearn.metrics import accuracy_score, recall_score, f1_score
 
 
 def compose_classify_score(y, y_pred, average: str = "micro") -> str:
+    from sklearn.metrics import accuracy_score, recall_score, f1_score
+
     accuracy = accuracy_score(y, y_pred)
     recall = recall_score(y, y_pred, average=average)
     f1 = f1_score(y, y_pred, average=average)
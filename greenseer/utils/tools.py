@@ -14,17 +14,35 @@
 #  limitations under the License.
 import os
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-import joblib
-import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
-from matplotlib.pylab import mpl
-from sklearn.base import BaseEstimator
+
+if TYPE_CHECKING:
+    from sklearn.base import BaseEstimator
 
 _root_dir = "."
 
 
+def pick_group_rows(table: pd.DataFrame, groups, fill) -> np.ndarray:
+    """
+    pick the row of the group of each row from table, all the rows are picked at once
+
+    :param table: one row each group, index by group
+    :param groups: group of each row
+    :param fill: value of the groups not in table, like the nan group
+    :return: one row each group in groups
+    """
+    # the last row is for the groups not in table, get_indexer gives them position -1
+    values = np.vstack([table.to_numpy(dtype=np.float64), np.full(table.shape[1], fill)])
+    return values[table.index.get_indexer(groups)]
+
+
 def enable_matplotlib_chinese():
+    import matplotlib.pyplot as plt
+    from matplotlib.pylab import mpl
+
     plt.rcParams['font.family'] = 'Source Han Serif SC'
     mpl.rcParams['font.sans-serif'] = ['Source Han Serif SC']  # 指定默认字体
     mpl.rcParams['axes.unicode_minus'] = False  # 解决保存图像是负号'-'显示为方块的问题
@@ -48,6 +66,8 @@ class DataSaver:
         Path(self._sklearn_root).mkdir(parents=True, exist_ok=True)
 
     def save_fig(self, fig_id, tight_layout=True, fig_extension="png", resolution=800):
+        import matplotlib.pyplot as plt
+
         path = os.path.join(self._image_root, fig_id + "." + fig_extension)
         print("Saving figure", fig_id)
         if tight_layout:
@@ -60,11 +80,13 @@ class DataSaver:
         data.to_csv(path, encoding='utf-8-sig')
 
     def save_sklearn_model(self, model, name: str):
+        import joblib
+
         path = os.path.join(self._sklearn_root, name + "." + "pkl")
         print("Saving sklearn model:", path)
         joblib.dump(model, path)
 
-    def load_sklearn_model(self, name: str) -> BaseEstimator:
+    def load_sklearn_model(self, name: str) -> "BaseEstimator":
         """
         load model file
         :param name: model file name
@@ -74,4 +96,6 @@ class DataSaver:
 
         if not os.path.exists(path):
             return None
+
+        import joblib
         return joblib.load(path)
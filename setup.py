@@ -20,6 +20,7 @@ intall_requires = [
     'tushare>=0.6.8',
     'pandas-datareader>=0.2.1',
     'pandas>=0.18.1',
+    'requests>=2.20.0',
     'ta-lib>=0.4.0',
     'numpy>=1.11.0',
     'seaborn>=0.10.1'
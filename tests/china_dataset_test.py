@@ -14,6 +14,10 @@
 #  limitations under the License.
 #
 
+import os
+import shutil
+import threading
+import time
 import unittest
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
@@ -22,7 +26,14 @@ import numpy as np
 import pandas as pd
 from pandas.testing import assert_frame_equal
 
-from greenseer.dataset.china_dataset import load_by_stock_id, load_multi_data, compose_target, list_industry_category
+from greenseer.dataset.china_dataset import load_by_stock_id, load_multi_data, compose_target, list_industry_category, \
+    fetch_targets, fetch_all, ChinaReportRepository, iter_multi_data
+from greenseer.dataset.panel import ReportPanel
+from greenseer.repository import ReportLocalData
+from greenseer.utils.rate_limiter import TokenBucketRateLimiter
+from tests.file_const import DEFAULT_TEST_FOLDER
+
+FETCH_ALL_FOLDER = DEFAULT_TEST_FOLDER + "/china_dataset_test"
 
 
 def create_mock_china_repository():
@@ -43,6 +54,49 @@ def create_expected_data(repository):
     return [assert_report, income_report, cash_report]
 
 
+class TestReportPanel(TestCase):
+    def setUp(self):
+        index = pd.MultiIndex.from_tuples([("b", pd.Timestamp("2019-12-31")), ("a", pd.Timestamp("2018-12-31")),
+                                           ("a", pd.Timestamp("2019-12-31"))], names=["code", "releaseAt"])
+        self.data = pd.DataFrame({"x": [1.0, 3.0, 5.0], "y": [2.0, np.nan, 4.0]}, index=index)
+
+    def test_to_and_from_frame(self):
+        panel = ReportPanel.from_frame(self.data)
+
+        self.assertEqual((2, 2, 2), panel.shape)
+        self.assertListEqual(["2018-12-31", "2019-12-31"], list(panel.dates.strftime("%Y-%m-%d")))
+        assert_frame_equal(self.data, panel.to_frame())
+
+    def test_from_frames(self):
+        batches = [self.data.loc[["b"]], self.data.loc[["a"]][["y", "x"]]]
+        assert_frame_equal(self.data, ReportPanel.from_frames(batches).to_frame())
+
+    def test_from_frame_with_missing_values(self):
+        data = pd.DataFrame({"x": pd.array([1, None, 5], dtype="Int64"), "y": [None, 3.0, 4.0]},
+                            index=self.data.index).astype({"y": object})
+        assert_frame_equal(self.data.assign(x=[1.0, np.nan, 5.0], y=[np.nan, 3.0, 4.0]),
+                           ReportPanel.from_frame(data).to_frame())
+
+    def test_select(self):
+        panel = ReportPanel.from_frame(self.data)
+
+        actual = panel.select(dates=slice("2019-01-01", None), items=["y"])
+        self.assertTrue(np.shares_memory(panel.values, panel.select(dates=slice("2019-01-01", None)).values))
+        assert_frame_equal(self.data.loc[[("b", pd.Timestamp("2019-12-31")), ("a", pd.Timestamp("2019-12-31"))],
+                                         ["y"]], actual.to_frame())
+        self.assertRaises(KeyError, panel.select, stocks=["c"])
+
+    def test_cross_section(self):
+        panel = ReportPanel.from_frame(self.data).ratio("x/y", "x", "y")
+
+        assert_frame_equal(pd.DataFrame({pd.Timestamp("2018-12-31"): [np.nan, np.nan],
+                                         pd.Timestamp("2019-12-31"): [0.5, 1.25]},
+                                        index=pd.Index(["b", "a"], name="code")).rename_axis(columns="releaseAt"),
+                           panel.item("x/y"))
+        np.testing.assert_array_equal([[np.nan, 0.5], [1.0, 1.0]], panel.rank().values[:, :, 0])
+        np.testing.assert_array_equal([[np.nan, -1.0], [np.nan, 1.0]], panel.zscore().values[:, :, 0])
+
+
 class TestLoadByStockId(TestCase):
 
     def test_load_by_stock_id(self):
@@ -53,6 +107,29 @@ class TestLoadByStockId(TestCase):
         expected = pd.concat({stock_id: pd.concat(reports, axis=1)})
         assert_frame_equal(expected, load_by_stock_id(stock_id, False, repository))
 
+    def test_load_three_reports_concurrently(self):
+        repository = create_mock_china_repository()
+        reports = create_expected_data(repository)
+        # each load waits the other two, it would time out if they were loaded one by one
+        started = threading.Barrier(3, timeout=5)
+
+        def wait_others(data):
+            def load(*args, **kwargs):
+                started.wait()
+                return data
+
+            return load
+
+        for report, data in zip([repository.assert_report, repository.income_report, repository.cash_report],
+                                reports):
+            report.load_data.side_effect = wait_others(data)
+
+        actual = load_by_stock_id("abc", True, repository)
+        assert_frame_equal(pd.concat({"abc": pd.concat(reports, axis=1)}), actual)
+        rate_limiters = {report.load_data.call_args.kwargs["rate_limiter"] for report in
+                         [repository.assert_report, repository.income_report, repository.cash_report]}
+        self.assertEqual(1, len(rate_limiters))
+
     @patch("greenseer.dataset.china_dataset.load_by_stock_id")
     def test_load_multi_data(self, load_stock):
         repository = create_mock_china_repository()
@@ -65,6 +142,159 @@ class TestLoadByStockId(TestCase):
         expected = pd.concat({stock_id_a: reports_a, stock_id_b: reports_b})
         assert_frame_equal(expected, load_multi_data([stock_id_a, stock_id_b]))
 
+    @patch("greenseer.dataset.china_dataset.load_by_stock_id")
+    def test_load_multi_data_concurrently(self, load_stock):
+        stock_ids = ["a", "b", "c"]
+        reports = {stock_id: pd.concat({stock_id: pd.DataFrame(np.random.random((3, 3)))}) for stock_id in
+                   stock_ids}
+        load_stock.side_effect = lambda stock_id, *args, **kwargs: reports[stock_id]
+
+        actual = load_multi_data(stock_ids, requests_per_second=100, max_workers=2)
+        assert_frame_equal(pd.concat([reports[stock_id] for stock_id in stock_ids]), actual)
+
+        rate_limiters = {call.args[4] for call in load_stock.call_args_list}
+        self.assertEqual(1, len(rate_limiters))
+        self.assertIsInstance(rate_limiters.pop(), TokenBucketRateLimiter)
+
+    def test_max_workers_caps_remote_calls(self):
+        repository = create_mock_china_repository()
+        reports = create_expected_data(repository)
+        lock = threading.Lock()
+        in_flight = [0, 0]
+
+        def remote(data):
+            def load(*args, **kwargs):
+                with lock:
+                    in_flight[0] += 1
+                    in_flight[1] = max(in_flight)
+                time.sleep(0.02)
+                with lock:
+                    in_flight[0] -= 1
+                return data
+
+            return load
+
+        for report, data in zip([repository.assert_report, repository.income_report, repository.cash_report],
+                                reports):
+            report.load_data.side_effect = remote(data)
+
+        load_multi_data(["a", "b", "c", "d"], force_remote=True, repository=repository, requests_per_second=1000,
+                        max_workers=2)
+        self.assertEqual(2, in_flight[1])
+
+    def test_load_local_reports_one_by_one(self):
+        repository = create_mock_china_repository()
+        create_expected_data(repository)
+        with patch("greenseer.dataset.china_dataset.ThreadPoolExecutor") as executor:
+            load_by_stock_id("abc", False, repository)
+            executor.assert_not_called()
+
+    @patch("greenseer.dataset.china_dataset.load_by_stock_id")
+    def test_resume_fetch_all(self, load_stock):
+        repository = create_mock_china_repository()
+        repository.stock_info = pd.DataFrame(index=["a", "b", "c"])
+        dates = pd.DatetimeIndex(["2019-12-31", "2019-09-30"])
+        reports = {stock_id: pd.concat({stock_id: pd.DataFrame({stock_id + "x": [1.0, 2.0], "y": [3.0, 4.0]},
+                                                               index=dates)}) for stock_id in ["a", "b", "c"]}
+
+        def broken(stock_id, *args, **kwargs):
+            if stock_id == "c":
+                raise IOError("network is broken")
+            return reports[stock_id]
+
+        load_stock.side_effect = broken
+        all_reports = ReportLocalData(FETCH_ALL_FOLDER)
+        try:
+            with patch("greenseer.dataset.china_dataset._local_all_reports_repo", all_reports):
+                self.assertRaises(IOError, fetch_all, repository=repository, chunk_size=1)
+                self.assertEqual(3, load_stock.call_count)
+
+                load_stock.side_effect = lambda stock_id, *args, **kwargs: reports[stock_id]
+                actual = fetch_all(repository=repository, chunk_size=1)
+                self.assertFalse(os.path.exists(FETCH_ALL_FOLDER + "/fetch_all_journal"))
+        finally:
+            shutil.rmtree(FETCH_ALL_FOLDER)
+
+        self.assertEqual(4, load_stock.call_count)
+        expected = pd.concat(reports.values()).rename_axis(["code", "releaseAt"])
+        assert_frame_equal(expected, actual, check_like=True)
+        self.assertListEqual(["code", "releaseAt", "ax", "y", "bx", "cx"],
+                             list(actual.reset_index().columns))
+
+    @patch("greenseer.dataset.china_dataset.load_by_stock_id")
+    def test_discard_journal_of_other_parameters(self, load_stock):
+        repository = create_mock_china_repository()
+        repository.stock_info = pd.DataFrame(index=["a", "b", "c"])
+        dates = pd.DatetimeIndex(["2019-12-31", "2019-09-30"])
+        reports = {stock_id: pd.concat({stock_id: pd.DataFrame({"x": [1.0, 2.0]}, index=dates)})
+                   for stock_id in ["a", "b", "c"]}
+
+        def broken(stock_id, *args, **kwargs):
+            if stock_id == "c":
+                raise IOError("network is broken")
+            return reports[stock_id]
+
+        load_stock.side_effect = broken
+        all_reports = ReportLocalData(FETCH_ALL_FOLDER)
+        try:
+            with patch("greenseer.dataset.china_dataset._local_all_reports_repo", all_reports):
+                self.assertRaises(IOError, fetch_all, repository=repository, chunk_size=1)
+                self.assertEqual(3, load_stock.call_count)
+
+                # the chunks are different, a and b are fetched again
+                load_stock.side_effect = lambda stock_id, *args, **kwargs: reports[stock_id]
+                actual = fetch_all(repository=repository, chunk_size=2)
+        finally:
+            shutil.rmtree(FETCH_ALL_FOLDER)
+
+        self.assertEqual(6, load_stock.call_count)
+        assert_frame_equal(pd.concat(reports.values()).rename_axis(["code", "releaseAt"]), actual)
+
+    def test_load_multi_data_in_processes(self):
+        repository = ChinaReportRepository(FETCH_ALL_FOLDER)
+        dates = ["2019-12-31", "2019-09-30"]
+        try:
+            for report in [repository.assert_report, repository.income_report, repository.cash_report]:
+                for stock_id in ["a", "b", "c"]:
+                    # the same item in different reports, the column names are duplicated
+                    report.local_source.refresh_data(pd.DataFrame(np.random.random((2, 2)), index=["x", "y"],
+                                                                  columns=dates), stock_id)
+
+            # d isn't in local, it's fetched and written by this process, not the processes of the pool
+            for report in [repository.assert_report, repository.income_report, repository.cash_report]:
+                report.initial_remote_data = MagicMock(return_value=pd.DataFrame(
+                    np.random.random((2, 2)), index=["x", "y"], columns=dates))
+
+            actual = load_multi_data(["a", "d", "b", "c"], repository=repository, n_jobs=2, max_sleep_seconds=None)
+            expected = load_multi_data(["a", "d", "b", "c"], repository=repository)
+            self.assertEqual(1, repository.cash_report.initial_remote_data.call_count)
+        finally:
+            shutil.rmtree(FETCH_ALL_FOLDER)
+
+        assert_frame_equal(expected, actual)
+        self.assertRaises(ValueError, load_multi_data, ["a"], requests_per_second=1, n_jobs=2)
+
+    @patch("greenseer.dataset.china_dataset.load_by_stock_id")
+    def test_iter_multi_data(self, load_stock):
+        stock_ids = ["a", "b", "c"]
+        reports = {stock_id: pd.concat({stock_id: pd.DataFrame(np.random.random((3, 3)))}) for stock_id in
+                   stock_ids}
+        load_stock.side_effect = lambda stock_id, *args, **kwargs: reports[stock_id]
+
+        for prefetch in [0, 2]:
+            batches = list(iter_multi_data(stock_ids, batch_size=2, prefetch=prefetch))
+            self.assertListEqual([["a", "b"], ["c"]], [list(batch.index.unique(0)) for batch in batches])
+            assert_frame_equal(pd.concat(reports.values()).rename_axis(["code", "releaseAt"]), pd.concat(batches))
+
+    @patch("greenseer.dataset.china_dataset.load_by_stock_id")
+    def test_iter_multi_data_stop_early(self, load_stock):
+        load_stock.side_effect = lambda stock_id, *args, **kwargs: pd.concat({stock_id: pd.DataFrame([[1.0]])})
+
+        batches = iter_multi_data([str(i) for i in range(100)], prefetch=1)
+        next(batches)
+        batches.close()
+        self.assertLess(load_stock.call_count, 5)
+
     def test_compose_target_set(self):
         index = ["a", "b", "c"]
 
@@ -86,6 +316,17 @@ class TestLoadByStockId(TestCase):
         print(actual)
         assert_frame_equal(expect, actual)
 
+    @patch("greenseer.dataset.china_dataset._default_targets", None)
+    @patch("greenseer.dataset.china_dataset.list_default_targets")
+    def test_fetch_targets_lazily(self, default_targets):
+        default_targets.return_value = {"st": ["b"]}
+        index = pd.Index(["a", "b"])
+
+        expect = pd.DataFrame({"st": [0, 1]}, index=index)
+        assert_frame_equal(expect, fetch_targets(index))
+        assert_frame_equal(expect, fetch_targets(index))
+        default_targets.assert_called_once()
+
     def test_list_stock_industry(self):
         repository = create_mock_china_repository()
         repository.stock_info = pd.DataFrame({
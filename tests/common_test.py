@@ -14,10 +14,13 @@
 #  limitations under the License.
 
 
+import time
 import unittest
 from unittest import TestCase
+from unittest.mock import patch
 
 from greenseer.configuration import create_configuration
+from greenseer.utils.rate_limiter import TokenBucketRateLimiter, RandomDelayLimiter
 
 
 class TestConfiguration(TestCase):
@@ -35,6 +38,38 @@ class TestConfiguration(TestCase):
         self.assertEqual(366, config.get_int_value("china_stock_config", "remote_fetch_days"))
 
 
+class TestTokenBucketRateLimiter(TestCase):
+
+    def test_acquire_limited_by_rate(self):
+        limiter = TokenBucketRateLimiter(20)
+        start = time.monotonic()
+        for _ in range(5):
+            limiter.acquire()
+        # first token is in the bucket, other 4 need 0.05 seconds for each
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    def test_burst(self):
+        limiter = TokenBucketRateLimiter(1, burst=3)
+        start = time.monotonic()
+        for _ in range(3):
+            limiter.acquire()
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_invalid_rate(self):
+        self.assertRaises(ValueError, TokenBucketRateLimiter, 0)
+
+
+class TestRandomDelayLimiter(TestCase):
+
+    @patch("time.sleep")
+    def test_delay_once(self, sleep):
+        limiter = RandomDelayLimiter(5)
+        for _ in range(3):
+            limiter.acquire()
+        sleep.assert_called_once()
+        self.assertLess(sleep.call_args[0][0], 5)
+
+
 if __name__ == "__main__":
     if __name__ == '__main__':
         unittest.main()
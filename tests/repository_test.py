@@ -13,23 +13,28 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import mmap
 import os
 import shutil
+import threading
 import unittest
 from logging.config import fileConfig
 from unittest import TestCase
 from unittest.mock import MagicMock, Mock, patch
 
+import numpy as np
 import pandas as pd
 import tushare
 from pandas import DataFrame
 from pandas.util.testing import assert_frame_equal
 
-from greenseer.repository import ReportLocalData, LocalSource
-from greenseer.repository.china_stock import TuShareStockBasicFetcher, NetEaseRemoteFetcher
+from greenseer.repository import ReportLocalData, LocalSource, ParquetLocalData, migrate_local_data, \
+    ReportRepository, find_dirty_quarters, ReportCache, WriteBehindLocalData, SqliteLocalData, to_report_date_index, \
+    from_report_date_index, SegmentLocalData, NegativeCache
+from greenseer.repository.china_stock import TuShareStockBasicFetcher, NetEaseRemoteFetcher, RemoteSession, \
+    get_global_remote_session, BasicInfoRepository, parse_net_ease_report
 from tests.file_const import DEFAULT_TEST_FOLDER, read_sina_600096_test_data, \
-    read_china_total_stock_info, \
-    create_mock_request_urlopen, read_600096_assert_reports
+    read_china_total_stock_info, read_600096_assert_reports
 
 TEST_STOCK_ID = "600096"
 
@@ -66,6 +71,513 @@ class TestFolderSource(TestCase):
 
         self.assertTrue(expected_data.empty)
 
+    def test_manifest_record_refreshed_data(self):
+        data = read_600096_assert_reports()
+        self.source.refresh_data(data, self.stock_id)
+
+        entry = ReportLocalData(DEFAULT_FOLDER).manifest.get(self.stock_id)
+        self.assertEqual(len(data.columns), entry["rows"])
+        self.assertEqual("2018-03-31", entry["last_report_date"])
+        self.assertEqual(os.path.getsize(self.expected_path), entry["bytes"])
+        self.assertListEqual([], self.source.manifest.stale_identifies("2018-03-31"))
+        self.assertListEqual([self.stock_id], self.source.manifest.stale_identifies("2018-06-30"))
+
+        with patch("os.path.exists") as exists:
+            self.assertTrue(self.source.exist(self.stock_id))
+            exists.assert_not_called()
+
+    def test_manifest_scan_existing_folder(self):
+        read_sina_600096_test_data().to_csv(self.expected_path, compression="gzip")
+
+        source = ReportLocalData(DEFAULT_FOLDER)
+        self.assertListEqual([self.stock_id], source.manifest.identifies())
+        self.assertIsNone(source.manifest.get(self.stock_id)["last_report_date"])
+
+    def test_manifest_rewrite_journal(self):
+        data = read_600096_assert_reports()
+        for _ in range(110):
+            self.source.refresh_data(data, self.stock_id)
+        self.source.remove_data(self.stock_id)
+        self.source.refresh_data(data, "600000")
+
+        with open(self.source.manifest.manifest_path) as manifest:
+            self.assertLess(len(manifest.readlines()), 100)
+        self.assertListEqual(["600000"], ReportLocalData(DEFAULT_FOLDER).manifest.identifies())
+        self.assertFalse(self.source.exist(self.stock_id))
+
+    def test_fetch_remote_if_file_is_deleted(self):
+        remote = read_600096_assert_reports()
+        self.source.refresh_data(remote, self.stock_id)
+        os.remove(self.expected_path)
+        self.assertTrue(self.source.exist(self.stock_id))
+
+        repository = MockReportRepository(self.source, remote)
+        assert_frame_equal(to_report_date_index(remote), repository.load_data(self.stock_id))
+        self.assertTrue(os.path.exists(self.expected_path))
+        self.assertIsNotNone(self.source.manifest.get(self.stock_id)["last_report_date"])
+
+    def test_manifest_skip_broken_line(self):
+        data = read_600096_assert_reports()
+        self.source.refresh_data(data, self.stock_id)
+        with open(self.source.manifest.manifest_path, "a") as manifest:
+            manifest.write('["600000", {"rows"')
+
+        self.assertListEqual([self.stock_id], ReportLocalData(DEFAULT_FOLDER).manifest.identifies())
+
+
+class TestParquetSource(TestCase):
+    def setUp(self):
+        self.stock_id = TEST_STOCK_ID
+        self.source = ParquetLocalData(DEFAULT_FOLDER)
+        self.expected_path = DEFAULT_FOLDER + '/600096.parquet'
+
+    def tearDown(self):
+        if os.path.exists(DEFAULT_FOLDER):
+            shutil.rmtree(DEFAULT_FOLDER)
+
+    def test_refresh_and_load_data(self):
+        data = read_600096_assert_reports()
+        self.source.refresh_data(data, self.stock_id)
+
+        self.assertTrue(os.path.exists(self.expected_path))
+        self.assertTrue(self.source.exist(self.stock_id))
+        actual = self.source.load_data(self.stock_id)
+        self.assertIsInstance(actual.index, pd.DatetimeIndex)
+        assert_frame_equal(to_report_date_index(data).sort_index(axis=1), actual, check_names=False)
+        assert_frame_equal(data.sort_index(), from_report_date_index(actual), check_dtype=False, check_names=False)
+
+    def test_forget_deleted_file(self):
+        self.source.refresh_data(read_600096_assert_reports(), self.stock_id)
+        os.remove(self.expected_path)
+
+        self.assertTrue(self.source.load_data(self.stock_id).empty)
+        self.assertFalse(self.source.exist(self.stock_id))
+
+    def test_layout_version_in_metadata(self):
+        import pyarrow.parquet as pq
+
+        self.source.refresh_data(read_600096_assert_reports(), self.stock_id)
+
+        metadata = pq.read_schema(self.expected_path).metadata
+        self.assertEqual(ParquetLocalData.LAYOUT_VERSION, metadata[ParquetLocalData.LAYOUT_METADATA_KEY])
+
+    def test_load_data_empty(self):
+        self.assertTrue(self.source.load_data(self.stock_id).empty)
+
+    def test_migrate_layout_1_when_load(self):
+        import pyarrow.parquet as pq
+
+        data = read_600096_assert_reports().sort_index()
+        data.to_parquet(self.expected_path)
+
+        actual = self.source.load_data(self.stock_id)
+        assert_frame_equal(to_report_date_index(data).sort_index(axis=1), actual, check_names=False)
+        metadata = pq.read_schema(self.expected_path).metadata
+        self.assertEqual(ParquetLocalData.LAYOUT_VERSION, metadata[ParquetLocalData.LAYOUT_METADATA_KEY])
+
+    def test_migrate_csv_when_load(self):
+        csv_source = ReportLocalData(DEFAULT_FOLDER)
+        csv_source.refresh_data(read_600096_assert_reports(), self.stock_id)
+
+        self.assertTrue(self.source.exist(self.stock_id))
+        actual = self.source.load_data(self.stock_id)
+        assert_frame_equal(to_report_date_index(csv_source.load_data(self.stock_id)).sort_index(axis=1), actual,
+                           check_names=False)
+        self.assertTrue(os.path.exists(self.expected_path))
+
+    def test_migrate_from_csv(self):
+        csv_source = ReportLocalData(DEFAULT_FOLDER)
+        data = read_600096_assert_reports()
+        csv_source.refresh_data(data, self.stock_id)
+
+        self.assertEqual(1, migrate_local_data(csv_source, self.source))
+        self.assertEqual([self.stock_id], self.source.list_identifies())
+        assert_frame_equal(csv_source.load_data(self.stock_id), from_report_date_index(
+            self.source.load_data(self.stock_id)).loc[csv_source.load_data(self.stock_id).index], check_dtype=False,
+                           check_names=False)
+
+
+class TestSqliteSource(TestCase):
+    def setUp(self):
+        self.stock_id = TEST_STOCK_ID
+        self.source = SqliteLocalData(DEFAULT_FOLDER)
+        self.data = read_600096_assert_reports()
+
+    def tearDown(self):
+        if os.path.exists(DEFAULT_FOLDER):
+            shutil.rmtree(DEFAULT_FOLDER)
+
+    def test_refresh_and_load_data(self):
+        self.data.iloc[0, 0] = np.nan
+        self.source.refresh_data(self.data, self.stock_id)
+
+        self.assertTrue(self.source.exist(self.stock_id))
+        self.assertFalse(self.source.exist("600000"))
+        assert_frame_equal(self.data.sort_index(), from_report_date_index(self.source.load_data(self.stock_id)),
+                           check_dtype=False, check_names=False)
+
+    def test_load_data_empty(self):
+        self.assertTrue(self.source.load_data(self.stock_id).empty)
+
+    def test_update_only_touch_given_quarters(self):
+        self.source.refresh_data(self.data, self.stock_id)
+        update = self.data[["2018-03-31"]] * 2
+
+        self.source.update_data(update, self.stock_id)
+
+        actual = from_report_date_index(self.source.load_data(self.stock_id))
+        assert_frame_equal(update.sort_index(), actual[["2018-03-31"]], check_dtype=False, check_names=False)
+        assert_frame_equal(self.data.drop(columns="2018-03-31").sort_index(), actual.drop(columns="2018-03-31"),
+                           check_dtype=False, check_names=False)
+
+    def test_query_cross_section(self):
+        self.source.refresh_data(self.data, self.stock_id)
+        self.source.refresh_data(self.data * 2, "600000")
+        item = "资产总计(万元)"
+
+        actual = self.source.query(items=[item], start="2017-12-31", end="2017-12-31")
+
+        expected = pd.DataFrame({item: [self.data.loc[item, "2017-12-31"] * 2, self.data.loc[item, "2017-12-31"]]},
+                                index=pd.MultiIndex.from_tuples([("600000", pd.Timestamp("2017-12-31")),
+                                                                 (self.stock_id, pd.Timestamp("2017-12-31"))],
+                                                                names=["code", "releaseAt"]))
+        assert_frame_equal(expected, actual, check_dtype=False)
+        self.assertListEqual(["600000", self.stock_id], self.source.list_identifies())
+
+    def test_load_by_repository(self):
+        remote = self.data.iloc[:, :4]
+        repository = MockReportRepository(self.source, remote)
+
+        first = repository.load_data(self.stock_id)
+        second = repository.load_data(self.stock_id)
+        assert_frame_equal(to_report_date_index(remote), first, check_dtype=False, check_names=False)
+        assert_frame_equal(first, second, check_dtype=False, check_names=False, check_like=True)
+
+        self.source.update_data = MagicMock(wraps=self.source.update_data)
+        repository.load_data(self.stock_id, force_remote=True, incremental=True)
+        self.source.update_data.assert_not_called()
+
+
+class TestSegmentSource(TestCase):
+    def setUp(self):
+        self.stock_id = TEST_STOCK_ID
+        self.source = SegmentLocalData(DEFAULT_FOLDER)
+        self.data = read_600096_assert_reports()
+
+    def tearDown(self):
+        if os.path.exists(DEFAULT_FOLDER):
+            shutil.rmtree(DEFAULT_FOLDER)
+
+    def test_refresh_and_load_data(self):
+        self.source.refresh_data(self.data, self.stock_id)
+
+        self.assertTrue(self.source.exist(self.stock_id))
+        self.assertFalse(self.source.exist("600000"))
+        assert_frame_equal(to_report_date_index(self.data), self.source.load_data(self.stock_id), check_dtype=False,
+                           check_names=False)
+
+    def test_load_data_empty(self):
+        self.assertTrue(self.source.load_data(self.stock_id).empty)
+
+    def test_load_without_copy(self):
+        self.source.refresh_data(self.data, self.stock_id)
+        first = self.source.load_data(self.stock_id)
+        second = SegmentLocalData(DEFAULT_FOLDER).load_data(self.stock_id)
+        base = first.values
+        while isinstance(base, np.ndarray):
+            base = base.base
+        self.assertIsInstance(base, mmap.mmap)
+
+        first.iloc[0, 0] = -1
+        self.assertNotEqual(-1, second.iloc[0, 0])
+        self.assertNotEqual(-1, self.source.load_data(self.stock_id).iloc[0, 0])
+
+    def test_compact(self):
+        csv_source = ReportLocalData(DEFAULT_FOLDER)
+        csv_source.refresh_data(self.data, self.stock_id)
+        csv_source.refresh_data(self.data * 2, "600000")
+
+        self.assertEqual(2, self.source.compact(csv_source))
+        self.source.refresh_data(self.data * 3, "600000")
+        old_segment = self.source.segment_path
+        size = os.path.getsize(old_segment)
+
+        self.assertEqual(2, self.source.compact())
+        self.assertFalse(os.path.exists(old_segment))
+        self.assertEqual(size * 2 / 3, os.path.getsize(self.source.segment_path))
+        reopened = SegmentLocalData(DEFAULT_FOLDER)
+        self.assertListEqual(["600000", self.stock_id], reopened.list_identifies())
+        assert_frame_equal(to_report_date_index(self.data * 3), reopened.load_data("600000"), check_dtype=False,
+                           check_names=False)
+
+    def test_refresh_appends_journal(self):
+        index_path = os.path.join(DEFAULT_FOLDER, SegmentLocalData.INDEX_FILE)
+        self.source.refresh_data(self.data, self.stock_id)
+        self.source.refresh_data(self.data.iloc[:3] * 2, "600000")
+
+        self.assertFalse(os.path.exists(index_path))
+        reopened = SegmentLocalData(DEFAULT_FOLDER)
+        assert_frame_equal(to_report_date_index(self.data.iloc[:3] * 2), reopened.load_data("600000"),
+                           check_dtype=False, check_names=False)
+        assert_frame_equal(self.source.load_data(self.stock_id), reopened.load_data(self.stock_id))
+
+        journal_path = self.source.journal_path
+        self.source.compact()
+        self.assertTrue(os.path.exists(index_path))
+        self.assertFalse(os.path.exists(journal_path))
+        self.assertListEqual(["600000", self.stock_id], SegmentLocalData(DEFAULT_FOLDER).list_identifies())
+
+
+class TestWriteBehindSource(TestCase):
+    def setUp(self):
+        self.stock_id = TEST_STOCK_ID
+        self.source = ReportLocalData(DEFAULT_FOLDER)
+        self.data = read_600096_assert_reports()
+
+    def tearDown(self):
+        if os.path.exists(DEFAULT_FOLDER):
+            shutil.rmtree(DEFAULT_FOLDER)
+
+    def test_refresh_replace_atomically(self):
+        self.source.refresh_data(self.data, self.stock_id)
+        self.source.refresh_data(self.data * 2, self.stock_id)
+
+        self.assertListEqual(["600096.gz", "manifest.gz.jsonl"], sorted(os.listdir(DEFAULT_FOLDER)))
+        assert_frame_equal((self.data * 2).sort_index(), self.source.load_data(self.stock_id), check_dtype=False)
+
+    def test_keep_old_file_if_write_failed(self):
+        self.source.refresh_data(self.data, self.stock_id)
+        broken = MagicMock()
+        broken.sort_index.return_value.to_csv.side_effect = IOError("disk full")
+
+        self.assertRaises(IOError, self.source.refresh_data, broken, self.stock_id)
+        self.assertListEqual(["600096.gz", "manifest.gz.jsonl"], sorted(os.listdir(DEFAULT_FOLDER)))
+        assert_frame_equal(self.data.sort_index(), self.source.load_data(self.stock_id), check_dtype=False)
+
+    def test_write_in_background(self):
+        with WriteBehindLocalData(self.source) as write_behind:
+            write_behind.refresh_data(self.data, self.stock_id)
+            self.assertTrue(write_behind.exist(self.stock_id))
+            assert_frame_equal(self.data, write_behind.load_data(self.stock_id))
+
+        self.assertTrue(self.source.exist(self.stock_id))
+        assert_frame_equal(self.data.sort_index(), self.source.load_data(self.stock_id), check_dtype=False)
+
+    def test_only_write_latest(self):
+        self.source.refresh_data = MagicMock()
+        write_behind = WriteBehindLocalData(self.source, workers=1)
+        for i in range(10):
+            write_behind.refresh_data(self.data * i, self.stock_id)
+        write_behind.close()
+
+        self.assertLessEqual(self.source.refresh_data.call_count, 10)
+        assert_frame_equal(self.data * 9, self.source.refresh_data.call_args[0][0])
+
+    def test_flush_raise_if_failed(self):
+        self.source.refresh_data = MagicMock(side_effect=IOError("disk full"))
+        write_behind = WriteBehindLocalData(self.source)
+        write_behind.refresh_data(self.data, self.stock_id)
+
+        self.assertRaises(IOError, write_behind.flush)
+        self.assertFalse(write_behind.exist(self.stock_id))
+        write_behind.close()
+
+    def test_keep_newer_record_if_write_failed(self):
+        started, release = threading.Event(), threading.Event()
+        written = []
+
+        def refresh(df, identify):
+            written.append(df)
+            if len(written) == 1:
+                started.set()
+                release.wait(5)
+                raise IOError("disk full")
+
+        self.source.refresh_data = MagicMock(side_effect=refresh)
+        write_behind = WriteBehindLocalData(self.source, workers=1)
+        write_behind.refresh_data(self.data, self.stock_id)
+        started.wait(5)
+        write_behind.refresh_data(self.data * 2, self.stock_id)
+        release.set()
+
+        self.assertRaises(IOError, write_behind.flush)
+        self.assertEqual(2, len(written))
+        assert_frame_equal(self.data * 2, written[-1])
+        write_behind.close()
+
+    def test_flush_at_exit(self):
+        with patch("greenseer.repository.write_behind.atexit") as at_exit:
+            write_behind = WriteBehindLocalData(self.source)
+            write_behind.refresh_data(self.data, self.stock_id)
+            at_exit.register.call_args[0][0]()
+            self.assertTrue(self.source.exist(self.stock_id))
+
+            write_behind.close()
+            at_exit.unregister.assert_called_once_with(at_exit.register.call_args[0][0])
+
+
+class MockReportRepository(ReportRepository):
+    def __init__(self, local_source, remote_data):
+        ReportRepository.__init__(self, local_source)
+        self.remote_data = remote_data
+
+    def initial_remote_data(self, stock_id):
+        return self.remote_data.copy()
+
+
+class TestIncrementalRefresh(TestCase):
+    def setUp(self):
+        self.stock_id = TEST_STOCK_ID
+        self.source = ReportLocalData(DEFAULT_FOLDER)
+        self.local = pd.DataFrame({"2019-12-31": [1.0, 2.0], "2019-09-30": [3.0, np.nan]}, index=["x", "y"])
+        self.source.refresh_data(self.local, self.stock_id)
+
+    def tearDown(self):
+        if os.path.exists(DEFAULT_FOLDER):
+            shutil.rmtree(DEFAULT_FOLDER)
+
+    def test_find_dirty_quarters(self):
+        remote = pd.DataFrame({"2020-03-31": [5.0, 6.0], "2019-12-31": [1.0, 2.5], "2019-09-30": [3.0, np.nan]},
+                              index=["x", "y"])
+        self.assertListEqual(["2020-03-31", "2019-12-31"], list(find_dirty_quarters(self.local, remote)))
+
+    def test_float_round_trip_is_not_dirty(self):
+        remote = self.local * (1 + 1e-12)
+        self.assertListEqual([], list(find_dirty_quarters(self.local, remote)))
+
+    def test_only_update_dirty_quarters(self):
+        remote = pd.DataFrame({"2020-03-31": [5.0, 6.0], "2019-12-31": [1.0, 2.0], "2019-09-30": [3.0, np.nan]},
+                              index=["x", "y"])
+        self.source.update_data = MagicMock(wraps=self.source.update_data)
+        repository = MockReportRepository(self.source, remote)
+
+        actual = repository.load_data(self.stock_id, force_remote=True, incremental=True)
+
+        self.assertListEqual(["2020-03-31"], list(self.source.update_data.call_args[0][0].columns))
+        assert_frame_equal(to_report_date_index(remote), actual)
+        assert_frame_equal(remote, self.source.load_data(self.stock_id))
+
+    def test_nothing_dirty(self):
+        self.source.refresh_data = MagicMock()
+        self.source.update_data = MagicMock()
+        repository = MockReportRepository(self.source, self.local)
+
+        repository.load_data(self.stock_id, force_remote=True, incremental=True)
+
+        self.source.refresh_data.assert_not_called()
+        self.source.update_data.assert_not_called()
+
+
+class TestNegativeCache(TestCase):
+    def setUp(self):
+        self.stock_id = TEST_STOCK_ID
+        self.path = DEFAULT_FOLDER + "/missing.json"
+        self.source = ReportLocalData(DEFAULT_FOLDER)
+
+    def tearDown(self):
+        if os.path.exists(DEFAULT_FOLDER):
+            shutil.rmtree(DEFAULT_FOLDER)
+
+    def test_persist_missing_stocks(self):
+        cache = NegativeCache(self.path, 60)
+        cache.mark_missing("a", self.stock_id)
+
+        reloaded = NegativeCache(self.path, 60)
+        self.assertTrue(reloaded.is_missing("a", self.stock_id))
+        self.assertFalse(reloaded.is_missing("b", self.stock_id))
+        reloaded.forget("a", self.stock_id)
+        self.assertEqual(0, len(NegativeCache(self.path, 60)))
+
+    def test_expire(self):
+        cache = NegativeCache(self.path, 0)
+        cache.mark_missing("a", self.stock_id)
+        self.assertFalse(cache.is_missing("a", self.stock_id))
+
+    def test_skip_missing_stock(self):
+        repository = MockReportRepository(self.source, pd.DataFrame())
+        repository.negative_cache = NegativeCache(self.path, 60)
+        repository.initial_remote_data = MagicMock(wraps=repository.initial_remote_data)
+        rate_limiter = MagicMock()
+
+        self.assertTrue(repository.load_data(self.stock_id, rate_limiter=rate_limiter).empty)
+        self.assertTrue(repository.load_data(self.stock_id, force_remote=True, rate_limiter=rate_limiter).empty)
+
+        self.assertEqual(1, repository.initial_remote_data.call_count)
+        self.assertEqual(1, rate_limiter.acquire.call_count)
+        self.assertFalse(self.source.exist(self.stock_id))
+        self.assertTrue(repository.negative_cache.is_missing(repository.report_type, self.stock_id))
+
+    def test_keep_local_when_remote_is_empty(self):
+        local = pd.DataFrame({"2019-12-31": [1.0]}, index=["x"])
+        self.source.refresh_data(local, self.stock_id)
+        repository = MockReportRepository(self.source, pd.DataFrame())
+        repository.negative_cache = NegativeCache(self.path, 60)
+        repository.negative_cache.mark_missing(repository.report_type, self.stock_id)
+        repository.initial_remote_data = MagicMock(wraps=repository.initial_remote_data)
+
+        for _ in range(2):
+            assert_frame_equal(to_report_date_index(local), repository.load_data(self.stock_id, force_remote=True))
+        self.assertEqual(2, repository.initial_remote_data.call_count)
+        assert_frame_equal(local, self.source.load_data(self.stock_id))
+
+    def test_forget_when_remote_has_data(self):
+        repository = MockReportRepository(self.source, pd.DataFrame({"2019-12-31": [1.0]}, index=["x"]))
+        repository.negative_cache = NegativeCache(self.path, 0)
+        repository.negative_cache.mark_missing(repository.report_type, self.stock_id)
+
+        self.assertFalse(repository.load_data(self.stock_id).empty)
+        self.assertEqual(0, len(repository.negative_cache))
+
+
+class TestReportCache(TestCase):
+    def setUp(self):
+        self.data = pd.DataFrame(np.random.random((10, 10)))
+        self.size = self.data.memory_usage(index=True, deep=True).sum()
+
+    def tearDown(self):
+        if os.path.exists(DEFAULT_FOLDER):
+            shutil.rmtree(DEFAULT_FOLDER)
+
+    def test_hit_and_miss(self):
+        cache = ReportCache(self.size * 2)
+        self.assertIsNone(cache.get(("a", "1")))
+        cache.put(("a", "1"), self.data)
+
+        actual = cache.get(("a", "1"))
+        assert_frame_equal(self.data, actual)
+        self.assertIsNot(self.data, actual)
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_evict_least_recently_used(self):
+        cache = ReportCache(self.size * 2)
+        cache.put("1", self.data)
+        cache.put("2", self.data)
+        cache.get("1")
+        cache.put("3", self.data)
+
+        self.assertIsNone(cache.get("2"))
+        self.assertIsNotNone(cache.get("1"))
+        self.assertIsNotNone(cache.get("3"))
+        self.assertEqual(self.size * 2, cache.current_bytes)
+
+    def test_invalidate_when_refresh(self):
+        source = ReportLocalData(DEFAULT_FOLDER)
+        local = pd.DataFrame({"2019-12-31": [1.0, 2.0]}, index=["x", "y"])
+        source.refresh_data(local, TEST_STOCK_ID)
+        source.load_data = MagicMock(wraps=source.load_data)
+        repository = MockReportRepository(source, local * 2)
+        repository.cache = ReportCache(self.size)
+
+        repository.load_data(TEST_STOCK_ID)
+        repository.load_data(TEST_STOCK_ID)
+        self.assertEqual(1, source.load_data.call_count)
+        self.assertEqual(1, repository.cache.hits)
+
+        repository.load_data(TEST_STOCK_ID, force_remote=True)
+        self.assertEqual(2.0, repository.load_data(TEST_STOCK_ID).iloc[0, 0])
+        self.assertEqual(2, source.load_data.call_count)
+
 
 @patch("tushare.get_stock_basics")
 class TestTuShareStockBasicFetcher(TestCase):
@@ -93,19 +605,110 @@ class TestTuShareStockBasicFetcher(TestCase):
         assert_frame_equal(self.__data.loc[[self.__stock_id]], actual)
 
 
+@patch("tushare.get_stock_basics")
+class TestBasicInfoRepository(TestCase):
+    def setUp(self):
+        self.__data = read_china_total_stock_info()
+
+    def tearDown(self):
+        if os.path.exists(DEFAULT_FOLDER):
+            shutil.rmtree(DEFAULT_FOLDER)
+
+    def test_load_from_remote_without_snapshot(self, remote_method):
+        remote_method.return_value = self.__data
+        remote_method.__name__ = "get_stock_basics"
+        repository = BasicInfoRepository(DEFAULT_FOLDER, ttl_seconds=60)
+
+        assert_frame_equal(self.__data, repository.load_data())
+        self.assertTrue(os.path.exists(DEFAULT_FOLDER + "/greenseer/china_stock_basics.parquet"))
+        remote_method.assert_called_once()
+
+    def test_load_from_fresh_snapshot(self, remote_method):
+        remote_method.return_value = self.__data
+        remote_method.__name__ = "get_stock_basics"
+        BasicInfoRepository(DEFAULT_FOLDER, ttl_seconds=60).load_data()
+        remote_method.reset_mock()
+
+        repository = BasicInfoRepository(DEFAULT_FOLDER, ttl_seconds=60)
+        assert_frame_equal(self.__data, repository.load_data())
+        repository.wait_for_refresh()
+        remote_method.assert_not_called()
+
+    def test_refresh_expired_snapshot_in_background(self, remote_method):
+        remote_method.return_value = self.__data
+        remote_method.__name__ = "get_stock_basics"
+        BasicInfoRepository(DEFAULT_FOLDER, ttl_seconds=60).load_data()
+        remote_method.return_value = self.__data.head(10)
+
+        repository = BasicInfoRepository(DEFAULT_FOLDER, ttl_seconds=0)
+        assert_frame_equal(self.__data, repository.load_data())
+        repository.wait_for_refresh()
+        self.assertEqual(2, remote_method.call_count)
+        self.assertEqual(10, len(repository.load_data()))
+        repository.wait_for_refresh()
+
+
 class NetEaseRemoteFetcherTest(TestCase):
     def setUp(self):
         self.mock_local_source = MagicMock(spec=LocalSource)
-        self.__repository = NetEaseRemoteFetcher("mock_path")
-        self.__original_data = pd.read_csv("data/600096.origin.csv", na_values='--',
-                                           index_col=0)
-
-    @patch("pandas.read_csv")
-    @patch("urllib.request.urlopen")
-    def test_initial_remote_data(self, request_urlopen, pandas_read_csv):
-        request_urlopen.return_value = create_mock_request_urlopen("data/600096.origin.csv")
-        pandas_read_csv.return_value = self.__original_data
-        assert_frame_equal(read_600096_assert_reports(), self.__repository.initial_remote_data("600096"))
+        self.mock_session = MagicMock(spec=RemoteSession)
+        self.__repository = NetEaseRemoteFetcher("mock_path_{}", self.mock_session)
+
+    def test_initial_remote_data(self):
+        expected = read_600096_assert_reports()
+        # the same layout as NetEase, padded cells, "--" for the missing ones and a comma at the end of each row
+        cells = expected.applymap(lambda value: "{:<10}".format("--" if value == 0 else int(value)))
+        lines = [",".join(["报告日期"] + list(expected.columns)) + ","]
+        lines.extend(",".join([item] + list(row)) + "," for item, row in zip(expected.index, cells.values))
+        self.mock_session.get.return_value = "\r\n".join(lines).encode("gb2312")
+
+        actual = self.__repository.initial_remote_data("600096")
+        assert_frame_equal(expected, actual, check_dtype=False, check_names=False)
+        self.assertEqual(np.float64, actual.values.dtype)
+        self.mock_session.get.assert_called_once_with("mock_path_600096")
+
+    def test_broken_remote_data(self):
+        self.mock_session.get.return_value = "报告日期,2018-03-31,2017-12-31,\r\n货币资金(万元),1.5,,\r\n存货(万元),x\r\n" \
+            .encode("gb2312")
+
+        actual = self.__repository.initial_remote_data("600096")
+        expected = pd.DataFrame({"2018-03-31": [1.5, np.nan], "2017-12-31": [0.0, 0.0]},
+                                index=["货币资金(万元)", "存货(万元)"])
+        assert_frame_equal(expected, actual, check_names=False)
+
+    def test_keep_items_and_fill_na_strings(self):
+        self.mock_session.get.return_value = "报告日期, 2018-03-31 ,2017-12-31,\r\n 现金(万元),nan,1\r\n 存货(万元),NA,2,\r\n" \
+            .encode("gb2312")
+
+        actual = self.__repository.initial_remote_data("600096")
+        expected = pd.DataFrame({"2018-03-31": [0.0, 0.0], "2017-12-31": [1.0, 2.0]},
+                                index=[" 现金(万元)", " 存货(万元)"])
+        assert_frame_equal(expected, actual, check_names=False)
+
+    def test_empty_remote_data(self):
+        self.mock_session.get.return_value = b""
+        self.assertTrue(self.__repository.initial_remote_data("600096").empty)
+
+    def test_html_remote_data(self):
+        self.mock_session.get.return_value = b"<html>\n<body>server is busy</body>\n</html>"
+        self.assertRaises(ValueError, parse_net_ease_report, self.mock_session.get.return_value)
+        self.assertTrue(self.__repository.initial_remote_data("600096").empty)
+
+    def test_share_global_session(self):
+        self.assertIs(get_global_remote_session(), NetEaseRemoteFetcher("mock_path").session)
+        self.assertIs(NetEaseRemoteFetcher("a").session, NetEaseRemoteFetcher("b").session)
+
+
+class RemoteSessionTest(TestCase):
+
+    @patch("requests.Session.get")
+    def test_get_with_timeout(self, session_get):
+        session_get.return_value.content = b"content"
+        session = RemoteSession(timeout=3)
+
+        self.assertEqual(b"content", session.get("http://mock"))
+        session_get.assert_called_once_with("http://mock", timeout=3)
+        session_get.return_value.raise_for_status.assert_called_once()
 
 
 if __name__ == '__main__':
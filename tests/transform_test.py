@@ -20,10 +20,12 @@ import pandas as pd
 from pandas.testing import assert_frame_equal
 
 from greenseer.dataset.china_dataset import CODE_INDEX_NAME, RELEASE_AT_INDEX_NAME
-from greenseer.preprocessing.clean_data import RemoveAbnormalFilter
+from greenseer.preprocessing.clean_data import RemoveAbnormalFilter, GroupRemoveAbnormalFilter
+from greenseer.preprocessing.feature_expression import FeatureExpressionTransformer
 from greenseer.preprocessing.transformers import regular_expression_index_filter, pick_annual_report_china, \
     regular_expression_column_filter, sum_column_transform, percent_column_transform, re_sum_column_transform, \
     re_percent_column_transform, pick_row_by_index_month, unstack_release_at, MeanDistanceTransformer
+from greenseer.utils.quantile_sketch import QuantileSketch
 
 
 class TimeSeriesFilterTest(unittest.TestCase):
@@ -87,6 +89,19 @@ class RegularExpressionIndexFilterTest(unittest.TestCase):
         assert_frame_equal(expected, transformer.transform(data))
         self.assertEqual(True, True)
 
+    def test_level_and_cache(self):
+        from greenseer.preprocessing.transformers import _resolve_labels
+        index = pd.MultiIndex.from_product([["600096", "000001", "300001"], pd.date_range("20200331", periods=2,
+                                                                                            freq="Q")])
+        data = pd.DataFrame({"x": np.arange(6)}, index=index)
+        transformer = regular_expression_index_filter(pattern=r'[36]0', level=0)
+
+        expected = data.loc[["600096", "300001"]].sort_index(level=0, ascending=False)
+        assert_frame_equal(expected, transformer.transform(data))
+        hits = _resolve_labels.cache_info().hits
+        assert_frame_equal(expected, transformer.transform(data.copy()))
+        self.assertEqual(hits + 1, _resolve_labels.cache_info().hits)
+
 
 class RegularExpressionColumnFilterTest(unittest.TestCase):
     def test_basic_case(self):
@@ -125,6 +140,47 @@ class ReExpressionColumnPercentTest(unittest.TestCase):
         self.assertEqual(True, True)
 
 
+class FeatureExpressionTransformerTest(unittest.TestCase):
+    def test_same_as_column_transforms(self):
+        data = pd.DataFrame({"我爱钱": [1, 2, np.nan], "我喜欢古董": [4, 5, 6], "我恨 没钱": [7, 0, 9]},
+                            index=["a", "b", "c"])
+        expected = re_sum_column_transform(new_name="sum", patterns=[r'我爱', r'我喜欢']).transform(data.copy())
+        expected["percent"] = expected["sum"] / expected["我恨 没钱"]
+        expected["scaled"] = -expected["我恨 没钱"] * 2 + 1
+
+        transformer = FeatureExpressionTransformer({"sum": "match('我爱', '我喜欢')",
+                                                    "percent": "(我喜欢古董 + 我爱钱) / `我恨 没钱`",
+                                                    "scaled": "1 - 2 * `我恨 没钱`"})
+        assert_frame_equal(expected, transformer.fit_transform(data.copy()), check_dtype=False)
+        assert_frame_equal(expected, transformer.transform(data.copy()), check_dtype=False)
+
+    def test_negative_keeps_na(self):
+        data = pd.DataFrame({"x": [1.0, np.nan], "y": [2.0, 3.0]}, index=["a", "b"])
+        transformer = FeatureExpressionTransformer({"negative": "-x", "scaled": "-2 * x", "same": "+x"})
+
+        actual = transformer.fit_transform(data.copy())
+        np.testing.assert_array_equal([-1.0, np.nan], actual["negative"])
+        np.testing.assert_array_equal([-2.0, np.nan], actual["scaled"])
+        np.testing.assert_array_equal([1.0, np.nan], actual["same"])
+
+    def test_wrong_expression(self):
+        with self.assertRaises(ValueError):
+            FeatureExpressionTransformer({"x": "a ** 2"})
+        with self.assertRaises(ValueError):
+            FeatureExpressionTransformer({"x": "open('a')"})
+        with self.assertRaises(KeyError):
+            FeatureExpressionTransformer({"x": "y + z"}).transform(pd.DataFrame({"y": [1]}))
+
+    def test_duplicated_columns(self):
+        data = pd.DataFrame([[1, 10, 100, 1000]], columns=["a", "a", "b", "c"])
+        actual = FeatureExpressionTransformer({"x": "b + c", "c": "b * 2"}).transform(data)
+        expected = pd.DataFrame([[1, 10, 100, 200, 1100]], columns=["a", "a", "b", "c", "x"])
+        assert_frame_equal(expected, actual, check_dtype=False)
+
+        with self.assertRaises(ValueError):
+            FeatureExpressionTransformer({"x": "a + b"}).transform(data)
+
+
 class SumColumnTransformerTest(unittest.TestCase):
     def test_basic_case(self):
         data = pd.DataFrame({"x": [1, 2, 3], "y": [4, 5, 6], "z": [7, 8, 9]}, index=["a", "b", "c"])
@@ -165,13 +221,31 @@ class UnstackReleaseAtTest(unittest.TestCase):
         expected = pd.DataFrame(
             [np.arange(0, 5), np.arange(5, 10)],
             columns=pd.date_range("20200622", periods=5, freq="Q"),
-            index=["a", "b"]
+            index=pd.Index(["a", "b"], name=CODE_INDEX_NAME)
         )
         expected.columns.names = [RELEASE_AT_INDEX_NAME]
         transform = unstack_release_at(start="2020-06-30", end="2021-06-30", column_name="x")
         actual = transform.transform(data)
         assert_frame_equal(expected, actual, check_dtype=False)
 
+    def test_unstack_fill_value(self):
+        index = pd.MultiIndex.from_tuples(
+            [("a", pd.Timestamp("2020-06-30")), ("a", pd.Timestamp("2020-09-30")), ("b", pd.Timestamp("2020-09-30")),
+             ("c", pd.Timestamp("2020-06-30")), ("c", pd.Timestamp("2020-09-30"))],
+            names=[CODE_INDEX_NAME, RELEASE_AT_INDEX_NAME])
+        data = pd.DataFrame({"x": [1, 2, 3, np.nan, 5]}, index=index)
+        expected = pd.DataFrame(
+            [[1, 2], [0, 3]],
+            columns=pd.DatetimeIndex(["2020-06-30", "2020-09-30"], name=RELEASE_AT_INDEX_NAME),
+            index=pd.Index(["a", "b"], name=CODE_INDEX_NAME)
+        )
+        transform = unstack_release_at(start="2020-06-30", end="2020-09-30", column_name="x", fill_value=0)
+        assert_frame_equal(expected, transform.transform(data), check_dtype=False)
+
+        kept = unstack_release_at(start="2020-06-30", end="2020-09-30", column_name="x", drop_if_contain_na=False)
+        self.assertEqual(["a", "b", "c"], list(kept.transform(data).index))
+        self.assertTrue(np.isnan(kept.transform(data).loc["b", pd.Timestamp("2020-06-30")]))
+
 
 class CleanDataTest(unittest.TestCase):
     def test_remove_abnormal_filter_both(self):
@@ -198,6 +272,48 @@ class CleanDataTest(unittest.TestCase):
         actual = test_filter.fit_transform(data)
         self.assertEqual(shape, actual.shape)
 
+    def test_remove_abnormal_filter_partial_fit(self):
+        data = pd.DataFrame({"x": np.random.random(10000), "y": np.random.random(10000)})
+        data.iloc[[10, 5000], 1] = [100, -1]
+        test_filter = RemoveAbnormalFilter(["x", "y"], quantile=0.99, mode='both')
+        for start in range(0, 10000, 1000):
+            test_filter.partial_fit(data.iloc[start:start + 1000])
+
+        expected = RemoveAbnormalFilter(["x", "y"], quantile=0.99, mode='both').fit(data)
+        np.testing.assert_allclose(expected._high, test_filter._high, atol=0.01)
+        np.testing.assert_allclose(expected._low, test_filter._low, atol=0.01)
+        actual = test_filter.transform(data)
+        self.assertNotIn(10, actual.index)
+        self.assertNotIn(5000, actual.index)
+        self.assertAlmostEqual(len(data) * 0.98, len(actual), delta=50)
+
+    def test_sketch_keeps_min_and_max(self):
+        values = np.random.RandomState(7).lognormal(size=100000)
+        sketch = QuantileSketch()
+        for chunk in np.array_split(values, 10):
+            sketch.update(chunk)
+        np.testing.assert_array_equal([values.min(), values.max()], sketch.quantile([0, 1]))
+
+        data = pd.DataFrame({"x": values})
+        for mode in ["low", "high"]:
+            test_filter = RemoveAbnormalFilter(["x"], quantile=0.99, mode=mode, approximate=True)
+            actual = test_filter.fit_transform(data)
+            # the bound at 0 or 1 keeps the extreme row of that side
+            self.assertIn(values.argmax() if mode == "low" else values.argmin(), actual.index)
+
+    def test_group_remove_abnormal_filter(self):
+        data = pd.DataFrame({"x": np.concatenate([np.arange(100), np.arange(100) * 100]),
+                             "group": ["a"] * 100 + ["b"] * 100})
+        data = pd.concat([data, pd.DataFrame({"x": [1000, 1000], "group": ["a", "c"]})], ignore_index=True)
+        for approximate in [False, True]:
+            test_filter = GroupRemoveAbnormalFilter("group", ["x"], quantile=0.99, approximate=approximate)
+            actual = test_filter.fit(data.iloc[:-1]).transform(data)
+            # 1000 is abnormal in group a but not in group b, and group c isn't fitted
+            self.assertNotIn(200, actual.index)
+            self.assertIn(201, actual.index)
+            self.assertIn(150, actual.index)
+            self.assertEqual(200, len(actual))
+
 
 class MeanDistanceTransformerTest(unittest.TestCase):
 
@@ -211,6 +327,50 @@ class MeanDistanceTransformerTest(unittest.TestCase):
         actual = transformer.fit_transform(data)
         assert_frame_equal(expected, actual, check_dtype=False)
 
+    def test_partial_fit_in_chunks(self):
+        random = np.random.RandomState(42)
+        data = pd.DataFrame({"x": random.random_sample(50), "y": random.random_sample(50),
+                             "z": random.choice(["a", "b", "c"], 50)})
+        expected = MeanDistanceTransformer(group_by="z", columns=["x", "y"], metric="mahalanobis").fit_transform(
+            data.copy())
+
+        transformer = MeanDistanceTransformer(group_by="z", columns=["x", "y"], metric="mahalanobis", chunk_size=7)
+        for start in range(0, 50, 20):
+            transformer.partial_fit(data.iloc[start:start + 20])
+        actual = pd.concat(transformer.iter_transform([data.iloc[:25].copy(), data.iloc[25:].copy()]))
+        assert_frame_equal(expected, actual)
+
+        # the covariance is pooled of the residuals to the center of each group
+        residual = (data[["x", "y"]] - data.groupby("z")[["x", "y"]].transform("mean")).to_numpy()
+        inverse_covariance = np.linalg.pinv(residual.T @ residual / (len(data) - 3))
+        distances = np.sqrt(np.sum(residual @ inverse_covariance * residual, axis=1))
+        np.testing.assert_allclose(distances, actual["distance"])
+
+    def test_cosine_and_unknown_group(self):
+        train = pd.DataFrame({"x": [1, 3, 0], "y": [1, 1, 2], "z": ["a", "a", "b"]})
+        test = pd.DataFrame({"x": [4, 1, 5], "y": [2, 0, 5], "z": ["a", "b", "c"]})
+        actual = MeanDistanceTransformer(group_by="z", columns=["x", "y"], metric="cosine").fit(train).transform(test)
+        np.testing.assert_allclose([0, 1, np.nan], actual["distance"], atol=1e-12)
+
+        with self.assertRaises(ValueError):
+            MeanDistanceTransformer(group_by="z", columns=["x", "y"], metric="manhattan").fit(train)
+        for chunk_size in [0, -1]:
+            with self.assertRaises(ValueError):
+                MeanDistanceTransformer(group_by="z", columns=["x", "y"], chunk_size=chunk_size).fit(train)
+
+    def test_rows_without_group_are_not_fitted(self):
+        random = np.random.RandomState(7)
+        data = pd.DataFrame({"x": random.random_sample(30), "y": random.random_sample(30),
+                             "z": random.choice(["a", "b"], 30)})
+        no_group = pd.DataFrame({"x": [100.0, -50.0], "y": [80.0, 30.0], "z": [np.nan, None]})
+        expected = MeanDistanceTransformer(group_by="z", columns=["x", "y"], metric="mahalanobis").fit_transform(
+            data.copy())
+
+        transformer = MeanDistanceTransformer(group_by="z", columns=["x", "y"], metric="mahalanobis")
+        actual = transformer.fit_transform(pd.concat([data, no_group], ignore_index=True))
+        np.testing.assert_allclose(expected["distance"], actual["distance"].iloc[:30])
+        self.assertTrue(actual["distance"].iloc[30:].isna().all())
+
 
 def calculate_distance(mean: pd.DataFrame):
     def calculate(row: pd.Series):